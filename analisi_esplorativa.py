@@ -2,13 +2,86 @@
 import streamlit as st
 import polars as pl
 import pandas as pd
+import altair as alt
 
 from classe_Grafici import Grafici
+from correlazioni import carica_correlazioni
+from cubo import aggrega, conta_droghe_per, eta_media
+from esploratore import esploratore_dataset
+from memo import memoizza
+from preprocessing import versione_dataset
+from serie_temporali import GRANULARITA, STAGIONALITA, TOTALE, carica_serie, in_tabella
 
 
-def analisi_esplorativa(dati, colonne_droga):
+@memoizza(maxsize = 16)
+def genera_grafici(morti_droga_genere):
+    """
+    funzione fatta salvare in cache i dati creati così da non dover fare ricaricare la pagiona a streamlit quando togglo l'etnia che voglio
+    (la chiave è l'impronta dei conteggi, quindi cambiando il filtro globale i grafici vengono rifatti)
+    """
+    # creazione di tre subset separati
+    morti_black = morti_droga_genere.filter(pl.col("Race") == 'Black')
+    morti_white = morti_droga_genere.filter(pl.col("Race") == 'White')
+    morti_other = morti_droga_genere.filter(pl.col("Race") == 'Other')
+
+    # Creazione dei grafici
+    grafico_black = Grafici.crea_grafico_barre(morti_black, "Droga", "Conteggio", color_col="Conteggio",
+                                               sort = "-y",show_legend = False, title="Black - Droghe più prevalenti",
+                                               width = 500, height = 400, label_angle = -90)
+
+    grafico_white = Grafici.crea_grafico_barre(morti_white, "Droga", "Conteggio", color_col="Conteggio",
+                                               sort="-y", title="White - Droghe più prevalenti",show_legend = False,
+                                               width = 500, height = 400, label_angle = -90)
+
+    grafico_other = Grafici.crea_grafico_barre(morti_other, "Droga", "Conteggio", color_col="Conteggio",
+                                               sort="-y", title="Other - Droghe più prevalenti", show_legend = False,
+                                               width = 500, height = 400, label_angle = -90)
+
+    # Restituzione di un dizionario di grafici già pronti, a cui dovro accederci dopo
+    return {
+        "Black": grafico_black,
+        "White": grafico_white,
+        "Other": grafico_other
+    }
+
+
+@memoizza(maxsize = 16)
+def genera_grafici_location(dat):
+    """
+    grafici delle droghe per categoria del luogo di decesso, in cache per impronta dei conteggi
+    """
+    home = dat.filter(pl.col("Location") == 'Home')
+    hospital = dat.filter(pl.col("Location") == 'Hospital')
+    other = dat.filter(pl.col("Location") == 'Other')
+
+    # Creazione dei grafici con la classe Grafici
+    grafico_home = Grafici.crea_grafico_barre(home, "Droga", "Conteggio",
+                                              color_col="Conteggio", horizontal=True,
+                                              sort="-x", title="Home - Droghe più prevalenti",
+                                              width = 700, height =400, show_legend = False)
+
+    grafico_hospital = Grafici.crea_grafico_barre(hospital, "Droga", "Conteggio",
+                                                  color_col="Conteggio", horizontal=True,
+                                                  sort="-x", title="Hospital - Droghe più prevalenti",
+                                                  width = 700, height =400, show_legend = False)
+
+    grafico_other = Grafici.crea_grafico_barre(other, "Droga", "Conteggio",
+                                               color_col="Conteggio", horizontal=True,
+                                               sort="-x", title="Other - Droghe più prevalenti",
+                                               width=500, height=400, show_legend = False)
+
+    return {
+        "Home": grafico_home,
+        "Hospital": grafico_hospital,
+        "Other": grafico_other
+    }
+
+
+def analisi_esplorativa(dati, colonne_droga, cubi, filtro = ()):
     """
     Analisi esplorativa del dataset. Completo di descrizione e grafici ad accompagnamento.
+    cubi sono i cubi materializzati delle morti (vedi cubo.py), da cui si ricavano i conteggi dei grafici;
+    dati e cubi sono già ristretti al filtro globale, la cui chiave (filtro) serve alle letture dal dataset partizionato
     """
     st.header("🔍 Analisi esplorativa del dataset")
     st.markdown("""
@@ -24,11 +97,17 @@ def analisi_esplorativa(dati, colonne_droga):
     # selectbox per mostrare/nascondere il dataset
     st.header("Dataset")
     st.write("Di seguito è possibile visualizzare il dataset completo, pulito e messo in ordine, usato per l'analisi.")
-    mostra_dataset = st.selectbox("Vuoi visualizzare il dataset completo?", ["No", "Sì"])
-    if mostra_dataset == "Sì":
-        st.dataframe(dati)
-    else:
-        st.warning("Dataset nascosto. Scegliere *Si* dalla tendina per visualizzarlo.")
+    # blocco interattivo isolato in un fragment: i suoi widget rieseguono solo questo blocco
+    @st.fragment
+    def sezione_dataset():
+        mostra_dataset = st.selectbox("Vuoi visualizzare il dataset completo?", ["No", "Sì"])
+        if mostra_dataset == "Sì":
+            # i dati restano sul server: al browser arriva solo la pagina visibile (vedi esploratore.py)
+            esploratore_dataset(filtro)
+        else:
+            st.warning("Dataset nascosto. Scegliere *Si* dalla tendina per visualizzarlo.")
+
+    sezione_dataset()
     st.write("---")
 
 
@@ -42,35 +121,12 @@ def analisi_esplorativa(dati, colonne_droga):
 
 
 
-    # funzinone che userò di seguito per categorizzare le età
-    def categorizza_età(età):
-        if 19 >= età >= 0:
-            return '19-'
-        elif 25 >= età >= 20:
-            return '20-25'
-        elif 30 >= età >= 26:
-            return '26-30'
-        elif 35 >= età >= 31:
-            return '31-35'
-        elif 40 >= età >= 36:
-            return '36-40'
-        elif 45 >= età >= 41:
-            return '41-45'
-        elif 50 >= età >= 46:
-            return '46-50'
-        elif 55 >= età >= 51:
-            return '51-55'
-        elif 60 >= età >= 56:
-            return '56-60'
-        elif 65 >= età >= 61:
-            return '61-65'
-        else:
-            return '65+'
-
-    # faccio con pandas che ha la funzione apply che è più diretta
-    cat_età = dati.get_column('Age').to_pandas().apply(categorizza_età)
-    morti_cat_età = cat_età.value_counts().reset_index()
-    morti_cat_età.columns = ['Categoria Età', 'Morti totali']
+    # la fascia d'età (AgeBand) è già calcolata in fase di caricamento, basta arrotolare il cubo
+    morti_cat_età = (
+        aggrega(cubi, ["AgeBand"])
+        .rename({"AgeBand": "Categoria Età"})
+        .sort("Morti totali", descending = True)
+    )
 
     morti_età = (
         dati
@@ -147,9 +203,7 @@ def analisi_esplorativa(dati, colonne_droga):
 
     # Distribuzione per sesso
     morti_sesso = (
-        dati
-        .group_by("Sex")
-        .agg(pl.count().alias("Morti totali"))
+        aggrega(cubi, ["Sex"])
         .filter(pl.col("Sex").is_in(["Male", "Female"]))
     )
 
@@ -180,10 +234,8 @@ def analisi_esplorativa(dati, colonne_droga):
 
     # DISTRIBUZIONE PER etnia
     morti_razza = (
-        dati
+        aggrega(cubi, ["Race"])
         .filter(pl.col("Race") != "Unknown")
-        .group_by("Race")
-        .agg(pl.count().alias("Morti totali"))
         .sort("Morti totali", descending = True)
     )
 
@@ -231,18 +283,16 @@ def analisi_esplorativa(dati, colonne_droga):
     # Analisi Temporale e Bivariata
     st.subheader("📆🔗 Analisi Bivariata e Temporale")
 
-    # morti totali per anno
+    # morti totali per anno (roll-up del cubo invece che group_by sul dataset completo)
     totale_per_anno = (
-        dati
-        .group_by("Year")
-        .agg(pl.count().alias("Totale_Anno"))
+        aggrega(cubi, ["Year"])
+        .rename({"Morti totali": "Totale_Anno"})
     )
     # morti totali annuali per sesso
     morti_annuali_sesso = (
-        dati
+        aggrega(cubi, ["Year", "Sex"])
         .filter(pl.col("Sex").is_in(["Male", "Female"]))
-        .group_by(["Year", "Sex"])
-        .agg(pl.count().alias("Morti"))
+        .rename({"Morti totali": "Morti"})
         .join(totale_per_anno, on="Year") # equivalente al metodo concat di panda
         .with_columns(
             (pl.col("Morti") / pl.col("Totale_Anno") * 100).round(2).alias("Percentuale")
@@ -268,16 +318,16 @@ def analisi_esplorativa(dati, colonne_droga):
 
     # morti mensili per sesso
     morti_mese = (
-        dati.filter(pl.col("Sex").is_in(["Male", "Female"]))
-        .group_by(["Month", "Sex"])
-        .agg(pl.count().alias("Conteggio"))
+        aggrega(cubi, ["Month", "Sex"])
+        .filter(pl.col("Sex").is_in(["Male", "Female"]))
+        .rename({"Morti totali": "Conteggio"})
     )
 
     # morti per giorno della settimaan
     morti_giorno = (
-        dati.filter(pl.col("Sex").is_in(["Male", "Female"]))
-        .group_by(["DayOfWeek", "Sex"])
-        .agg(pl.count().alias("Conteggio"))
+        aggrega(cubi, ["DayOfWeek", "Sex"])
+        .filter(pl.col("Sex").is_in(["Male", "Female"]))
+        .rename({"Morti totali": "Conteggio"})
     )
 
     # grafico morti mensili
@@ -324,6 +374,59 @@ def analisi_esplorativa(dati, colonne_droga):
         Per le donne, i decessi sono più distribuiti, ma con valori più alti la Domenica (468) e il Sabato (457). Questi dati potrebbero indicare un'associazione tra le morti durante i fine settimana e comportamenti che aumentano l'esposizione ai rischi della droga.
     """)
 
+    # serie temporali giornaliere: tutte le viste vengono ricavate dalla stessa matrice dei conteggi (vedi serie_temporali.py)
+    st.write("""
+        Le viste seguenti partono dai conteggi giornalieri delle morti (totali, per sesso e per droga) e permettono di
+        osservare l'andamento con medie mobili, variazioni rispetto all'anno precedente, profili stagionali e curve cumulate.
+    """)
+    serie_giornaliere = carica_serie(dati, tuple(colonne_droga))
+
+    @st.fragment
+    def sezione_serie_temporali():
+        col1, col2, col3 = st.columns([1, 1, 2])
+        with col1:
+            vista = st.selectbox("Vista temporale:", ["Conteggi", "Media mobile", "Variazione annua", "Profilo stagionale", "Cumulata", "Cumulata per anno"])
+        with col2:
+            if vista == "Profilo stagionale":
+                stagionalita = st.selectbox("Stagionalità:", STAGIONALITA)
+            elif vista == "Variazione annua":
+                granularita = st.selectbox("Granularità:", GRANULARITA[2:]) # per mese, trimestre o anno il confronto è esatto
+            else:
+                granularita = st.selectbox("Granularità:", GRANULARITA, index = 2)
+        with col3:
+            serie = st.multiselect("Serie:", serie_giornaliere.nomi, default = [TOTALE])
+        if not serie:
+            st.warning("Selezionare almeno una serie.")
+            return
+
+        asse_x, titolo_y = alt.X("Data:T", title = "Data"), "Morti"
+        if vista == "Conteggi":
+            risultato = serie_giornaliere.ricampiona(granularita, serie)
+        elif vista == "Media mobile":
+            finestra = st.slider("Ampiezza della finestra (periodi):", min_value = 2, max_value = 60, value = 7)
+            risultato = serie_giornaliere.media_mobile(finestra, granularita, serie)
+            titolo_y = f"Media mobile su {finestra} periodi"
+        elif vista == "Variazione annua":
+            risultato = serie_giornaliere.variazione_annua(granularita, serie)
+            titolo_y = "Variazione sull'anno precedente (%)"
+        elif vista == "Profilo stagionale":
+            risultato = serie_giornaliere.profilo_stagionale(stagionalita, serie)
+            asse_x, titolo_y = alt.X("Data:O", title = stagionalita.capitalize()), "Morti medie al giorno"
+        else:
+            risultato = serie_giornaliere.cumulata(granularita, serie, per_anno = vista == "Cumulata per anno")
+            titolo_y = "Morti cumulate"
+
+        tabella = in_tabella(*risultato).drop_nans()
+        grafico = alt.Chart(tabella).mark_line().encode(
+            x = asse_x,
+            y = alt.Y("Valore:Q", title = titolo_y),
+            color = alt.Color("Serie:N", title = "Serie"),
+            tooltip = ["Data", "Serie", alt.Tooltip("Valore:Q", format = ".2f")]
+        ).properties(height = 400, title = f"{vista} delle morti")
+        st.altair_chart(grafico, use_container_width = True)
+
+    sezione_serie_temporali()
+
     # morti per sesso e età
     morti_eta_sesso = (
         dati
@@ -344,41 +447,10 @@ def analisi_esplorativa(dati, colonne_droga):
 
 
     # Aggregazione dei dati per età media rispetto ad anno, mese e giorno della settimana
-    morti_em_anno = (
-        dati
-        .group_by("Year")
-        .agg([
-            pl.col("Age").mean().alias("Totale"),
-            pl.when(pl.col("Sex") == "Male").then(pl.col("Age")).mean().alias("Maschi"),
-            pl.when(pl.col("Sex") == "Female").then(pl.col("Age")).mean().alias("Femmine")
-        ])
-        .melt(id_vars="Year", variable_name="Categoria", value_name="Età Media")
-        .sort("Year")
-    )
-
-    morti_em_mese = (
-        dati
-        .group_by("Month")
-        .agg([
-            pl.col("Age").mean().alias("Totale"),
-            pl.when(pl.col("Sex") == "Male").then(pl.col("Age")).mean().alias("Maschi"),
-            pl.when(pl.col("Sex") == "Female").then(pl.col("Age")).mean().alias("Femmine")
-        ])
-        .melt(id_vars="Month", variable_name="Categoria", value_name="Età Media")
-        .sort("Month")
-    )
-
-    morti_em_giorno = (
-        dati
-        .group_by("DayOfWeek")
-        .agg([
-            pl.col("Age").mean().alias("Totale"),
-            pl.when(pl.col("Sex") == "Male").then(pl.col("Age")).mean().alias("Maschi"),
-            pl.when(pl.col("Sex") == "Female").then(pl.col("Age")).mean().alias("Femmine")
-        ])
-        .melt(id_vars="DayOfWeek", variable_name="Categoria", value_name="Età Media")
-        .sort("DayOfWeek")
-    )
+    # (dai cubi: somma delle età / numero di morti)
+    morti_em_anno = eta_media(cubi, ["Year"]).sort("Year")
+    morti_em_mese = eta_media(cubi, ["Month"]).sort("Month")
+    morti_em_giorno = eta_media(cubi, ["DayOfWeek"]).sort("DayOfWeek")
 
 
     # creazione dei grafici usando il metodo crea_grafico_linea
@@ -457,45 +529,45 @@ def analisi_esplorativa(dati, colonne_droga):
                 """)
 
 
-    # coinvolgimento per tipo di droga
+    # coinvolgimento per tipo di droga (il cubo ha già il numero di morti per droga)
     dati_morti_droga = (
-        dati
-        .select(["Year"] + colonne_droga)
-        .group_by("Year")
-        .agg([
-            pl.sum(droga).alias(droga) for droga in colonne_droga
-        ])
+        aggrega(cubi, ["Year"], colonne_droga)
         .melt(id_vars=["Year"], variable_name="Droga", value_name="Morti") # equivale a un pivot della tabella
         .filter(pl.col("Morti") > 0)  # filtro per droghe con almeno un decesso
     )
 
-    # Opzioni di visualizzazione
-    opzioni_droga = ["Tutte le droghe"] + colonne_droga
-    scelta_droga = st.selectbox("Seleziona una droga da visualizzare:", opzioni_droga)
-
-    if scelta_droga == "Tutte le droghe":
-        dati_visualizzati = dati_morti_droga.to_pandas()
-        titolo = "Sviluppo temporale delle morti per tutte le droghe"
-        color_col = "Droga"
-    else:
-        dati_visualizzati = dati_morti_droga.filter(pl.col("Droga") == scelta_droga).to_pandas()
-        titolo = f"Sviluppo temporale delle morti per {scelta_droga}"
-        color_col = scelta_droga  # Colore fisso per singola droga
-
-    # creazione del grafico
-    grafico_morti_droga = Grafici.crea_grafico_linea(
-        dat=dati_visualizzati,
-        x_col="Year",
-        y_col="Morti",
-        color_col="Droga" if scelta_droga == "Tutte le droghe" else color_col,
-        title=titolo,
-        width=900,
-        height=500,
-        label_angle=-45
-    )
+    # cambiare droga riesegue solo questo grafico (fragment)
+    @st.fragment
+    def sezione_droghe_anno():
+        # Opzioni di visualizzazione
+        opzioni_droga = ["Tutte le droghe"] + colonne_droga
+        scelta_droga = st.selectbox("Seleziona una droga da visualizzare:", opzioni_droga)
+
+        if scelta_droga == "Tutte le droghe":
+            dati_visualizzati = dati_morti_droga.to_pandas()
+            titolo = "Sviluppo temporale delle morti per tutte le droghe"
+            color_col = "Droga"
+        else:
+            dati_visualizzati = dati_morti_droga.filter(pl.col("Droga") == scelta_droga).to_pandas()
+            titolo = f"Sviluppo temporale delle morti per {scelta_droga}"
+            color_col = scelta_droga  # Colore fisso per singola droga
 
-    # stampa deel grafico
-    st.altair_chart(grafico_morti_droga, use_container_width =True)
+        # creazione del grafico
+        grafico_morti_droga = Grafici.crea_grafico_linea(
+            dat=dati_visualizzati,
+            x_col="Year",
+            y_col="Morti",
+            color_col="Droga" if scelta_droga == "Tutte le droghe" else color_col,
+            title=titolo,
+            width=900,
+            height=500,
+            label_angle=-45
+        )
+
+        # stampa deel grafico
+        st.altair_chart(grafico_morti_droga, use_container_width =True)
+
+    sezione_droghe_anno()
 
     st.write("""
     L'analisi del coinvolgimento delle droghe nei decessi offre una prospettiva sui cambiamenti e le tendenze sul consumo/abuso di queste. 
@@ -561,35 +633,13 @@ def analisi_esplorativa(dati, colonne_droga):
     """
     Distribuzione droghe per genere:
     devo prima effettuare un conteggio del coinvolgimento delle droghe, salvate in modo binario (1 = droga usata e 0 = altrimenti)
+    (un solo group_by sul cubo per tutte le droghe, vedi conta_droghe_per)
     """
-    risultati = [] # lista vuota che conterrà i valori del conteggio della droga per maschi e femmina
-    for droga in colonne_droga:
-        maschi = (
-            dati.filter(
-                (pl.col(droga) == 1) & (pl.col("Sex") == "Male")
-            ).height # height equivale al numero di righe della tabella creata ( = n_gruppo)
-        )
-
-        femmine = (
-            dati.filter(
-                (pl.col(droga) == 1) & (pl.col("Sex") == "Female")
-            ).height
-        )
-
-        risultati.append({
-            "Droga": droga,
-            "Sesso": "Male",
-            "Conteggio": maschi
-        })
-
-        risultati.append({
-            "Droga": droga,
-            "Sesso": "Female",
-            "Conteggio": femmine
-        })
-
-    # trasformazione in dataframe plars
-    morti_droga_genere = pl.DataFrame(risultati)
+    morti_droga_genere = (
+        conta_droghe_per(cubi, "Sex", colonne_droga)
+        .filter(pl.col("Sex").is_in(["Male", "Female"]))
+        .rename({"Sex": "Sesso"})
+    )
 
     # non mi andava bene il modo in cui venivano stampate i grafici a barre affiancati,
     # qundi opto per due grafici che riporteranno le info per ogni sesso
@@ -655,58 +705,14 @@ def analisi_esplorativa(dati, colonne_droga):
         Distribuzione droghe per razza:
         devo prima effettuare un conteggio del coinvolgimento delle droghe, salvate in modo binario (1 = droga usata e 0 = altrimenti)
     """
-    risultati = []  # lista vuota che conterrà i valori per razze
-    for droga in colonne_droga:
-        black = (
-            dati.filter((pl.col(droga) == 1) & (pl.col("Race") == "Black")).height
-        )
-
-        white = (
-            dati.filter((pl.col(droga) == 1) & (pl.col("Race") == "White")).height
-        )
-
-        # tutti i valori di race che non sono in Black o White
-        altri = (
-            dati.filter((pl.col(droga) == 1) & (~pl.col("Race").is_in(["Black", "White"]))).height
-        )
-
-        # Aggiunta dei risultati con valori coerenti
-        risultati.append({"Droga": droga, "Race": "Black", "Conteggio": black})
-        risultati.append({"Droga": droga, "Race": "White", "Conteggio": white})
-        risultati.append({"Droga": droga, "Race": "Other", "Conteggio": altri})
-
-    # Conversione in DataFrame polars
-    morti_droga_genere = pl.DataFrame(risultati)
-
-    @st.cache_data
-    def genera_grafici(_morti_droga_genere):
-        """
-        funzione fatta salvare in cache i dati creati così da non dover fare ricaricare la pagiona a streamlit quando togglo l'etnia che voglio
-        """
-        # creazione di tre subset separati
-        morti_black = morti_droga_genere.filter(pl.col("Race") == 'Black')
-        morti_white = morti_droga_genere.filter(pl.col("Race") == 'White')
-        morti_other = morti_droga_genere.filter(pl.col("Race") == 'Other')
-
-        # Creazione dei grafici
-        grafico_black = Grafici.crea_grafico_barre(morti_black, "Droga", "Conteggio", color_col="Conteggio",
-                                                   sort = "-y",show_legend = False, title="Black - Droghe più prevalenti",
-                                                   width = 500, height = 400, label_angle = -90)
-
-        grafico_white = Grafici.crea_grafico_barre(morti_white, "Droga", "Conteggio", color_col="Conteggio",
-                                                   sort="-y", title="White - Droghe più prevalenti",show_legend = False,
-                                                   width = 500, height = 400, label_angle = -90)
-
-        grafico_other = Grafici.crea_grafico_barre(morti_other, "Droga", "Conteggio", color_col="Conteggio",
-                                                   sort="-y", title="Other - Droghe più prevalenti", show_legend = False,
-                                                   width = 500, height = 400, label_angle = -90)
-
-        # Restituzione di un dizionario di grafici già pronti, a cui dovro accederci dopo
-        return {
-            "Black": grafico_black,
-            "White": grafico_white,
-            "Other": grafico_other
-        }
+    # tutti i valori di race che non sono in Black o White finiscono in Other
+    razza = (
+        pl.when(pl.col("Race").is_in(["Black", "White"]))
+        .then(pl.col("Race").cast(pl.Utf8))
+        .otherwise(pl.lit("Other"))
+        .alias("Race")
+    )
+    morti_droga_genere = conta_droghe_per(cubi, razza, colonne_droga)
 
     # Generazione e salvataggio dei grafici in un avariabile
     grafici = genera_grafici(morti_droga_genere)
@@ -736,65 +742,14 @@ def analisi_esplorativa(dati, colonne_droga):
 
 
     ### STAMPA DEI LUOGHI DI DECESSO
-    risultati_location = []  # lista vuota per salvare i risultati
-
-    dati = dati.with_columns(
-        pl.col("Location").str.to_lowercase().alias("Location_low")     #  per rendere il filtro case-insensitive
+    # la categoria del luogo (Home, Hospital, Other) viene ricavata da Location sul cubo dei luoghi, vedi cubo.DERIVATE
+    morti_droga_location = (
+        conta_droghe_per(cubi, "LocationCategory", colonne_droga)
+        .drop_nulls("LocationCategory")
+        .rename({"LocationCategory": "Location"})
     )
 
-    # Loop per calcolare i conteggi in base alle categorie di Location
-    for droga in colonne_droga:
-        home = dati.filter(
-            (pl.col(droga) == 1) & (pl.col("Location_low").str.contains("home|residence"))
-        ).height
-
-        hospital = dati.filter(
-            (pl.col(droga) == 1) & (pl.col("Location_low").str.contains("hospital|hiospital|nursing|shelter"))
-        ).height
-
-        # tutto cio che non è hospitola o home
-        other = dati.filter(
-            (pl.col(droga) == 1) &
-            (~pl.col("Location_low").str.contains("home|residence|hospital|hiospital|nursing|shelter"))
-        ).height
-
-        # Aggiunta dei risultati alla lista
-        risultati_location.append({"Droga": droga, "Location": "Home", "Conteggio": home})
-        risultati_location.append({"Droga": droga, "Location": "Hospital", "Conteggio": hospital})
-        risultati_location.append({"Droga": droga, "Location": "Other", "Conteggio": other})
-
-    # Conversione in DataFrame Polars
-    morti_droga_location = pl.DataFrame(risultati_location)
-
     # Funzione con cache per velocizzare il cambio di categoria
-    @st.cache_data
-    def genera_grafici_location(_dat):
-        home = _dat.filter(pl.col("Location") == 'Home')
-        hospital = _dat.filter(pl.col("Location") == 'Hospital')
-        other = _dat.filter(pl.col("Location") == 'Other')
-
-        # Creazione dei grafici con la classe Grafici
-        grafico_home = Grafici.crea_grafico_barre(home, "Droga", "Conteggio",
-                                                  color_col="Conteggio", horizontal=True,
-                                                  sort="-x", title="Home - Droghe più prevalenti",
-                                                  width = 700, height =400, show_legend = False)
-
-        grafico_hospital = Grafici.crea_grafico_barre(hospital, "Droga", "Conteggio",
-                                                      color_col="Conteggio", horizontal=True,
-                                                      sort="-x", title="Hospital - Droghe più prevalenti",
-                                                      width = 700, height =400, show_legend = False)
-
-        grafico_other = Grafici.crea_grafico_barre(other, "Droga", "Conteggio",
-                                                   color_col="Conteggio", horizontal=True,
-                                                   sort="-x", title="Other - Droghe più prevalenti",
-                                                   width=500, height=400, show_legend = False)
-
-        return {
-            "Home": grafico_home,
-            "Hospital": grafico_hospital,
-            "Other": grafico_other
-        }
-
     # Generazione e caching dei grafici
     grafici_location = genera_grafici_location(morti_droga_location)
 
@@ -839,26 +794,19 @@ def analisi_esplorativa(dati, colonne_droga):
 
     #### CORRELAZIONI TRA VARIABILI NUMERICHE
 
-    # funzione per tirare fuori le variabili di tipo numerico dal dataset
+    # funzione per tirare fuori le variabili di tipo numerico dal dataset (basta lo schema, non legge i dati)
     def var_numeriche(dati):
         numeriche = []
-        for col in dati.columns:
-            if dati[col].dtype in [pl.Float64, pl.Int64, pl.Int32]:
+        for col, tipo in dati.schema.items():
+            if tipo.is_numeric(): # con lo schema compatto ci sono anche interi piccoli e UInt8
                 numeriche.append(col)
         return numeriche
 
     st.subheader("🔗 Correlazioni tra Variabili")
 
-    numeriche = var_numeriche(dati)
-    dati_numerici = (
-        dati
-        .select(numeriche)
-        .drop(["Quarter", "Other","Month_num","Day_num", "Latitudine", "Longitudine"]) # non mi interessa calcolarle per queste variabili
-        .to_pandas() # mi serve per buttare la tabella creata alla funzione corr che userò in seguito
-    )
-
-
-    correlazioni = dati_numerici.corr(method="pearson")
+    # non mi interessa calcolarle per queste variabili (DrugMask e CityKey sono codici, non variabili)
+    escluse = ["Quarter", "Other", "Month_num", "Day_num", "DrugMask", "CityKey"]
+    numeriche = [col for col in var_numeriche(dati) if col not in escluse]
 
     st.write("""
     Una matrice di correlazione è uno strumento fondamentale per analizzare le relazioni tra variabili numeriche in un dataset. 
@@ -873,11 +821,23 @@ def analisi_esplorativa(dati, colonne_droga):
 
     st.write("Matrice di correlazione tra variabili numeriche:")
 
-    mostra_corr = st.selectbox("Vuoi visualizzare la matrice di correlazione?", ["No", "Sì"])
-    if mostra_corr == "No":
-        st.warning("Matrice di correlazione nascosta. Scegliere *Si* dalla tendina per visualizzarla.")
-    else:
-        st.dataframe(correlazioni.style.background_gradient(cmap='coolwarm_r'))
+    # il calcolo e la scelta del coefficiente restano confinati in questo blocco (fragment)
+    @st.fragment
+    def sezione_correlazioni():
+        mostra_corr = st.selectbox("Vuoi visualizzare la matrice di correlazione?", ["No", "Sì"])
+        if mostra_corr == "No":
+            st.warning("Matrice di correlazione nascosta. Scegliere *Si* dalla tendina per visualizzarla.")
+        else:
+            # la matrice viene calcolata (e messa in cache) solo quando serve, vedi correlazioni.py
+            metodo = st.selectbox("Coefficiente di correlazione:", ["Pearson", "Spearman", "Kendall"])
+            try:
+                correlazioni = carica_correlazioni(tuple(numeriche), metodo.lower(), filtro, versione_dataset(compatto = True))
+            except ValueError:
+                st.warning("Con il filtro attivo non ci sono abbastanza righe per calcolare le correlazioni.")
+                return
+            st.dataframe(correlazioni.style.background_gradient(cmap='coolwarm_r'))
+
+    sezione_correlazioni()
 
     st.write("""
     **Analisi della matrice di correlazioni**
@@ -1,19 +1,51 @@
+import json
+
 import streamlit as st
 import polars as pl
 import altair as alt
 import numpy as np
 
 import folium
-from folium.plugins import HeatMap, MarkerCluster
+from folium.plugins import HeatMap
 from streamlit_folium import folium_static
 
-from scipy.stats import gaussian_kde
-
+from aree_cap import morti_non_assegnati, morti_per_cap
 from classe_Grafici import Grafici
+from citta import chiavi_valide, morti_per_citta
+from cubo import aggrega
+from densita import DIMENSIONI_CELLA, carica_heatmap, carica_kde
+from geometria import confini
+from preprocessing import versione_dataset
+from tessere import legenda_strato, strato_tessere
 
-def analisi_spaziale(dati):
+
+def _punti_geojson(tabella, raggio):
+    """
+    FeatureCollection GeoJson con un punto per riga della tabella (colonne Latitudine e Longitudine),
+    le altre colonne come proprietà e il raggio del marker in Raggio
+    """
+    proprieta = (
+        tabella
+        .drop(["Latitudine", "Longitudine"])
+        .with_columns([pl.col(pl.Utf8).fill_null("n.d."), pl.Series("Raggio", raggio)])
+        .to_dicts()
+    )
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": p}
+            for lon, lat, p in zip(tabella["Longitudine"].to_list(), tabella["Latitudine"].to_list(), proprieta)
+        ]
+    }
+
+
+def analisi_spaziale(dati, cubi, citta, filtro = ()):
     """
     funzione per l'analisi spaziale/geografica, fatta anche con mappe interattive
+    cubi sono i cubi materializzati delle morti (vedi cubo.py), da cui si ricavano i conteggi dei grafici
+    citta è la tabella delle città (vedi citta.py), da cui si prendono le coordinate tramite CityKey
+    filtro è la chiave del filtro globale (vedi filtri.py), con cui restano in cache le griglie di densità
+    e i conteggi per area del CAP
     """
 
 
@@ -27,32 +59,40 @@ def analisi_spaziale(dati):
     L'obiettivo è identificare i punti caldi e correlare eventuali differenze geografiche con fattori demografici, economici o infrastrutturali, supportando così lo sviluppo di strategie mirate per la prevenzione e l'intervento.
     """)
 
-    # pulizia dei dati per l'analisi geografica
-    dati_geo = (
-        dati.filter(
-            pl.col("DeathCityGeo").str.contains(r"\(-?\d+\.\d+, -?\d+\.\d+\)")
-        )
-    ).to_pandas() # devo convertire a pandas per compatibilità con scikit
+    # pulizia dei dati per l'analisi geografica: tengo le righe la cui città ha coordinate valide
+    # (filtro sulle chiavi intere); le coordinate arrivano dalla tabella delle città
+    dati_geo = dati.filter(pl.col("CityKey").is_in(chiavi_valide(citta).cast(dati["CityKey"].dtype)))
+
+    # i decessi hanno le coordinate della loro città: sulla mappa basta un marker per città, con raggio proporzionale
+    # alla radice del numero di morti (area proporzionale ai morti)
+    per_citta = morti_per_citta(dati_geo, citta)
+    morti = per_citta["Morti"].to_numpy()
+    raggio = 4 + 20 * np.sqrt(morti / morti.max(initial = 1))
 
 
     st.subheader("Distribuzione geografica delle morti")
 
-    # mappa interattiva, with clustering marker
     m = folium.Map(location = [41.6, -72.7], zoom_start =8)
 
-    # Marker Cluster per una migliore visualizzazione
-    # https://python-visualization.github.io/folium/latest/user_guide/plugins/marker_cluster.html
-    marker_cluster = MarkerCluster().add_to(m)
+    # un unico layer GeoJson costruito dalle colonne della tabella per città: popup e tooltip vengono
+    # generati dal browser a partire dalle proprietà di ogni punto, senza un oggetto python per decesso
+    # https://python-visualization.github.io/folium/latest/user_guide/geojson/geojson_marker.html
+    folium.GeoJson(
+        _punti_geojson(per_citta, raggio),
+        marker = folium.CircleMarker(color = "red", weight = 1, fill = True, fill_color = "red", fill_opacity = 0.5),
+        style_function = lambda punto: {"radius": punto["properties"]["Raggio"]},
+        tooltip = folium.GeoJsonTooltip(fields = ["Citta", "Morti"], aliases = ["Città:", "Morti:"]),
+        popup = folium.GeoJsonPopup(
+            fields = ["Citta", "Contea", "Morti", "Età media", "Maschi", "Femmine"],
+            aliases = ["Città:", "Contea:", "Morti:", "Età media:", "Maschi:", "Femmine:"]
+        )
+    ).add_to(m)
 
-    for indice, riga in dati_geo.iterrows(): # uso iterrows, fa parte di pandas
-        folium.CircleMarker(
-            location=[riga["Latitudine"], riga["Longitudine"]],
-            radius = 5,
-            popup=f"Age: {riga['Age']}, Sex: {riga['Sex']}, Race: {riga['Race']}",
-            color="red",
-            fill=True,
-            fillColor="red"
-        ).add_to(marker_cluster)
+    # senza filtro la densità (stima del kernel sul dataset completo) si può sovrapporre come tessere già disegnate
+    strato_densita = None if filtro else strato_tessere("densita", "Densità (stima del kernel)", mostra = False)
+    if strato_densita is not None:
+        strato_densita.add_to(m)
+        folium.LayerControl().add_to(m)
 
     col1, col2, col3 = st.columns([1,2,1])
     with col2:
@@ -62,75 +102,145 @@ def analisi_spaziale(dati):
     st.subheader("Statistiche distribuzione geografica")
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Totale decessi:", len(dati_geo))
+        st.metric("Totale decessi:", dati_geo.height)
     with col2:
-        st.metric("Luoghi di decesso:", dati_geo["Death City"].nunique()) # nunique() restituisco il numero di valori unici che ho
+        st.metric("Luoghi di decesso:", dati_geo["Death City"].n_unique()) # numero di valori unici
 
 
     st.subheader("Densità della distribuzione geografica delle morti")
 
-    m_dens =folium.Map(location=[41.6, -72.7], zoom_start=8) # imposta los cheletro della mappa
+    # la heatmap riceve solo le celle non vuote di una griglia calcolata lato server (vedi densita.py),
+    # quindi la pagina non cresce con il numero di decessi; cambiare la risoluzione riesegue solo questo blocco
+    @st.fragment
+    def mappa_densita():
+        dimensione_cella = st.select_slider("Lato delle celle della griglia (gradi)", options = DIMENSIONI_CELLA, value = 0.02)
+        celle = carica_heatmap(filtro, dimensione_cella, versione_dataset(compatto = True))
 
-    # dati per la heatmap
-    dati_dens = [[riga['Latitudine'], riga['Longitudine']] for _, riga in dati_geo.iterrows()]
+        m_dens =folium.Map(location=[41.6, -72.7], zoom_start=8) # imposta los cheletro della mappa
+        HeatMap(celle.select(["Latitudine", "Longitudine", "Peso"]).to_numpy().tolist()).add_to(m_dens) # aggiungo il layer della densità alla mappa
 
-    HeatMap(dati_dens).add_to(m_dens) # aggiungo il layer della densità alla mappa
+        col1, col2, col3 = st.columns([1,2,1])
+        with col2:
+            folium_static(m_dens, width=700, height=400)
+        st.caption(f"{celle.height} celle non vuote")
 
 
     # Stima della densità con il metodo del Kernel
     # https://docs.scipy.org/doc/scipy/tutorial/stats/kernel_density_estimation.html
+    # calcolata su una griglia con la convoluzione via FFT invece che punto per punto (vedi densita.py)
+    @st.fragment
+    def grafico_densita():
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            metodo = st.selectbox("Larghezza di banda del kernel:", ["Scott", "Silverman", "Fissa"])
+        with col2:
+            banda_fissa = st.number_input("Banda fissa (gradi):", min_value = 0.005, max_value = 0.5, value = 0.05, step = 0.005, disabled = metodo != "Fissa")
+
+        try:
+            dati_densità, banda = carica_kde(filtro, metodo.lower(), banda_fissa if metodo == "Fissa" else None, versione_dataset(compatto = True))
+        except ValueError:
+            # con un filtro stretto i punti possono essere troppo pochi o tutti nella stessa città (banda nulla)
+            st.info("Con il filtro attivo i punti non bastano per stimare la densità.")
+            return
+
+        x = dati_densità["Longitudine"]
+        y = dati_densità["Latitudine"]
+
+        # Creazione della densità
+        grafico_densità = alt.Chart(dati_densità).mark_circle().encode(
+            x=alt.X('Longitudine:Q', scale=alt.Scale(domain=[x.min(), x.max()])),
+            y=alt.Y('Latitudine:Q', scale=alt.Scale(domain=[y.min(), y.max()])),
+            color=alt.Color('Densità:Q', scale=alt.Scale(scheme='plasma')),
+            tooltip=['Longitudine', 'Latitudine', 'Morti', 'Densità']
+        ).properties(
+            width=500,
+            height=500
+        )
+        st.altair_chart(grafico_densità, use_container_width=True)
+        st.caption(f"Banda: {banda[0]:.4f}° in longitudine, {banda[1]:.4f}° in latitudine")
+
+
+    # coropletica per area del CAP: i decessi vengono assegnati alle aree con l'indice spaziale (vedi aree_cap.py)
+    # e le aree sono disegnate con i confini semplificati per lo zoom della mappa (vedi geometria.py)
+    @st.fragment
+    def mappa_cap():
+        misura = st.selectbox("Valore per area del CAP:", ["Morti per km2", "Morti"])
+        per_cap = morti_per_cap(filtro, versione_dataset(compatto = True))
+        if per_cap["Morti"].sum() == 0:
+            st.info("Con il filtro attivo nessun decesso cade nelle aree dei CAP.")
+            return
+
+        positivi = per_cap.filter(pl.col("Morti") > 0)[misura].to_numpy()
+        m_cap = folium.Map(location = [41.6, -72.7], zoom_start = 8)
+
+        # senza filtro le densità per CAP e per contea arrivano come tessere già disegnate (vedi tessere.py)
+        strato_cap = None if filtro or misura != "Morti per km2" else strato_tessere("cap", "Morti per km² per CAP")
+        if strato_cap is not None:
+            strato_cap.add_to(m_cap)
+            strato_contee = strato_tessere("contee", "Morti per km² per contea", mostra = False)
+            if strato_contee is not None:
+                strato_contee.add_to(m_cap)
+            legenda = legenda_strato("cap")
+            if legenda is not None:
+                legenda.add_to(m_cap)
+            folium.LayerControl().add_to(m_cap)
+        else:
+            # valori della tabella come proprietà delle aree, per il tooltip
+            proprieta = {
+                riga["ZCTA5CE10"]: {"Morti": riga["Morti"], "Densità": round(riga["Morti per km2"], 2)}
+                for riga in per_cap.select(["ZCTA5CE10", "Morti", "Morti per km2"]).iter_rows(named = True)
+            }
+            aree = json.loads(confini("cap", zoom = 8))
+            for area in aree["features"]:
+                area["properties"].update(proprieta[area["properties"]["ZCTA5CE10"]])
+
+            # classi sui quantili delle aree con almeno un decesso (la distribuzione è molto asimmetrica)
+            soglie = np.unique(np.concatenate([[0], np.quantile(positivi, [0.25, 0.5, 0.75, 0.9]), [positivi.max()]]))
+
+            coropletica = folium.Choropleth(
+                geo_data = aree,
+                data = dict(zip(per_cap["ZCTA5CE10"].to_list(), per_cap[misura].to_list())),
+                key_on = "feature.properties.ZCTA5CE10",
+                bins = soglie.tolist() if len(soglie) >= 4 else 6,
+                fill_color = "YlOrRd",
+                fill_opacity = 0.7,
+                line_weight = 0.3,
+                legend_name = misura
+            ).add_to(m_cap)
+            coropletica.geojson.add_child(folium.GeoJsonTooltip(
+                fields = ["ZCTA5CE10", "Morti", "Densità"], aliases = ["CAP:", "Morti:", "Morti per km²:"]
+            ))
 
-    # stima delle densità
-    x = dati_geo["Longitudine"]
-    y = dati_geo["Latitudine"]
-
-    xy = np.vstack([x,y])
-    z = gaussian_kde(xy)(xy)
-
-    # Creazione DataFrame
-    dati_densità = pl.DataFrame({
-        'Longitudine': x,
-        'Latitudine': y,
-        'Densità': z
-    })
-
-    # Creazione della densità
-    grafico_densità = alt.Chart(dati_densità).mark_circle().encode(
-        x=alt.X('Longitudine:Q', scale=alt.Scale(domain=[x.min(), x.max()])),
-        y=alt.Y('Latitudine:Q', scale=alt.Scale(domain=[y.min(), y.max()])),
-        color=alt.Color('Densità:Q', scale=alt.Scale(scheme='plasma')),
-        tooltip=['Longitudine', 'Latitudine', 'Densità']
-    ).properties(
-        width=500,
-        height=500
-    )
+        col1, col2, col3 = st.columns([1,2,1])
+        with col2:
+            folium_static(m_cap, width=700, height=400)
+        non_assegnati = morti_non_assegnati(filtro, versione_dataset(compatto = True))
+        st.caption(
+            f"{positivi.size} aree del CAP con almeno un decesso su {per_cap.height}; "
+            f"{non_assegnati} decessi non assegnati a un'area (città non indicata o coordinate generiche dello stato)"
+        )
+        st.dataframe(per_cap.head(10), use_container_width = True, hide_index = True)
 
 
     # Creazione delle tab per la visualizzazione dei grafici
-    tab1, tab2 = st.tabs(["Mappa di Densità", "Grafico di Densità"])
+    tab1, tab2, tab3 = st.tabs(["Mappa di Densità", "Grafico di Densità", "Densità per CAP"])
     with tab1:
-        col1, col2, col3 = st.columns([1,2,1])
-        with col2:
-            folium_static(m_dens, width=700, height=400)
+        mappa_densita()
     with tab2:
-        st.altair_chart(grafico_densità, use_container_width=True)
+        grafico_densita()
+    with tab3:
+        mappa_cap()
 
-    # top 10 contee suddivisi per sesso
+    # top 10 contee suddivisi per sesso (roll-up del cubo)
     morti_contea_sesso = (
-        dati.group_by(["Death County", "Sex"])
-        .agg([
-            pl.count().alias("Morti totali")
-        ])
+        aggrega(cubi, ["Death County", "Sex"])
         .sort("Morti totali", descending = True)
         .head(10)
     )
 
     # top 10 città suddivisi per sesso
     morti_citta_sesso = (
-        dati.group_by(["Death City", "Sex"])
-        .agg([
-            pl.count().alias("Morti totali")
-        ])
+        aggrega(cubi, ["Death City", "Sex"])
         .sort("Morti totali", descending = True)
         .head(10)
     )
@@ -183,12 +293,12 @@ def analisi_spaziale(dati):
 
     # distribuzione delle morti per luogo
     morti_luogo = (
-        dati
+        aggrega(cubi, ["Location"])
         .with_columns(
-            pl.col("Location").str.to_lowercase().alias("Location")
+            pl.col("Location").cast(pl.Utf8).str.to_lowercase().alias("Location")
         )
         .group_by("Location")
-        .agg(pl.count().alias("Morti totali"))
+        .agg(pl.sum("Morti totali"))
         .sort("Morti totali", descending=True)  # ordine decrescente delle morti toali
     )
 
@@ -228,20 +338,17 @@ def analisi_spaziale(dati):
 
     # Selezione delle top 10 città con più morti
     top_citta_morti = (
-        dati
-        .group_by("Death City")
-        .agg(pl.count().alias("Morti totali"))
+        aggrega(cubi, ["Death City"])
         .sort("Morti totali", descending=True)
         .head(10)
         .select("Death City")
     )
 
     # Filtrare i dati per le top 10 città e calcolare le morti per anno
+    # (i Categorical di cubi diversi hanno codifiche diverse: il confronto si fa sul testo)
     morti_per_anno_top_citta = (
-        dati
-        .filter(pl.col("Death City").is_in(top_citta_morti["Death City"]))
-        .group_by(["Year", "Death City"])
-        .agg(pl.count().alias("Morti totali"))
+        aggrega(cubi, ["Year", "Death City"])
+        .filter(pl.col("Death City").cast(pl.Utf8).is_in(top_citta_morti["Death City"].cast(pl.Utf8)))
         .sort(["Year", "Death City"])
     )
 
@@ -259,9 +366,7 @@ def analisi_spaziale(dati):
 
     # Selezione delle top 10 contee con più morti
     top_contee_morti = (
-        dati
-        .group_by("Death County")
-        .agg(pl.count().alias("Morti totali"))
+        aggrega(cubi, ["Death County"])
         .sort("Morti totali", descending=True)
         .head(10)
         .select("Death County")
@@ -269,10 +374,8 @@ def analisi_spaziale(dati):
 
     # iltrare i dati per le top 10 contee e calcolare le morti per anno
     morti_per_anno_top_contee = (
-        dati
-        .filter(pl.col("Death County").is_in(top_contee_morti["Death County"]))
-        .group_by(["Year", "Death County"])
-        .agg(pl.count().alias("Morti totali"))
+        aggrega(cubi, ["Year", "Death County"])
+        .filter(pl.col("Death County").cast(pl.Utf8).is_in(top_contee_morti["Death County"].cast(pl.Utf8)))
         .sort(["Year", "Death County"])
     )
 
@@ -289,12 +392,17 @@ def analisi_spaziale(dati):
     )
 
     # Creazione della selezione con tendina per scegliere il grafico
-    selezione_grafico = st.selectbox("Seleziona il grafico da visualizzare:", ["Top 10 Città", "Top 10 Contee"])
+    # cambiare grafico riesegue solo questo blocco (fragment), non mappe e densità
+    @st.fragment
+    def sezione_top10_anno():
+        selezione_grafico = st.selectbox("Seleziona il grafico da visualizzare:", ["Top 10 Città", "Top 10 Contee"])
+
+        if selezione_grafico == "Top 10 Città":
+            st.altair_chart(grafico_morti_per_anno_citta, use_container_width=True)
+        else:
+            st.altair_chart(grafico_morti_per_anno_contee, use_container_width=True)
 
-    if selezione_grafico == "Top 10 Città":
-        st.altair_chart(grafico_morti_per_anno_citta, use_container_width=True)
-    else:
-        st.altair_chart(grafico_morti_per_anno_contee, use_container_width=True)
+    sezione_top10_anno()
 
     st.write("""
     Nel corso degli anni analizzati, Hartford emerge chiaramente come la città con il maggior numero di morti totali, mostrando un incremento significativo dai 27 decessi del 2012 ai 188 del 2021. 
@@ -6,6 +6,12 @@ import altair as alt
 from sklearn.model_selection import train_test_split
 from sklearn.linear_model import LogisticRegression
 
+from filtri import scan_filtrato
+from indice_droghe import carica_indice_droghe
+from itemset import carica_itemset
+from memo import memoizza
+from preprocessing import versione_dataset
+
 # esempio usato per la regressione logistica
 # https://www.datacamp.com/tutorial/understanding-logistic-regression-python
 
@@ -13,7 +19,31 @@ from sklearn.linear_model import LogisticRegression
 # https://scikit-learn.org/1.5/modules/generated/sklearn.linear_model.LogisticRegression.html
 
 
-def analisi_stat(dati, colonne_droga):
+@memoizza(maxsize = 32)
+def carica_dati_RL(altre_droghe, droga_obiettivo, filtro = (), versione = None):
+    """
+    funzione per caching del dataset del modello: legge dal dataset partizionato
+    soltanto le colonne delle droghe (stesso schema compatto usato da app.py),
+    ristretto al filtro globale della barra laterale; in cache per versione del dataset (vedi versione_dataset)
+    """
+    return (
+        scan_filtrato(filtro, list(altre_droghe) + [droga_obiettivo])
+        .drop_nulls()
+        .collect()
+    )
+
+
+@memoizza(maxsize = 32)
+def addestra_modello(X_train, y_train):
+    """
+    addestramento del modello, in cache per impronta dei dati di training (forma, tipo e un campione di righe)
+    """
+    modello = LogisticRegression(random_state=16)
+    modello.fit(X_train, y_train)
+    return modello
+
+
+def analisi_stat(dati, colonne_droga, filtro = ()):
     st.title("Analisi statistica - Modelli")
     st.markdown("""
 
@@ -39,73 +69,155 @@ def analisi_stat(dati, colonne_droga):
     """)
 
 
-    droga_obiettivo = st.selectbox("Seleziona la droga da predire", colonne_droga)
-    altre_droghe = [d for d in colonne_droga if d != droga_obiettivo] # tutte le droghe meno la droga selezionata
+    # blocco interattivo isolato in un fragment: cambiare la droga riaddestra e ridisegna solo il modello
+    @st.fragment
+    def sezione_modello():
+        droga_obiettivo = st.selectbox("Seleziona la droga da predire", colonne_droga)
+        altre_droghe = [d for d in colonne_droga if d != droga_obiettivo] # tutte le droghe meno la droga selezionata
+
+        dati_nonull = carica_dati_RL(tuple(altre_droghe), droga_obiettivo, filtro, versione_dataset(compatto = True)) # carico solo le colonne che servono al modello
+
+        # variabili per la definizioned el modello
+        X = dati_nonull.select(altre_droghe).to_numpy()
+        y = dati_nonull.select(droga_obiettivo).to_numpy().ravel() # trasformo in un vettore riga
+
+
+        # variabili per il training del modello
+        # (con un filtro molto stretto possono mancare righe o esempi di una delle due classi)
+        if len(y) < 10:
+            st.warning("Con il filtro attivo non ci sono abbastanza decessi per addestrare il modello.")
+            return
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=16)
+        if len(set(y_train)) < 2:
+            st.warning(f"Con il filtro attivo non ci sono decessi sia con sia senza {droga_obiettivo} per addestrare il modello.")
+            return
+
+        # salvo in una varubaile i risultati del modello
+        modello_reg_log = addestra_modello(X_train, y_train)
+
+        # coefficienti del modello
+        coefficienti = pl.DataFrame({
+            "Droga": altre_droghe,
+            "Coefficiente": modello_reg_log.coef_[0]
+        }).sort("Coefficiente", descending=True)
+
+        grafico = alt.Chart(coefficienti).mark_bar().encode(
+            x=alt.X('Coefficiente:Q', title='Coefficiente'),
+            y=alt.Y('Droga:N', sort='-x', title='Droga'),
+            color=alt.condition(
+                alt.datum.Coefficiente > 0,
+                alt.value("blue"),
+                alt.value("red")
+            )
+        ).properties(
+            width=600,
+            height=400,
+            title=f'Importanza delle Droghe nella Predizione di {droga_obiettivo}'
+        )
 
-    @st.cache_data
-    def carica_dati_RL():
-        # funzione per caching del dataset
-        return dati.select(altre_droghe + [droga_obiettivo]).drop_nulls()
+        col1, col2, col3 = st.columns([1,2,1])
+        with col2:
+            st.altair_chart(grafico)
 
-    dati_nonull = carica_dati_RL() # carico i dati con la funzione fatta prima
+        # Aggiunta accuracy score
+        accuracy = modello_reg_log.score(X_test, y_test)
+        st.markdown(f"""
+        ### Performance del Modello
+        - Accuracy sul test set: {accuracy:.3f}
+        - I coefficienti positivi indicano una correlazione positiva con la presenza della sostanza target
+        - I coefficienti negativi indicano una correlazione negativa
+        """)
 
-    # variabili per la definizioned el modello
-    X = dati_nonull.select(altre_droghe).to_numpy()
-    y = dati_nonull.select(droga_obiettivo).to_numpy().ravel() # trasformo in un vettore riga
+    sezione_modello()
 
 
-    # variabili per il training del modello
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=16)
+    st.markdown("""
+    ### Considerazioni sul Modello
+       - Pro: Ottima per variabili binarie
+       - Pro: Facilmente interpretabile
+       - Contro: Non cattura relazioni non lineari
+    """)
 
 
-    @st.cache_resource
-    def addestra_modello(X_train, y_train):
-        # addestramento del modeello
-        modello = LogisticRegression(random_state=16)
-        modello.fit(X_train, y_train)
-        return modello
+    # co-presenza delle sostanze a partire dall'indice a bitmask
+    st.markdown("""
+    ### Co-presenza delle sostanze
 
-    # salvo in una varubaile i risultati del modello
-    modello_reg_log = addestra_modello(X_train, y_train)
+    La matrice riporta la probabilità condizionata $P(A|B)$ di trovare la sostanza A (righe)
+    nei decessi in cui è presente la sostanza B (colonne).
+    """)
 
-    # coefficienti del modello
-    coefficienti = pl.DataFrame({
-        "Droga": altre_droghe,
-        "Coefficiente": modello_reg_log.coef_[0]
-    }).sort("Coefficiente", descending=True)
+    indice = carica_indice_droghe(filtro, versione_dataset(compatto = True))
 
-    grafico = alt.Chart(coefficienti).mark_bar().encode(
-        x=alt.X('Coefficiente:Q', title='Coefficiente'),
-        y=alt.Y('Droga:N', sort='-x', title='Droga'),
-        color=alt.condition(
-            alt.datum.Coefficiente > 0,
-            alt.value("blue"),
-            alt.value("red")
-        )
+    grafico_cooccorrenze = alt.Chart(indice.tabella_cooccorrenze()).mark_rect().encode(
+        x=alt.X('Condizione:N', sort=colonne_droga, title='Condizione (B)'),
+        y=alt.Y('Droga:N', sort=colonne_droga, title='Droga (A)'),
+        color=alt.Color('P(Droga | Condizione):Q', scale=alt.Scale(scheme='blues'), title='P(A|B)'),
+        tooltip=['Droga', 'Condizione', 'Co-occorrenze', 'P(Droga | Condizione)']
     ).properties(
         width=600,
-        height=400,
-        title=f'Importanza delle Droghe nella Predizione di {droga_obiettivo}'
+        height=600,
+        title='Probabilità condizionate di co-presenza'
     )
 
-    col1, col2, col3 = st.columns([1,2,1])
-    with col2:
-        st.altair_chart(grafico)
-
-    # Aggiunta accuracy score
-    accuracy = modello_reg_log.score(X_test, y_test)
-    st.markdown(f"""
-    ### Performance del Modello
-    - Accuracy sul test set: {accuracy:.3f}
-    - I coefficienti positivi indicano una correlazione positiva con la presenza della sostanza target
-    - I coefficienti negativi indicano una correlazione negativa
-    """)
+    @st.fragment
+    def sezione_copresenza():
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.altair_chart(grafico_cooccorrenze)
+        with col2:
+            # interrogazione dell'indice: quante morti con certe sostanze e senza altre
+            con = st.multiselect("Sostanze presenti", colonne_droga, default=["Fentanyl", "Xylazine"])
+            senza = st.multiselect("Sostanze assenti", [d for d in colonne_droga if d not in con], default=["Heroin"])
+            st.metric("Decessi corrispondenti", f"{indice.conta(con, senza):,}")
+
+            st.write("Combinazioni esatte più frequenti:")
+            st.dataframe(indice.istogramma_combinazioni().head(10), hide_index=True)
 
+    sezione_copresenza()
 
+
+    # combinazioni frequenti di sostanze (itemset frequenti su bitset, vedi itemset.py)
     st.markdown("""
-    ### Considerazioni sul Modello
-       - Pro: Ottima per variabili binarie
-       - Pro: Facilmente interpretabile
-       - Contro: Non cattura relazioni non lineari
+    ### Combinazioni frequenti di sostanze
+
+    Gli itemset frequenti sono gli insiemi di sostanze presenti insieme in almeno una quota minima dei decessi (supporto).
+    Da questi si ricavano le regole di associazione $A \\rightarrow C$ con confidenza $P(C|A)$ e lift $P(C|A) / P(C)$
+    (lift maggiore di 1: le sostanze compaiono insieme più spesso di quanto accadrebbe per caso).
+    La pendenza indica di quanti punti percentuali all'anno cresce (o cala) la quota dei decessi con quella combinazione.
     """)
 
+    itemset = carica_itemset(filtro, versione_dataset(compatto = True))
+
+    @st.fragment
+    def sezione_itemset():
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            min_supporto = st.slider("Supporto minimo (%)", min_value=0.5, max_value=20.0, value=2.0, step=0.5) / 100
+        with col2:
+            lunghezze = st.slider("Numero di sostanze", min_value=2, max_value=5, value=(3, 5))
+        with col3:
+            min_confidenza = st.slider("Confidenza minima", min_value=0.0, max_value=1.0, value=0.5, step=0.05)
+        with col4:
+            min_lift = st.slider("Lift minimo", min_value=0.0, max_value=5.0, value=1.0, step=0.1)
+
+        tab1, tab2, tab3 = st.tabs(["Combinazioni in crescita", "Combinazioni per anno", "Regole di associazione"])
+        with tab1:
+            riassunto, per_anno = itemset.andamento(min_supporto, *lunghezze)
+            st.dataframe(riassunto.head(20), hide_index=True)
+            crescita = riassunto.head(5).get_column("Itemset")
+            grafico_crescita = alt.Chart(per_anno.filter(pl.col("Itemset").is_in(crescita))).mark_line(point=True).encode(
+                x=alt.X('Anno:O', title='Anno'),
+                y=alt.Y('Supporto:Q', title='Decessi con la combinazione (%)'),
+                color=alt.Color('Itemset:N', title='Combinazione'),
+                tooltip=['Itemset', 'Anno', alt.Tooltip('Supporto:Q', format='.2f')]
+            ).properties(height=400, title='Le cinque combinazioni più in crescita')
+            st.altair_chart(grafico_crescita, use_container_width=True)
+        with tab2:
+            anno = st.selectbox("Anno", itemset.anni.tolist(), index=len(itemset.anni) - 1)
+            st.dataframe(itemset.frequenti(min_supporto, *lunghezze, anno=anno).head(20), hide_index=True)
+        with tab3:
+            regole = itemset.regole(min_supporto, min_confidenza, min_lift, lunghezze[1])
+            st.dataframe(regole.head(50), hide_index=True)
+
+    sezione_itemset()
@@ -45,20 +45,41 @@ st.markdown(
 )
 
 
-from preprocessing import carica_dati, get_droghe
+from preprocessing import carica_citta, carica_cubi, get_droghe, versione_dataset
+from filtri import vista_filtrata
 from intro_descrittiva import intro_descrittiva
 from analisi_esplorativa import analisi_esplorativa
 from analisi_stat import analisi_stat
 from analisi_geografica import analisi_spaziale
-from barra_laterale import intro_barra_lat
+from barra_laterale import intro_barra_lat, statistiche_barra_lat
+
+
+@st.fragment
+def sezione(funzione, *argomenti, differita = None):
+    """
+    esegue una sezione dell'app in un fragment di streamlit: i widget della sezione rieseguono solo
+    la sezione stessa e non tutta la pagina.
+    Se differita è l'etichetta di un toggle, la sezione (pesante) non viene calcolata finché l'utente non la apre
+    """
+    if differita is not None and not st.toggle(differita, value = False):
+        st.info("Sezione non ancora caricata: attivare l'interruttore qui sopra per calcolarla e visualizzarla.")
+        return
+    funzione(*argomenti)
 
 
 # main di collaudo delle funzioni
 def main():
 
-    intro_barra_lat()
+    # versione dei dati: cambia dopo un append o una modifica del csv, e con lei le chiavi delle cache
+    versione = versione_dataset(compatto = True)
 
-    dati = carica_dati()
+    # filtro globale scelto nella barra laterale (le opzioni vengono dai cubi completi)
+    filtro = intro_barra_lat(carica_cubi(compatto = True, versione = versione))
+
+    # schema compatto: flag delle droghe UInt8 e dimensioni categoriche, group_by e filtri lavorano su codici interi;
+    # dataset e cubi materializzati (da cui si ricavano i conteggi dei grafici) ristretti al filtro, in cache per versione del dataset e chiave
+    dati, cubi = vista_filtrata(filtro, compatto = True, versione = versione)
+    citta = carica_citta(compatto = True, versione = versione) # tabella delle città con le coordinate, collegata ai dati tramite CityKey
     colonne_droga = get_droghe()
 
     # realizzo delle anchor all'interno della pagina per 'aggrapparmi' ai capitoli
@@ -66,14 +87,22 @@ def main():
     st.markdown('<div id="introduzione"></div>', unsafe_allow_html=True)
     intro_descrittiva()
 
+    if dati.is_empty():
+        st.warning("Nessun decesso corrisponde al filtro selezionato nella barra laterale.")
+        return
+
     st.markdown('<div id="analisi-esplorativa"></div>', unsafe_allow_html=True)
-    analisi_esplorativa(dati, colonne_droga)
+    sezione(analisi_esplorativa, dati, colonne_droga, cubi, filtro)
 
     st.markdown('<div id="analisi-geografica"></div>', unsafe_allow_html=True)
-    analisi_spaziale(dati)
+    # mappe con un marker per decesso e stima della densità: calcolate solo su richiesta
+    sezione(analisi_spaziale, dati, cubi, citta, filtro, differita = "Mostra l'analisi geografica (mappe e densità)")
 
     st.markdown('<div id="analisi-statistica"></div>', unsafe_allow_html=True)
-    analisi_stat(dati, colonne_droga)
+    # addestramento del modello: calcolato solo su richiesta
+    sezione(analisi_stat, dati, colonne_droga, filtro, differita = "Mostra l'analisi statistica (modelli)")
+
+    statistiche_barra_lat()
 
 
 main()
@@ -0,0 +1,253 @@
+"""
+Assegnazione dei decessi alle aree dei CAP (ZCTA) con un indice spaziale.
+
+I decessi hanno le coordinate della loro città (vedi citta.py), quindi le coordinate distinte da assegnare
+sono poche centinaia anche quando il dataset cresce: ogni coordinata viene assegnata una volta sola e il risultato
+resta in cache; i decessi passano poi alle aree con un join sulla chiave intera CityKey (costo lineare nelle righe).
+
+L'indice è una griglia uniforme sul riquadro delle aree: ogni cella elenca le aree il cui riquadro (bounding box)
+la tocca. Per un punto si controllano solo le aree della sua cella (di solito da una a quattro) con il test
+esatto del punto nel poligono (ray casting sui lati di tutti gli anelli dell'area, buchi compresi), invece
+di confrontare ogni punto con tutti i poligoni.
+"""
+
+import numpy as np
+import polars as pl
+
+from filtri import scan_filtrato
+from geometria import FILE_CONFINI, carica_topologia, contea_per_area
+from memo import memoizza
+from preprocessing import carica_citta
+
+# celle della griglia per lato
+CELLE_INDICE = 64
+
+# punti per blocco nel test del punto nel poligono (limita la matrice punti x lati)
+PUNTI_PER_BLOCCO = 2048
+
+
+class IndiceSpaziale:
+    """
+    griglia uniforme di riquadri sulle aree della topologia (vedi geometria.py), con test esatto del punto
+    nel poligono e cache delle coordinate già assegnate
+    """
+
+    def __init__(self, topologia, celle = CELLE_INDICE):
+        self.codici = [p["ZCTA5CE10"] for p in topologia.proprieta]
+        self.lati = [] # per area: (x1, y1, x2, y2) di tutti i lati dei suoi anelli
+        riquadri = []
+        for area in range(len(topologia.poligoni)):
+            anelli = [anello for poligono in topologia.aree(area) for anello in poligono]
+            lonlat = [topologia.lonlat[anello] for anello in anelli]
+            inizi = np.concatenate([xy[:-1] for xy in lonlat])
+            fini = np.concatenate([xy[1:] for xy in lonlat])
+            self.lati.append((inizi[:, 0], inizi[:, 1], fini[:, 0], fini[:, 1]))
+            riquadri.append(np.concatenate([inizi.min(axis = 0), inizi.max(axis = 0)]))
+        self.riquadri = np.array(riquadri) # lon min, lat min, lon max, lat max
+
+        self.celle = celle
+        self.origine = self.riquadri[:, :2].min(axis = 0)
+        self.passo = (self.riquadri[:, 2:].max(axis = 0) - self.origine) / celle
+
+        # coppie (cella, area) per ogni cella coperta dal riquadro dell'area, ordinate per cella (formato CSR)
+        coppie = []
+        for area, riquadro in enumerate(self.riquadri):
+            (i0, j0), (i1, j1) = self._cella_xy(riquadro[:2]), self._cella_xy(riquadro[2:])
+            i, j = np.meshgrid(np.arange(i0, i1 + 1), np.arange(j0, j1 + 1), indexing = "ij")
+            coppie.append(np.column_stack([(i * celle + j).ravel(), np.full(i.size, area)]))
+        coppie = np.concatenate(coppie)
+        coppie = coppie[np.argsort(coppie[:, 0], kind = "stable")]
+        self.aree_celle = coppie[:, 1]
+        self.inizi_celle = np.searchsorted(coppie[:, 0], np.arange(celle * celle + 1))
+
+        self._assegnati = {} # (longitudine, latitudine) -> indice dell'area (-1 se fuori da tutte)
+
+    def _cella_xy(self, punti):
+        # indici di colonna e riga della griglia (i punti sul bordo destro finiscono nell'ultima cella)
+        return np.clip(((np.asarray(punti) - self.origine) / self.passo).astype(np.int64), 0, self.celle - 1)
+
+    def _dentro(self, area, longitudine, latitudine):
+        # ray casting a blocchi di punti: dentro se la semiretta verso est attraversa un numero dispari di lati
+        x1, y1, x2, y2 = self.lati[area]
+        risultato = np.zeros(len(longitudine), dtype = bool)
+        for inizio in range(0, len(longitudine), PUNTI_PER_BLOCCO):
+            x = longitudine[inizio:inizio + PUNTI_PER_BLOCCO, None]
+            y = latitudine[inizio:inizio + PUNTI_PER_BLOCCO, None]
+            attraversa = (y1 > y) != (y2 > y)
+            with np.errstate(divide = "ignore", invalid = "ignore"):
+                ascisse = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            risultato[inizio:inizio + PUNTI_PER_BLOCCO] = np.count_nonzero(attraversa & (x < ascisse), axis = 1) % 2 == 1
+        return risultato
+
+    def _assegna(self, longitudine, latitudine):
+        """
+        indice dell'area di ogni punto (-1 se fuori da tutte), senza cache
+        """
+        risultato = np.full(len(longitudine), -1, dtype = np.int64)
+        dentro_griglia = (
+            (longitudine >= self.origine[0]) & (longitudine <= self.origine[0] + self.passo[0] * self.celle)
+            & (latitudine >= self.origine[1]) & (latitudine <= self.origine[1] + self.passo[1] * self.celle)
+        )
+        punti = np.flatnonzero(dentro_griglia)
+        ij = self._cella_xy(np.column_stack([longitudine[punti], latitudine[punti]]))
+        cella = ij[:, 0] * self.celle + ij[:, 1]
+
+        # coppie (punto, area candidata) dalle liste delle celle, tenendo solo i riquadri che contengono il punto
+        quanti = self.inizi_celle[cella + 1] - self.inizi_celle[cella]
+        punto = np.repeat(punti, quanti)
+        scostamento = np.arange(quanti.sum()) - np.repeat(np.cumsum(quanti) - quanti, quanti)
+        area = self.aree_celle[np.repeat(self.inizi_celle[cella], quanti) + scostamento]
+        riquadro = self.riquadri[area]
+        nel_riquadro = (
+            (longitudine[punto] >= riquadro[:, 0]) & (latitudine[punto] >= riquadro[:, 1])
+            & (longitudine[punto] <= riquadro[:, 2]) & (latitudine[punto] <= riquadro[:, 3])
+        )
+        punto, area = punto[nel_riquadro], area[nel_riquadro]
+
+        # test esatto, un'area alla volta su tutti i suoi punti candidati
+        ordine = np.argsort(area, kind = "stable")
+        punto, area = punto[ordine], area[ordine]
+        confini = np.flatnonzero(np.diff(area)) + 1
+        for blocco_punti, blocco_aree in zip(np.split(punto, confini), np.split(area, confini)):
+            if len(blocco_punti) == 0:
+                continue
+            dentro = self._dentro(blocco_aree[0], longitudine[blocco_punti], latitudine[blocco_punti])
+            liberi = blocco_punti[dentro & (risultato[blocco_punti] < 0)]
+            risultato[liberi] = blocco_aree[0]
+        return risultato
+
+    def assegna(self, longitudine, latitudine):
+        """
+        indice dell'area (posizione in self.codici) di ogni punto, -1 se fuori da tutte le aree;
+        le coordinate distinte vengono assegnate una volta sola e restano in cache
+        """
+        longitudine = np.asarray(longitudine, dtype = np.float64)
+        latitudine = np.asarray(latitudine, dtype = np.float64)
+        if len(longitudine) == 0:
+            return np.zeros(0, dtype = np.int64)
+        distinte, inversa = np.unique(np.column_stack([longitudine, latitudine]), axis = 0, return_inverse = True)
+        chiavi = list(map(tuple, distinte.tolist()))
+        nuove = [k for k, chiave in enumerate(chiavi) if chiave not in self._assegnati]
+        if nuove:
+            for chiave, area in zip([chiavi[k] for k in nuove], self._assegna(*distinte[nuove].T).tolist()):
+                self._assegnati[chiave] = area
+        return np.array([self._assegnati[chiave] for chiave in chiavi], dtype = np.int64)[inversa.ravel()]
+
+
+@memoizza(maxsize = 1)
+def carica_indice(sorgente = FILE_CONFINI):
+    """
+    indice spaziale delle aree dei CAP, costruito una volta per processo (con la sua cache delle coordinate)
+    """
+    return IndiceSpaziale(carica_topologia(sorgente))
+
+
+def tabella_aree(sorgente = FILE_CONFINI):
+    """
+    aree dei CAP con la superficie di terra: ZCTA5CE10, ALAND10 (m^2) e km2
+    """
+    proprieta = carica_topologia(sorgente).proprieta
+    return pl.DataFrame({
+        "ZCTA5CE10": [p["ZCTA5CE10"] for p in proprieta],
+        "ALAND10": [p["ALAND10"] for p in proprieta]
+    }).with_columns((pl.col("ALAND10") / 1e6).alias("km2"))
+
+
+def cap_per_citta(citta, sorgente = FILE_CONFINI):
+    """
+    area del CAP di ogni città: tabella (CityKey, ZCTA5CE10), con ZCTA5CE10 nullo per le coordinate che
+    non cadono in nessuna area e per le città non assegnabili, cioè senza coordinate valide o senza nome:
+    la geocodifica generica "CT\n(41.575155, -72.738288)" (città e contea nulle) è il centro dello stato,
+    non il luogo del decesso, e altrimenti finirebbe tutta nell'area che contiene quel punto
+    """
+    assegnabili = citta.filter(pl.col("CoordinateValide") & pl.col("Citta").is_not_null())
+    indice = carica_indice(sorgente)
+    aree = indice.assegna(assegnabili["Longitudine"].to_numpy(), assegnabili["Latitudine"].to_numpy())
+    codici = np.array(indice.codici + [None], dtype = object)
+    assegnate = pl.DataFrame({
+        "CityKey": assegnabili["CityKey"],
+        "ZCTA5CE10": pl.Series(codici[aree].tolist(), dtype = pl.Utf8)
+    })
+    return citta.select("CityKey").join(assegnate, on = "CityKey", how = "left")
+
+
+def assegna_morti(dati, citta, sorgente = FILE_CONFINI):
+    """
+    decessi per città del LazyFrame dati (colonna CityKey) con l'area del CAP di ogni città (vedi cap_per_citta):
+    tabella (CityKey, len, ZCTA5CE10); i decessi senza città hanno CityKey nullo
+    """
+    return (
+        dati
+        .group_by("CityKey")
+        .len()
+        .collect()
+        .with_columns(pl.col("CityKey").cast(citta["CityKey"].dtype))
+        .join(cap_per_citta(citta, sorgente), on = "CityKey", how = "left")
+    )
+
+
+def conta_per_area(assegnati, sorgente = FILE_CONFINI):
+    """
+    decessi per area del CAP a partire da quelli assegnati con assegna_morti: tabella
+    (ZCTA5CE10, ALAND10, km2, Morti, Morti per km2) con tutte le aree (zero morti comprese), dalla più colpita;
+    i decessi non assegnabili restano fuori
+    """
+    per_area = (
+        assegnati
+        .drop_nulls("ZCTA5CE10")
+        .group_by("ZCTA5CE10")
+        .agg(pl.col("len").sum().alias("Morti"))
+    )
+    return (
+        tabella_aree(sorgente)
+        .join(per_area, on = "ZCTA5CE10", how = "left")
+        .with_columns(pl.col("Morti").fill_null(0))
+        .with_columns((pl.col("Morti") / pl.col("km2")).alias("Morti per km2"))
+        .sort(["Morti", "ZCTA5CE10"], descending = [True, False])
+    )
+
+
+@memoizza(maxsize = 32)
+def _morti_per_citta(filtro = (), versione = None):
+    """
+    assegna_morti sui decessi del filtro globale, leggendo la sola colonna CityKey dal dataset partizionato
+    """
+    return assegna_morti(scan_filtrato(filtro, ["CityKey"]), carica_citta(compatto = True, versione = versione))
+
+
+def morti_non_assegnati(filtro = (), versione = None):
+    """
+    decessi con il filtro globale che non si possono assegnare a un'area del CAP (senza città, città non
+    assegnabile o coordinate fuori da tutte le aree), esclusi da morti_per_cap e morti_per_contea
+    """
+    return _morti_per_citta(filtro, versione).filter(pl.col("ZCTA5CE10").is_null())["len"].sum()
+
+
+@memoizza(maxsize = 32)
+def morti_per_cap(filtro = (), versione = None):
+    """
+    decessi per area del CAP con il filtro globale (vedi conta_per_area): i conteggi per città letti dal dataset
+    partizionato passano alle aree con un join su CityKey, i decessi non assegnabili restano fuori
+    (vedi morti_non_assegnati). In cache per versione del dataset (vedi versione_dataset) e filtro
+    """
+    return conta_per_area(_morti_per_citta(filtro, versione))
+
+
+@memoizza(maxsize = 32)
+def morti_per_contea(filtro = (), versione = None):
+    """
+    decessi per contea sommando le aree dei CAP, con le contee assegnate come nei confini di geometria.py
+    (vedi contea_per_area): tabella (Contea, km2, Morti, Morti per km2), dalla più colpita
+    """
+    contee = pl.DataFrame({
+        "ZCTA5CE10": [p["ZCTA5CE10"] for p in carica_topologia().proprieta],
+        "Contea": contea_per_area(carica_topologia(), carica_citta(compatto = True, versione = versione))
+    }, schema = {"ZCTA5CE10": pl.Utf8, "Contea": pl.Utf8})
+    return (
+        morti_per_cap(filtro, versione)
+        .join(contee, on = "ZCTA5CE10")
+        .group_by("Contea")
+        .agg([pl.col("km2").sum(), pl.col("Morti").sum()])
+        .with_columns((pl.col("Morti") / pl.col("km2")).alias("Morti per km2"))
+        .sort(["Morti", "Contea"], descending = [True, False])
+    )
@@ -1,6 +1,15 @@
 import streamlit as st
 
-def intro_barra_lat():
+from cubo import cubo_per, valori_dimensione
+from filtri import chiave_filtro, descrivi_filtro
+from memo import statistiche_cache
+
+
+def intro_barra_lat(cubi):
+    """
+    barra laterale con i link alle sezioni e il filtro globale (anni, contea, sesso, etnia);
+    le opzioni vengono lette dai cubi non filtrati (poche righe rispetto al dataset). Restituisce la chiave canonica del filtro (vedi filtri.py)
+    """
     st.sidebar.markdown("# 📊 Analisi statistica")
 
     st.sidebar.markdown("### Esplora")
@@ -11,4 +20,24 @@ def intro_barra_lat():
         - [Analisi esplorativa](#analisi-esplorativa)
         - [Analisi geografica](#analisi-geografica)
         - [Analisi statistica](#analisi-statistica)
-    """)
\ No newline at end of file
+    """)
+
+    # filtro globale: vale per tutte le sezioni della pagina
+    st.sidebar.markdown("### Filtri")
+    anni = sorted(cubo_per(cubi, ["Year"]).get_column("Year").unique().to_list())
+    intervallo = st.sidebar.slider("Anni", min_value = anni[0], max_value = anni[-1], value = (anni[0], anni[-1]))
+    contee = st.sidebar.multiselect("Contea", valori_dimensione(cubi, "Death County"))
+    sessi = st.sidebar.multiselect("Sesso", valori_dimensione(cubi, "Sex"))
+    etnie = st.sidebar.multiselect("Etnia", valori_dimensione(cubi, "Race"))
+
+    filtro = chiave_filtro(intervallo, anni, {"Death County": contee, "Sex": sessi, "Race": etnie})
+    st.sidebar.caption(f"Filtro attivo: {descrivi_filtro(filtro)}")
+    return filtro
+
+
+def statistiche_barra_lat():
+    """
+    contatori delle cache memoizzate (vedi memo.py), aggiornati all'ultimo caricamento completo della pagina
+    """
+    with st.sidebar.expander("Statistiche delle cache"):
+        st.dataframe(statistiche_cache(), hide_index = True)
@@ -0,0 +1,420 @@
+"""
+Benchmark della fase di preprocessing: confronta la vecchia pipeline eager
+(polars -> pandas -> polars, un with_columns per droga) con il piano lazy unico di preprocessing.py.
+
+Con --scale esegue invece la suite di scalabilità: per ogni scala genera (se manca) un csv sintetico
+con genera_dati.py e misura l'ingestione e ogni funzione di analisi, per vedere dove le cose si rompono
+prima che i dati reali crescano. Le sezioni dell'app in bare mode calcolano solo la parte fuori dai fragment,
+quindi i motori dei blocchi interattivi (correlazioni, serie temporali, itemset, densità, aree dei CAP)
+hanno passi a parte, che li chiamano direttamente sul dataset sintetico della scala.
+
+Ogni misura gira in un sottoprocesso separato, così il picco di memoria (ru_maxrss)
+è quello della sola pipeline misurata e non viene sporcato dalle altre.
+
+uso:
+    python benchmark.py --csv drug_deaths.csv --ripetizioni 5
+    python benchmark.py --csv drug_deaths.csv --scale 10 100 1000 --timeout 600
+"""
+
+import argparse
+import json
+import logging
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import polars as pl
+
+from preprocessing import (
+    FILE_DATI, carica_aggregati_snapshot, carica_citta_snapshot, carica_dataset_snapshot, carica_snapshot,
+    costruisci_aggregati, get_droghe, pulisci_dati, scan_dati
+)
+
+
+def pulisci_dati_vecchia(percorso):
+    """
+    copia della vecchia pipeline eager (con il passaggio da pandas), tenuta solo come riferimento per il confronto
+    """
+    dati = pl.read_csv(percorso, ignore_errors = True) # carico i dati
+
+    # conversione del formato della colonna Date e rimozione dei valori nulli
+    dati = dati.with_columns(
+        # creo una nuova colonna con le date in formato datetime
+        pl.col("Date").str.strptime(pl.Datetime, format="%m/%d/%Y")
+    )
+
+    # fase di pulizia/riordino del dataset
+    dati = (dati
+            .with_columns([
+                pl.col("Age").fill_null(strategy="mean"), # sostituisco gli NA in Age con la media generale (solo 3 valori mancanti, quindi non inficia sui risultati finali)
+                # Rimpiazzo valori nulli in alcune colonne (utili alle successive analisi) con "unknown"
+                pl.col("Sex").fill_null("Unknown"),
+                pl.col("Race").fill_null("Unknown"),
+                pl.col("Death County").fill_null("Unknown"),
+                # Creazione di colonne separate per anno, mese e trimestre
+                # utile per analisi di serie storiche
+                pl.col("Date").dt.year().alias("Year").cast(pl.Int64),
+                pl.col("Date").dt.month().alias("Month").cast(pl.Int64),
+                pl.col("Date").dt.day().alias("Day").cast(pl.Int64),
+                pl.col("Date").dt.month().alias("Month_num").cast(pl.Int64),
+                pl.col("Date").dt.day().alias("Day_num").cast(pl.Int64),
+                pl.col("Date").dt.quarter().alias("Quarter").cast(pl.Int64), # aggiungo anche il trimestre (= quarter in inglese)
+                pl.col("Date").dt.weekday().alias("DayOfWeek").cast(pl.Int64)
+
+            ])
+    )
+
+    dati = dati.with_columns((pl.col("Year") * 100 + pl.col("Month_num")).alias("YearMonth"))
+
+    # creo un dizionario per la mappare i giorni della settimana salvati nella varaiabile DayOfWeek
+    giorno_settimana = {
+        0: "Lunedì",
+        1: "Martedì",
+        2: "Mercoledì",
+        3: "Giovedì",
+        4: "Venerdì",
+        5: "Sabato",
+        6: "Domenica"
+    }
+
+    nomi_mesi = {
+        1: "Gennaio",
+        2: "Febbraio",
+        3: "Marzo",
+        4: "Aprile",
+        5: "Maggio",
+        6: "Giugno",
+        7: "Luglio",
+        8: "Agosto",
+        9: "Settembre",
+        10: "Ottobre",
+        11: "Novembre",
+        12: "Dicembre"
+    }
+
+    # converto il dataset in un dataframe pandas per poter applicare map
+    dati_pd = dati.to_pandas()
+
+    dati_pd["DayOfWeek"] = dati_pd["DayOfWeek"].map(giorno_settimana)
+    dati_pd["Month"] = dati_pd["Month"].map(nomi_mesi)
+
+    # ritorno a un dataframe polars
+    dati = pl.from_pandas(dati_pd)
+
+    # conversione dei valori delle colonne relative alle droghe in valori binari, questo per comodità nei successivi calcoli
+    # (Y = 1, altrimenti = 0)
+    colonne_droga = get_droghe()
+    for droga in colonne_droga:
+        dati =  dati.with_columns(
+            pl.when(pl.col(droga) == "Y").then(1).otherwise(0).alias(droga)
+        )
+
+    # conversione di formato dei valori di alcune variaili
+    dati = dati.with_columns([
+                pl.col("Age").cast(pl.Int64),
+                pl.col("Death County").cast(pl.Utf8),
+                pl.col("Sex").cast(pl.Utf8)
+    ])
+
+    # estraggo la latitudine e la longitudine
+    dati = dati.with_columns([
+        pl.col("DeathCityGeo")
+        .str.extract(r"\(([^,]+), ([^)]+)\)", 1)
+        .cast(pl.Float64)
+        .alias("Latitudine"),
+
+        pl.col("DeathCityGeo")
+        .str.extract(r"\(([^,]+), ([^)]+)\)", 2)
+        .cast(pl.Float64)
+        .alias("Longitudine")
+    ])
+
+    # dato che colonne relative alla data create prima vengono messe alla fine, le sposto all'inizio per una migliore visualizzazione
+
+    dati = dati.drop("Year").insert_column(3, dati.get_column("Year"))
+    dati = dati.drop("Month").insert_column(4, dati.get_column("Month"))
+    dati = dati.drop("Month_num").insert_column(5, dati.get_column("Month_num"))
+    dati = dati.drop("Quarter").insert_column(6, dati.get_column("Quarter"))
+    dati = dati.drop("Day").insert_column(7, dati.get_column("Day"))
+    dati = dati.drop("Day_num").insert_column(8, dati.get_column("Day_num"))
+    dati = dati.drop("DayOfWeek").insert_column(9, dati.get_column("DayOfWeek"))
+
+    return dati
+
+
+PIPELINE = {
+    "vecchia": pulisci_dati_vecchia,
+    "nuova": pulisci_dati
+}
+
+
+def _passo_ingestione(percorso, cartella):
+    # ingestione a freddo: csv -> snapshot (schema compatto, come l'app)
+    shutil.rmtree(cartella, ignore_errors = True)
+    return lambda: carica_snapshot(percorso, cartella, compatto = True).height
+
+
+def _passo_cubo(percorso, cartella):
+    dati = carica_snapshot(percorso, cartella, compatto = True)
+    return lambda: sum(cubo.height for cubo in costruisci_aggregati(dati).values())
+
+
+def _passo_esplorativa(percorso, cartella):
+    from analisi_esplorativa import analisi_esplorativa
+
+    dati = carica_snapshot(percorso, cartella, compatto = True)
+    cubi = carica_aggregati_snapshot(percorso, cartella, compatto = True)
+
+    def esegui():
+        analisi_esplorativa(dati, get_droghe(), cubi)
+        return dati.height
+    return esegui
+
+
+def _passo_geografica(percorso, cartella):
+    from analisi_geografica import analisi_spaziale
+
+    dati = carica_snapshot(percorso, cartella, compatto = True)
+    cubi = carica_aggregati_snapshot(percorso, cartella, compatto = True)
+    citta = carica_citta_snapshot(percorso, cartella, compatto = True)
+
+    def esegui():
+        analisi_spaziale(dati, cubi, citta)
+        return dati.height
+    return esegui
+
+
+def _passo_correlazioni(percorso, cartella):
+    from correlazioni import METODI, matrice_correlazione
+
+    # il dataset partizionato della scala, non quello dell'app in cache/ (la lettura avviene dentro la misura)
+    cartella_dataset = carica_dataset_snapshot(percorso, cartella, compatto = True)
+    colonne = ["Age", "Year"] + get_droghe()
+    dati = scan_dati(colonne = colonne, compatto = True, cartella_dataset = cartella_dataset)
+
+    def esegui():
+        for metodo in METODI:
+            matrice_correlazione(dati, colonne, metodo)
+        return len(colonne)
+    return esegui
+
+
+def _passo_serie(percorso, cartella):
+    from serie_temporali import GRANULARITA, SerieGiornaliere
+
+    dati = carica_snapshot(percorso, cartella, compatto = True)
+
+    def esegui():
+        serie = SerieGiornaliere.da_dati(dati, get_droghe())
+        for granularita in GRANULARITA:
+            serie.media_mobile(7, granularita)
+        serie.variazione_annua()
+        serie.profilo_stagionale()
+        serie.cumulata(per_anno = True)
+        return len(serie.nomi)
+    return esegui
+
+
+def _passo_itemset(percorso, cartella):
+    from itemset import ItemsetDroghe
+
+    cartella_dataset = carica_dataset_snapshot(percorso, cartella, compatto = True)
+    dati = scan_dati(colonne = ["DrugMask", "Year"], compatto = True, cartella_dataset = cartella_dataset)
+
+    def esegui():
+        itemset = ItemsetDroghe.da_dati(dati.collect(), get_droghe())
+        itemset.andamento(0.02, 3, 5)
+        return itemset.regole(0.02, 0.5, 1.0, 5).height
+    return esegui
+
+
+def _passo_densita(percorso, cartella):
+    from densita import StimaKDE, celle_non_vuote, griglia, larghezza_banda, punti_pesati
+
+    cartella_dataset = carica_dataset_snapshot(percorso, cartella, compatto = True)
+    dati = scan_dati(colonne = ["CityKey"], compatto = True, cartella_dataset = cartella_dataset)
+    citta = carica_citta_snapshot(percorso, cartella, compatto = True)
+
+    def esegui():
+        longitudine, latitudine, pesi = punti_pesati(dati, citta)
+        celle = celle_non_vuote(*griglia(longitudine, latitudine, 0.02, pesi))
+        stima = StimaKDE(longitudine, latitudine, larghezza_banda(longitudine, latitudine, pesi), pesi)
+        stima.valuta(longitudine, latitudine)
+        return celle.height
+    return esegui
+
+
+def _passo_aree_cap(percorso, cartella):
+    from aree_cap import assegna_morti, carica_indice, conta_per_area
+
+    cartella_dataset = carica_dataset_snapshot(percorso, cartella, compatto = True)
+    dati = scan_dati(colonne = ["CityKey"], compatto = True, cartella_dataset = cartella_dataset)
+    citta = carica_citta_snapshot(percorso, cartella, compatto = True)
+    carica_indice() # l'indice spaziale si costruisce una volta per processo, come nell'app
+
+    def esegui():
+        return conta_per_area(assegna_morti(dati, citta)).height
+    return esegui
+
+
+# passi della suite di scalabilità: ognuno prepara i suoi input (fuori dalla misura)
+# e restituisce la funzione da cronometrare
+PASSI = {
+    "ingestione": _passo_ingestione,
+    "cubo": _passo_cubo,
+    "analisi_esplorativa": _passo_esplorativa,
+    "analisi_spaziale": _passo_geografica,
+    "correlazioni": _passo_correlazioni,
+    "serie_temporali": _passo_serie,
+    "itemset": _passo_itemset,
+    "densita": _passo_densita,
+    "aree_cap": _passo_aree_cap
+}
+
+
+def _rss_mb():
+    # su linux ru_maxrss è in kilobyte
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def misura(nome, percorso):
+    """
+    esegue una volta la pipeline indicata e restituisce tempo e picco di memoria
+    """
+    rss_iniziale = _rss_mb()
+    inizio = time.perf_counter()
+    dati = PIPELINE[nome](percorso)
+    secondi = time.perf_counter() - inizio
+
+    return {
+        "pipeline": nome,
+        "righe": dati.height,
+        "secondi": secondi,
+        "picco_rss_mb": _rss_mb(),
+        "delta_rss_mb": _rss_mb() - rss_iniziale
+    }
+
+
+def misura_passo(nome, percorso, cartella):
+    """
+    esegue una volta il passo indicato della suite di scalabilità e restituisce tempo e picco di memoria
+    """
+    # le funzioni di analisi girano senza il server di streamlit ("bare mode"): i comandi st.* non
+    # disegnano nulla ma il calcolo avviene comunque, tolgo solo gli avvisi che ne derivano
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+    esegui = PASSI[nome](percorso, cartella)
+    rss_iniziale = _rss_mb()
+    inizio = time.perf_counter()
+    righe = esegui()
+    secondi = time.perf_counter() - inizio
+
+    return {
+        "passo": nome,
+        "righe": righe,
+        "secondi": secondi,
+        "picco_rss_mb": _rss_mb(),
+        "delta_rss_mb": _rss_mb() - rss_iniziale
+    }
+
+
+def suite_scalabilita(csv, scale, cartella, ripetizioni, timeout):
+    """
+    per ogni scala genera il csv sintetico (se non c'è già) ed esegue tutti i PASSI in sottoprocessi;
+    un passo che supera il timeout o termina con errore viene segnato come tale e la suite prosegue
+    """
+    from genera_dati import genera
+
+    cartella = Path(cartella)
+    risultati = []
+    for scala in scale:
+        scala = int(scala) if scala == int(scala) else scala
+        percorso = cartella / f"{Path(csv).stem}_x{scala}.csv"
+        if not percorso.exists():
+            genera(csv, scala, percorso)
+        cartella_cache = cartella / f"cache_x{scala}"
+
+        for nome in PASSI:
+            for _ in range(ripetizioni):
+                comando = [
+                    sys.executable, __file__, "--passo", nome,
+                    "--csv", str(percorso), "--cartella", str(cartella_cache)
+                ]
+                try:
+                    esito = subprocess.run(comando, capture_output = True, text = True, timeout = timeout)
+                except subprocess.TimeoutExpired:
+                    risultati.append({"scala": scala, "passo": nome, "esito": f"timeout ({timeout} s)"})
+                    break
+                if esito.returncode != 0:
+                    errore = (esito.stderr.strip().splitlines() or ["?"])[-1]
+                    risultati.append({"scala": scala, "passo": nome, "esito": f"errore: {errore}"})
+                    break
+                risultati.append({"scala": scala, "esito": "ok", **json.loads(esito.stdout.strip().splitlines()[-1])})
+
+    riepilogo = (
+        pl.DataFrame(risultati, infer_schema_length = None)
+        .group_by(["scala", "passo"], maintain_order = True)
+        .agg([
+            pl.col("esito").last(),
+            pl.col("righe").first(),
+            pl.col("secondi").median().alias("secondi (mediana)"),
+            pl.col("picco_rss_mb").max().alias("picco RSS (MB)"),
+            pl.col("delta_rss_mb").max().alias("delta RSS (MB)")
+        ])
+    )
+    with pl.Config(tbl_rows = -1, tbl_cols = -1, fmt_str_lengths = 80):
+        print(riepilogo)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "benchmark della pipeline di preprocessing")
+    parser.add_argument("--csv", default = FILE_DATI)
+    parser.add_argument("--ripetizioni", type = int, default = 3)
+    parser.add_argument("--scale", type = float, nargs = "+", help = "esegue la suite di scalabilità alle scale indicate (es. 10 100 1000)")
+    parser.add_argument("--cartella", default = "dati_sintetici", help = "dove salvare csv sintetici e artefatti della suite")
+    parser.add_argument("--timeout", type = float, default = 1800, help = "secondi massimi per ogni passo della suite")
+    parser.add_argument("--esegui", choices = list(PIPELINE), help = argparse.SUPPRESS) # usato dai sottoprocessi
+    parser.add_argument("--passo", choices = list(PASSI), help = argparse.SUPPRESS) # usato dai sottoprocessi della suite
+    args = parser.parse_args()
+
+    if args.esegui:
+        print(json.dumps(misura(args.esegui, args.csv)))
+        return
+
+    if args.passo:
+        print(json.dumps(misura_passo(args.passo, args.csv, args.cartella)))
+        return
+
+    if args.scale:
+        suite_scalabilita(args.csv, args.scale, args.cartella, args.ripetizioni, args.timeout)
+        return
+
+    risultati = []
+    for nome in PIPELINE:
+        for _ in range(args.ripetizioni):
+            esito = subprocess.run(
+                [sys.executable, __file__, "--csv", args.csv, "--esegui", nome],
+                capture_output = True, text = True, check = True
+            )
+            risultati.append(json.loads(esito.stdout.strip().splitlines()[-1]))
+
+    riepilogo = (
+        pl.DataFrame(risultati)
+        .group_by("pipeline", maintain_order = True)
+        .agg([
+            pl.col("righe").first(),
+            pl.col("secondi").median().alias("secondi (mediana)"),
+            pl.col("secondi").min().alias("secondi (min)"),
+            pl.col("picco_rss_mb").max().alias("picco RSS (MB)"),
+            pl.col("delta_rss_mb").max().alias("delta RSS (MB)")
+        ])
+    )
+    with pl.Config(tbl_rows = -1, tbl_cols = -1):
+        print(riepilogo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Funzioni comuni per gli artefatti in cache su disco (snapshot, dataset partizionato, confini, tessere).
+
+Ogni artefatto è accompagnato da un manifesto json con la chiave da cui è stato costruito (hash della sorgente,
+versione del codice che lo produce, ...): se il manifesto corrisponde alla chiave attuale l'artefatto si legge
+da disco, altrimenti si ricostruisce. I file vengono sempre scritti in modo atomico.
+"""
+
+import hashlib
+import json
+import os
+
+
+def hash_file(percorso):
+    """
+    calcola l'hash sha256 del file letto a blocchi, usato come chiave degli artefatti costruiti a partire dal file
+    """
+    h = hashlib.sha256()
+    with open(percorso, "rb") as file:
+        for blocco in iter(lambda: file.read(1 << 20), b""):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def scrivi_atomico(percorso, scrivi):
+    """
+    scrive prima su un file temporaneo e poi lo rinomina, così un processo che sta
+    leggendo (o ha in memory-map) il vecchio file non vede mai un file scritto a metà
+    """
+    temporaneo = percorso.with_name(percorso.name + ".tmp")
+    scrivi(temporaneo)
+    os.replace(temporaneo, percorso)
+
+
+def leggi_manifesto(manifesto):
+    """
+    legge il manifesto json di un artefatto (dizionario vuoto se non esiste)
+    """
+    if not manifesto.exists():
+        return {}
+    with open(manifesto, "r") as file:
+        return json.load(file)
+
+
+def corrisponde(salvata, chiave):
+    """
+    controlla che il manifesto letto corrisponda alla chiave attuale
+    """
+    return bool(salvata) and all(salvata.get(k) == v for k, v in chiave.items())
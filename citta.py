@@ -0,0 +1,117 @@
+"""
+Tabella dimensionale delle città di decesso.
+
+La colonna DeathCityGeo (es. "Norwalk, CT 06850\n(41.11805, -73.412906)") ha poche centinaia di valori
+distinti, quindi invece di applicare le regex a ogni riga la tabella delle città contiene un'unica riga
+per valore distinto, già interpretato una volta sola: chiave intera (CityKey), città, contea, CAP
+(se presente), latitudine, longitudine e un flag di validità delle coordinate.
+Il dataset tiene solo CityKey, e filtri e mappe diventano join o ricerche per chiave su questa tabella.
+"""
+
+import polars as pl
+
+# bounding box approssimativo del Connecticut (latitudine, longitudine)
+LATITUDINE_CT = (40.9, 42.1)
+LONGITUDINE_CT = (-73.8, -71.7)
+
+SCHEMA_CITTA = {
+    "CityKey": pl.UInt32,
+    "DeathCityGeo": pl.Utf8,
+    "Citta": pl.Utf8,
+    "Contea": pl.Utf8,
+    "CAP": pl.Utf8,
+    "Latitudine": pl.Float64,
+    "Longitudine": pl.Float64,
+    "CoordinateValide": pl.Boolean
+}
+
+
+def _interpreta(valori):
+    """
+    interpreta i valori distinti di DeathCityGeo (colonne DeathCityGeo e Contea) con le regex, una volta per valore
+    """
+    prima_riga = pl.col("DeathCityGeo").str.split("\n").list.first()
+    return (
+        valori
+        .with_columns([
+            prima_riga.str.extract(r"^(.+?),\s*[A-Z]{2}\b").str.strip_chars().alias("Citta"),
+            prima_riga.str.extract(r"\b(\d{5})\b").alias("CAP"),
+            pl.col("DeathCityGeo")
+            .str.extract_groups(r"\((?<Latitudine>-?\d+\.\d+), (?<Longitudine>-?\d+\.\d+)\)")
+            .alias("_coordinate")
+        ])
+        .unnest("_coordinate")
+        .with_columns(pl.col(["Latitudine", "Longitudine"]).cast(pl.Float64))
+        .with_columns(
+            (pl.col("Latitudine").is_not_null() & pl.col("Longitudine").is_not_null()).alias("CoordinateValide")
+        )
+    )
+
+
+def aggiorna_citta(citta, sorgente):
+    """
+    aggiunge alla tabella delle città (None se non esiste ancora) i valori di DeathCityGeo presenti nel
+    LazyFrame grezzo sorgente e non ancora in tabella; le chiavi già assegnate non cambiano, quelle nuove
+    proseguono la numerazione (in ordine alfabetico), così snapshot e delta restano coerenti
+
+    la contea di una città è quella più frequente tra i suoi decessi
+    """
+    if citta is None:
+        citta = pl.DataFrame(schema = SCHEMA_CITTA)
+
+    nuove = (
+        sorgente
+        .filter(pl.col("DeathCityGeo").is_not_null())
+        .group_by("DeathCityGeo")
+        .agg(pl.col("Death County").drop_nulls().mode().sort().first().alias("Contea"))
+        .join(citta.lazy().select("DeathCityGeo"), on = "DeathCityGeo", how = "anti")
+        .sort("DeathCityGeo")
+        .collect()
+    )
+    if nuove.height == 0:
+        return citta
+
+    nuove = (
+        _interpreta(nuove)
+        .with_row_index("CityKey", offset = citta.height)
+        .select([pl.col(nome).cast(tipo) for nome, tipo in SCHEMA_CITTA.items()])
+    )
+    return pl.concat([citta, nuove])
+
+
+def chiavi_valide(citta):
+    """
+    chiavi delle città con coordinate valide (per filtrare il dataset con un is_in sugli interi)
+    """
+    return citta.filter(pl.col("CoordinateValide"))["CityKey"]
+
+
+def coordinate(citta, chiavi):
+    """
+    latitudine e longitudine (array numpy) corrispondenti a un array di CityKey, con una ricerca per indice
+    (le chiavi sono consecutive a partire da 0, quindi coincidono con la posizione nella tabella)
+    """
+    return citta["Latitudine"].to_numpy()[chiavi], citta["Longitudine"].to_numpy()[chiavi]
+
+
+def morti_per_citta(dati, citta):
+    """
+    decessi per città (solo quelle con coordinate valide): numero di morti, età media e morti per sesso,
+    con nome, contea e coordinate prese dalla tabella delle città; una riga per città, dalla più colpita
+    """
+    return (
+        dati
+        .group_by("CityKey")
+        .agg([
+            pl.len().alias("Morti"),
+            pl.col("Age").mean().round(1).alias("Età media"),
+            (pl.col("Sex") == "Male").sum().alias("Maschi"),
+            (pl.col("Sex") == "Female").sum().alias("Femmine")
+        ])
+        .with_columns(pl.col("CityKey").cast(SCHEMA_CITTA["CityKey"]))
+        .join(
+            citta.filter(pl.col("CoordinateValide")).select(["CityKey", "Citta", "Contea", "Latitudine", "Longitudine"]),
+            on = "CityKey"
+        )
+        .sort("Morti", descending = True)
+    )
@@ -0,0 +1,177 @@
+"""
+Motore per le matrici di correlazione (Pearson/phi, Spearman, Kendall) tra le variabili numeriche
+e i flag binari delle droghe.
+
+Le colonne richieste (poche colonne numeriche nello schema compatto) vengono lette una volta sola e scorse
+a blocchi di righe; per ogni blocco si accumulano solo le statistiche sufficienti, quindi le matrici float64
+intermedie non dipendono dal numero di righe:
+    - Pearson: numero di righe, somme e matrice dei prodotti X^T X (un solo prodotto matriciale per blocco);
+      sui flag 0/1 delle droghe il coefficiente di Pearson coincide con il phi
+    - Spearman: Pearson sui ranghi medi, ricavati una volta sola dai valori distinti di ogni colonna
+      (poche decine per colonna: età, anno, flag)
+    - Kendall (tau-b): tabelle di contingenza tra i valori distinti di ogni coppia di colonne,
+      da cui si contano coppie concordanti, discordanti e parimerito senza confrontare le righe a due a due
+
+Le righe con valori nulli vengono scartate (come se fossero assenti in tutte le colonne).
+"""
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from filtri import scan_filtrato
+
+METODI = ["pearson", "spearman", "kendall"]
+
+# righe convertite in float64 alla volta
+RIGHE_PER_BLOCCO = 1_000_000
+
+
+def blocchi(dati, colonne, righe_per_blocco = RIGHE_PER_BLOCCO):
+    """
+    colonne richieste dal LazyFrame dati a blocchi di righe, come matrici numpy float64: le colonne vengono lette
+    con una sola passata sui dati e poi scorse a blocchi con iter_slices (viste senza copia)
+    """
+    tabella = dati.select(colonne).drop_nulls().collect()
+    for blocco in tabella.iter_slices(righe_per_blocco):
+        yield blocco.to_numpy().astype(np.float64)
+
+
+def valori_distinti(dati, colonne):
+    """
+    per ogni colonna: valori distinti ordinati e relativo numero di righe (righe con nulli escluse)
+    """
+    dati = dati.select(colonne).drop_nulls()
+    distinti = {}
+    for colonna in colonne:
+        conteggi = dati.group_by(colonna).len().sort(colonna).collect()
+        distinti[colonna] = (conteggi[colonna].to_numpy().astype(np.float64), conteggi["len"].to_numpy())
+    return distinti
+
+
+def pearson(blocchi_dati):
+    """
+    matrice di correlazione di Pearson accumulando n, somme e X^T X blocco per blocco;
+    i dati vengono traslati della media del primo blocco, così le somme dei quadrati restano piccole
+    e la differenza finale non perde precisione (anno ~ 2000, varianza ~ 10)
+    """
+    n, traslazione, somme, prodotti = 0, None, None, None
+    for x in blocchi_dati:
+        if traslazione is None:
+            traslazione = x.mean(axis = 0)
+            somme = np.zeros(x.shape[1])
+            prodotti = np.zeros((x.shape[1], x.shape[1]))
+        x = x - traslazione
+        n += x.shape[0]
+        somme += x.sum(axis = 0)
+        prodotti += x.T @ x
+
+    if n < 2:
+        raise ValueError("servono almeno due righe per calcolare le correlazioni")
+
+    covarianza = prodotti - np.outer(somme, somme) / n
+    deviazioni = np.sqrt(np.diag(covarianza))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        correlazione = covarianza / np.outer(deviazioni, deviazioni)
+    # colonne costanti: correlazione non definita (come in pandas)
+    correlazione[deviazioni == 0, :] = np.nan
+    correlazione[:, deviazioni == 0] = np.nan
+    return np.clip(correlazione, -1, 1)
+
+
+def _ranghi_medi(conteggi):
+    # rango medio di ogni valore distinto: righe con valore minore + (righe con lo stesso valore + 1) / 2
+    return np.cumsum(conteggi) - conteggi + (conteggi + 1) / 2
+
+
+def spearman(blocchi_dati, distinti):
+    """
+    Spearman = Pearson sui ranghi medi; ogni valore viene sostituito dal suo rango con una ricerca
+    binaria sui valori distinti, quindi anche i ranghi si calcolano blocco per blocco
+    """
+    valori = [v for v, _ in distinti.values()]
+    ranghi = [_ranghi_medi(c) for _, c in distinti.values()]
+
+    def blocchi_ranghi():
+        for x in blocchi_dati:
+            yield np.column_stack([
+                ranghi[j][np.searchsorted(valori[j], x[:, j])] for j in range(x.shape[1])
+            ])
+
+    return pearson(blocchi_ranghi())
+
+
+def _tau_b(tabella):
+    """
+    tau-b di Kendall da una tabella di contingenza (righe: valori ordinati di x, colonne: valori ordinati di y)
+    """
+    tabella = tabella.astype(np.float64)
+    n = tabella.sum()
+
+    # per ogni cella, numero di righe con x e y entrambi maggiori (concordanti) o x maggiore e y minore (discordanti)
+    suffissi = tabella[::-1, ::-1].cumsum(axis = 0).cumsum(axis = 1)[::-1, ::-1] # somma su i' >= i, j' >= j
+    sotto = np.zeros_like(tabella)
+    sotto[:-1, :-1] = suffissi[1:, 1:]
+    prefissi = tabella[::-1, :].cumsum(axis = 0)[::-1, :].cumsum(axis = 1) # somma su i' >= i, j' <= j
+    sopra = np.zeros_like(tabella)
+    sopra[:-1, 1:] = prefissi[1:, :-1]
+
+    concordanti = (tabella * sotto).sum()
+    discordanti = (tabella * sopra).sum()
+
+    coppie = n * (n - 1) / 2
+    parimerito_x = (tabella.sum(axis = 1) * (tabella.sum(axis = 1) - 1) / 2).sum()
+    parimerito_y = (tabella.sum(axis = 0) * (tabella.sum(axis = 0) - 1) / 2).sum()
+    denominatore = np.sqrt((coppie - parimerito_x) * (coppie - parimerito_y))
+
+    return (concordanti - discordanti) / denominatore if denominatore > 0 else np.nan
+
+
+def kendall(blocchi_dati, distinti):
+    """
+    tau-b di Kendall per ogni coppia di colonne, dalle tabelle di contingenza accumulate blocco per blocco
+    (ogni valore viene codificato con la sua posizione tra i valori distinti della colonna)
+    """
+    valori = [v for v, _ in distinti.values()]
+    k = len(valori)
+    tabelle = {(i, j): np.zeros((len(valori[i]), len(valori[j])), dtype = np.int64) for i in range(k) for j in range(i + 1, k)}
+
+    for x in blocchi_dati:
+        codici = [np.searchsorted(valori[j], x[:, j]) for j in range(k)]
+        for (i, j), tabella in tabelle.items():
+            dimensione = tabella.shape[1]
+            tabella += np.bincount(codici[i] * dimensione + codici[j], minlength = tabella.size).reshape(tabella.shape)
+
+    correlazione = np.eye(k)
+    for (i, j), tabella in tabelle.items():
+        correlazione[i, j] = correlazione[j, i] = _tau_b(tabella)
+    return correlazione
+
+
+def matrice_correlazione(dati, colonne, metodo = "pearson", righe_per_blocco = RIGHE_PER_BLOCCO):
+    """
+    matrice di correlazione (numpy, colonne x colonne) tra le colonne del LazyFrame dati con il metodo indicato
+    """
+    if metodo not in METODI:
+        raise ValueError(f"metodo non valido: {metodo} (disponibili: {METODI})")
+
+    blocchi_dati = blocchi(dati, colonne, righe_per_blocco)
+    if metodo == "pearson":
+        return pearson(blocchi_dati)
+
+    distinti = valori_distinti(dati, colonne)
+    if metodo == "spearman":
+        return spearman(blocchi_dati, distinti)
+    return kendall(blocchi_dati, distinti)
+
+
+@st.cache_data(show_spinner = "Calcolo della matrice di correlazione...")
+def carica_correlazioni(colonne, metodo = "pearson", filtro = (), versione = None):
+    """
+    matrice di correlazione tra le colonne indicate del dataset partizionato (stesso schema compatto usato da app.py),
+    ristretto al filtro globale (vedi filtri.py), calcolata una volta per versione del dataset (vedi versione_dataset)
+    e combinazione di colonne, metodo e filtro; restituita come DataFrame pandas per lo styling
+    """
+    colonne = list(colonne)
+    matrice = matrice_correlazione(scan_filtrato(filtro, colonne), colonne, metodo)
+    return pd.DataFrame(matrice, index = colonne, columns = colonne)
@@ -0,0 +1,134 @@
+"""
+Cubi materializzati delle morti.
+
+Invece di un solo cubo su tutte le dimensioni (che con città, luogo e giorno della settimana ha quasi
+una cella per riga del dataset) si costruiscono alcuni cubi stretti, ognuno sulle poche dimensioni che servono
+a una famiglia di grafici (vedi CUBI): tempo, giorni della settimana, persone, città e luoghi. Per ogni
+combinazione si tiene il numero di morti, la somma delle età e il numero di morti per droga.
+Ogni grafico si ottiene poi "arrotolando" il cubo più piccolo che contiene le dimensioni richieste con aggrega(),
+cioè con un group_by/sum su poche centinaia di righe già aggregate invece che sull'intero dataset.
+Le dimensioni DERIVATE (es. LocationCategory) non stanno nei cubi: vengono ricavate al momento della query
+dalla dimensione da cui dipendono (vedi dimensioni.py).
+"""
+
+import polars as pl
+
+from dimensioni import tabella_luoghi
+
+# cubi materializzati: nome -> dimensioni
+CUBI = {
+    "tempo": ["Year", "Month", "Sex"],
+    "giorni": ["DayOfWeek", "Sex"],
+    "persone": ["Sex", "Race", "AgeBand"],
+    "citta": ["Death County", "Death City", "Sex"],
+    "citta_anni": ["Year", "Death County", "Death City"],
+    "luoghi": ["Location"]
+}
+
+# dimensioni ricavate al momento della query: dimensione derivata -> dimensione del cubo da cui dipende
+DERIVATE = {"LocationCategory": "Location"}
+
+
+def costruisci_cubo(dati, dimensioni, colonne_droga):
+    """
+    costruisce un cubo: un group_by sulle dimensioni con conteggio, somma delle età e morti per droga
+    """
+    return (
+        dati
+        .group_by(dimensioni)
+        .agg([
+            pl.len().cast(pl.Int64).alias("Morti totali"),
+            pl.col("Age").cast(pl.Int64).sum().alias("Somma età"),
+            pl.col(colonne_droga).cast(pl.Int64).sum()
+        ])
+    )
+
+
+def costruisci_cubi(dati, colonne_droga):
+    """
+    costruisce tutti i CUBI, calcolati insieme in parallelo a partire dallo stesso dataset
+    """
+    piani = [costruisci_cubo(dati.lazy(), dimensioni, colonne_droga) for dimensioni in CUBI.values()]
+    return dict(zip(CUBI, pl.collect_all(piani)))
+
+
+def unisci_cubi(vecchi, nuovi):
+    """
+    somma due insiemi di cubi (es. storico + nuovi record) sommando le misure delle celle in comune
+    """
+    return {
+        nome: (
+            pl.concat([vecchi[nome], nuovi[nome]])
+            .group_by(dimensioni)
+            .agg(pl.exclude(dimensioni).sum())
+        )
+        for nome, dimensioni in CUBI.items()
+    }
+
+
+def cubo_per(cubi, dimensioni):
+    """
+    il cubo più piccolo che contiene tutte le dimensioni richieste; le dimensioni DERIVATE vengono aggiunte
+    al cubo che contiene la dimensione da cui dipendono, con un join sui suoi valori distinti
+    """
+    necessarie = {DERIVATE.get(dimensione, dimensione) for dimensione in dimensioni}
+    candidati = [cubo for cubo in cubi.values() if necessarie <= set(cubo.columns)]
+    if not candidati:
+        raise ValueError(f"nessun cubo contiene le dimensioni {sorted(necessarie)} (cubi: {CUBI})")
+    cubo = min(candidati, key=lambda c: c.height)
+    if "LocationCategory" in dimensioni:
+        cubo = cubo.join(tabella_luoghi(cubo), on="Location", how="left")
+    return cubo
+
+
+def aggrega(cubi, per, misure=("Morti totali",)):
+    """
+    roll-up dei cubi sulle dimensioni 'per', sommando le misure richieste
+    """
+    return cubo_per(cubi, per).group_by(per).agg(pl.col(list(misure)).sum())
+
+
+def conta_droghe_per(dati, dimensione, colonne_droga):
+    """
+    numero di morti per ogni droga lungo una dimensione, in formato lungo (colonne: dimensione, Droga, Conteggio)
+    con un solo group_by/sum sulle colonne delle droghe seguito da un unpivot
+
+    dati può essere il dataset (flag 0/1) o il dizionario dei cubi (conteggi per droga), dato che le colonne hanno
+    lo stesso nome; dimensione è il nome di una colonna o un'espressione con alias (es. per raggruppare alcune categorie)
+    """
+    nome = dimensione if isinstance(dimensione, str) else dimensione.meta.output_name()
+    if isinstance(dati, dict):
+        dati = cubo_per(dati, [dimensione] if isinstance(dimensione, str) else dimensione.meta.root_names())
+    return (
+        dati
+        .group_by(dimensione)
+        .agg(pl.col(colonne_droga).cast(pl.Int64).sum())
+        .unpivot(index=nome, variable_name="Droga", value_name="Conteggio")
+    )
+
+
+def eta_media(cubi, per):
+    """
+    età media totale, dei maschi e delle femmine per le dimensioni 'per', in formato lungo
+    (colonne: per, Categoria, Età Media), calcolata come somma delle età / numero di morti
+    """
+    def media(filtro=pl.lit(True)):
+        return pl.col("Somma età").filter(filtro).sum() / pl.col("Morti totali").filter(filtro).sum()
+
+    return (
+        cubo_per(cubi, per + ["Sex"])
+        .group_by(per)
+        .agg([
+            media().alias("Totale"),
+            media(pl.col("Sex") == "Male").alias("Maschi"),
+            media(pl.col("Sex") == "Female").alias("Femmine")
+        ])
+        .unpivot(index=per, variable_name="Categoria", value_name="Età Media")
+    )
+
+
+def valori_dimensione(cubi, colonna):
+    """
+    valori distinti (come testo, ordinati) di una dimensione dei cubi, letti dal cubo più piccolo che la contiene
+    """
+    return cubo_per(cubi, [colonna]).select(pl.col(colonna).cast(pl.Utf8)).unique().drop_nulls().to_series().sort().to_list()
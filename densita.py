@@ -0,0 +1,223 @@
+"""
+Densità geografica dei decessi calcolata lato server su una griglia regolare di latitudine e longitudine.
+
+I punti vengono contati nelle celle della griglia con np.histogram2d (con pesi: i decessi hanno le coordinate
+della loro città, quindi basta un punto per città pesato con il numero di morti) e alla mappa arrivano
+solo le celle non vuote: la dimensione della pagina dipende dalla risoluzione della griglia e non dal
+numero di decessi. Le griglie restano in cache per filtro globale e dimensione della cella.
+
+La stima della densità con il metodo del kernel (StimaKDE) lavora sulla stessa idea: invece di valutare
+la somma dei kernel gaussiani in ogni punto (costo quadratico nel numero di punti, come gaussian_kde(xy)(xy)),
+i punti vengono distribuiti sui nodi di una griglia regolare (binning lineare), la griglia viene convoluta
+con il kernel tramite FFT e la densità nei punti si ricava per interpolazione bilineare dalla griglia.
+Il costo dipende dalla dimensione della griglia, non dal numero di punti.
+"""
+
+import numpy as np
+import polars as pl
+from scipy.signal import fftconvolve
+
+from citta import LATITUDINE_CT, LONGITUDINE_CT, chiavi_valide, coordinate
+from filtri import scan_filtrato
+from memo import memoizza
+from preprocessing import carica_citta
+
+# lato delle celle disponibili, in gradi
+DIMENSIONI_CELLA = [0.01, 0.02, 0.05, 0.1]
+
+# regole per la larghezza di banda del kernel e nodi della griglia per lato
+METODI_BANDA = ["scott", "silverman", "fissa"]
+NODI_GRIGLIA = 256
+
+
+def griglia(longitudine, latitudine, dimensione_cella, pesi = None, estensione = (LONGITUDINE_CT, LATITUDINE_CT)):
+    """
+    conteggi (eventualmente pesati) dei punti nelle celle quadrate di lato dimensione_cella gradi
+    che coprono l'estensione ((lon min, lon max), (lat min, lat max)); i punti fuori dall'estensione vengono ignorati.
+    Restituisce (conteggi [longitudine x latitudine], bordi delle celle in longitudine, bordi in latitudine)
+    """
+    (lon_min, lon_max), (lat_min, lat_max) = estensione
+    bordi_lon = np.arange(lon_min, lon_max + dimensione_cella, dimensione_cella)
+    bordi_lat = np.arange(lat_min, lat_max + dimensione_cella, dimensione_cella)
+    conteggi, _, _ = np.histogram2d(longitudine, latitudine, bins = [bordi_lon, bordi_lat], weights = pesi)
+    return conteggi, bordi_lon, bordi_lat
+
+
+def celle_non_vuote(conteggi, bordi_lon, bordi_lat):
+    """
+    centri e pesi delle sole celle non vuote: tabella (Latitudine, Longitudine, Morti)
+    """
+    i, j = np.nonzero(conteggi)
+    return pl.DataFrame({
+        "Latitudine": (bordi_lat[j] + bordi_lat[j + 1]) / 2,
+        "Longitudine": (bordi_lon[i] + bordi_lon[i + 1]) / 2,
+        "Morti": conteggi[i, j]
+    })
+
+
+def punti_pesati(dati, citta):
+    """
+    un punto per città con coordinate valide, pesato con il numero di decessi: (longitudine, latitudine, pesi)
+    come array numpy; dati è un LazyFrame con la colonna CityKey e citta la tabella delle città (vedi citta.py)
+    """
+    per_citta = (
+        dati
+        .group_by("CityKey")
+        .len()
+        .collect()
+        .with_columns(pl.col("CityKey").cast(citta["CityKey"].dtype))
+        .filter(pl.col("CityKey").is_in(chiavi_valide(citta)))
+        .sort("CityKey")
+    )
+    latitudine, longitudine = coordinate(citta, per_citta["CityKey"].to_numpy())
+    return longitudine, latitudine, per_citta["len"].to_numpy().astype(np.float64)
+
+
+def punti_filtrati(filtro = (), versione = None):
+    """
+    punti_pesati dei decessi del filtro globale, leggendo la sola colonna CityKey dal dataset partizionato
+    """
+    return punti_pesati(scan_filtrato(filtro, ["CityKey"]), carica_citta(compatto = True, versione = versione))
+
+
+def _quantile_pesato(valori, pesi, quantili):
+    ordine = np.argsort(valori)
+    cumulati = np.cumsum(pesi[ordine])
+    return np.interp(np.asarray(quantili) * cumulati[-1], cumulati, valori[ordine])
+
+
+def larghezza_banda(longitudine, latitudine, pesi = None, metodo = "scott", fissa = None):
+    """
+    matrice di covarianza (2 x 2, in gradi^2, longitudine e latitudine) del kernel gaussiano, come in gaussian_kde:
+        - scott: covarianza dei punti * n^(-1/3), cioè il fattore n^(-1/6) sulle deviazioni standard
+        - silverman: come scott, ma le deviazioni standard scendono alla stima robusta IQR / 1.349 quando è
+          minore (la correlazione tra gli assi resta quella dei punti)
+        - fissa: kernel isotropo con deviazione standard fissa su entrambi gli assi
+    i pesi sono pesi di frequenza (un punto per città pesato con il numero di morti): n è la somma dei pesi
+    e la covarianza è quella dei punti ripetuti, quindi la banda è la stessa di gaussian_kde sui singoli decessi
+    """
+    if metodo not in METODI_BANDA:
+        raise ValueError(f"metodo non valido: {metodo} (disponibili: {METODI_BANDA})")
+    if metodo == "fissa":
+        return np.eye(2) * fissa ** 2
+
+    punti = np.vstack([np.asarray(longitudine, dtype = np.float64), np.asarray(latitudine, dtype = np.float64)])
+    pesi = np.ones(punti.shape[1]) if pesi is None else np.asarray(pesi, dtype = np.float64)
+    n = pesi.sum()
+    if n <= 1:
+        return np.zeros((2, 2))
+    scarti = punti - (punti @ pesi / n)[:, None]
+    covarianza = (scarti * pesi) @ scarti.T / (n - 1)
+
+    if metodo == "silverman":
+        sigma = np.sqrt(np.diag(covarianza))
+        robusta = sigma.copy()
+        for asse, valori in enumerate(punti):
+            q1, q3 = _quantile_pesato(valori, pesi, [0.25, 0.75])
+            if q3 > q1:
+                robusta[asse] = min(sigma[asse], (q3 - q1) / 1.349)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            scala = np.where(sigma > 0, robusta / sigma, 0)
+        covarianza = covarianza * np.outer(scala, scala)
+
+    return covarianza * n ** (-1 / 3)
+
+
+class StimaKDE:
+    """
+    stima della densità con kernel gaussiano (matrice di covarianza, vedi larghezza_banda) calcolata su una griglia regolare:
+    binning lineare dei punti sui nodi, convoluzione con il kernel via FFT, interpolazione bilineare nei punti
+    """
+
+    def __init__(self, longitudine, latitudine, covarianza, pesi = None, nodi = NODI_GRIGLIA):
+        longitudine = np.asarray(longitudine, dtype = np.float64)
+        latitudine = np.asarray(latitudine, dtype = np.float64)
+        pesi = np.ones(len(longitudine)) if pesi is None else np.asarray(pesi, dtype = np.float64)
+        self.covarianza = np.asarray(covarianza, dtype = np.float64)
+        if len(longitudine) == 0 or pesi.sum() <= 0:
+            raise ValueError("servono dei punti per stimare la densità")
+        if not (np.all(np.diag(self.covarianza) > 0) and np.linalg.det(self.covarianza) > 0):
+            raise ValueError("larghezza di banda nulla: i punti sono troppo pochi o allineati")
+        # deviazione standard del kernel su ciascun asse
+        self.banda = np.sqrt(np.diag(self.covarianza))
+
+        # griglia che copre i punti più tre bande per lato (oltre, il kernel è trascurabile)
+        self.assi = [
+            np.linspace(valori.min() - 3 * h, valori.max() + 3 * h, nodi)
+            for valori, h in zip((longitudine, latitudine), self.banda)
+        ]
+        passi = np.array([asse[1] - asse[0] for asse in self.assi])
+
+        # binning lineare: ogni punto distribuisce il suo peso sui quattro nodi della cella che lo contiene
+        binnati = np.zeros(nodi * nodi)
+        for indici, frazioni in self._nodi_e_pesi(longitudine, latitudine):
+            binnati += np.bincount(indici, weights = pesi * frazioni, minlength = nodi * nodi)
+        binnati = binnati.reshape(nodi, nodi) # longitudine x latitudine
+
+        # kernel gaussiano con la covarianza piena (assi correlati, come gaussian_kde) campionato sui nodi
+        # fino a quattro bande dal centro, normalizzato a somma 1
+        scarti = []
+        for h, passo in zip(self.banda, passi):
+            raggio = min(int(np.ceil(4 * h / passo)), nodi - 1)
+            scarti.append(np.arange(-raggio, raggio + 1) * passo)
+        dx, dy = np.meshgrid(*scarti, indexing = "ij")
+        inversa = np.linalg.inv(self.covarianza)
+        kernel = np.exp(-0.5 * (inversa[0, 0] * dx ** 2 + 2 * inversa[0, 1] * dx * dy + inversa[1, 1] * dy ** 2))
+        kernel /= kernel.sum()
+
+        # densità per unità di area (gradi^2): l'integrale sulla griglia vale 1
+        self.densita = np.clip(fftconvolve(binnati, kernel, mode = "same"), 0, None) / (pesi.sum() * passi.prod())
+
+    def _nodi_e_pesi(self, longitudine, latitudine):
+        # per ogni punto: indici piatti dei quattro nodi vicini e relative frazioni bilineari
+        nodi = len(self.assi[0])
+        posizioni = []
+        for valori, asse in zip((longitudine, latitudine), self.assi):
+            g = np.clip((valori - asse[0]) / (asse[1] - asse[0]), 0, nodi - 1)
+            i = np.minimum(g.astype(np.int64), nodi - 2)
+            posizioni.append((i, g - i))
+        (i, fx), (j, fy) = posizioni
+        return [
+            (i * nodi + j, (1 - fx) * (1 - fy)),
+            ((i + 1) * nodi + j, fx * (1 - fy)),
+            (i * nodi + j + 1, (1 - fx) * fy),
+            ((i + 1) * nodi + j + 1, fx * fy)
+        ]
+
+    def valuta(self, longitudine, latitudine):
+        """
+        densità nei punti richiesti, per interpolazione bilineare dalla griglia
+        """
+        piatta = self.densita.ravel()
+        return sum(piatta[indici] * frazioni for indici, frazioni in self._nodi_e_pesi(
+            np.asarray(longitudine, dtype = np.float64), np.asarray(latitudine, dtype = np.float64)
+        ))
+
+
+@memoizza(maxsize = 32)
+def carica_kde(filtro = (), metodo = "scott", banda_fissa = None, versione = None):
+    """
+    densità dei decessi del filtro globale nei punti delle città (Longitudine, Latitudine, Morti, Densità)
+    e deviazione standard del kernel su ciascun asse; in cache per versione del dataset (vedi versione_dataset),
+    filtro e banda
+    """
+    longitudine, latitudine, pesi = punti_filtrati(filtro, versione)
+    stima = StimaKDE(longitudine, latitudine, larghezza_banda(longitudine, latitudine, pesi, metodo, banda_fissa), pesi)
+    tabella = pl.DataFrame({
+        "Longitudine": longitudine,
+        "Latitudine": latitudine,
+        "Morti": pesi,
+        "Densità": stima.valuta(longitudine, latitudine)
+    })
+    return tabella, stima.banda
+
+
+@memoizza(maxsize = 32)
+def carica_heatmap(filtro = (), dimensione_cella = 0.02, versione = None):
+    """
+    celle non vuote della griglia dei decessi per il filtro globale, con i pesi normalizzati tra 0 e 1
+    (la scala che si aspetta HeatMap), in cache per versione del dataset, filtro e dimensione della cella
+    """
+    longitudine, latitudine, pesi = punti_filtrati(filtro, versione)
+    celle = celle_non_vuote(*griglia(longitudine, latitudine, dimensione_cella, pesi))
+    return celle.with_columns((pl.col("Morti") / pl.col("Morti").max()).alias("Peso"))
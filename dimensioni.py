@@ -0,0 +1,78 @@
+"""
+Dimensioni derivate calcolate una volta sola nella pipeline di caricamento (vedi piano_pulizia):
+    - AgeBand: fascia d'età, con pl.cut sui limiti configurabili LIMITI_ETA
+    - LocationCategory: categoria del luogo di decesso (Home, Hospital, Other), ottenuta applicando
+      la tabella di regole REGOLE_LUOGO una volta per ogni valore distinto di Location
+
+Entrambe sono Enum, quindi le sezioni dell'app raggruppano per codici già pronti invece di
+ricalcolarle a ogni rendering. Se cambiano limiti o regole va incrementata VERSIONE_PIPELINE.
+"""
+
+import polars as pl
+
+# limiti (inclusi) delle fasce d'età: 0-19, 20-25, ..., 61-65, oltre 65
+LIMITI_ETA = [19, 25, 30, 35, 40, 45, 50, 55, 60, 65]
+
+# regole per la categoria del luogo, valutate in ordine sul testo in minuscolo (vince la prima che corrisponde);
+# "hiospital" è un refuso presente nel dataset originale
+REGOLE_LUOGO = [
+    ("hospital|hiospital|nursing|shelter", "Hospital"),
+    ("home|residence", "Home")
+]
+# categoria dei luoghi non nulli che non rientrano in nessuna regola
+ALTRO_LUOGO = "Other"
+
+
+def fasce_eta(limiti = LIMITI_ETA):
+    """
+    etichette delle fasce d'età corrispondenti ai limiti (intervalli chiusi a destra)
+    """
+    return [f"{limiti[0]}-"] + [f"{a + 1}-{b}" for a, b in zip(limiti, limiti[1:])] + [f"{limiti[-1]}+"]
+
+
+def categorie_luogo():
+    """
+    categorie possibili del luogo, nell'ordine in cui compaiono nei grafici
+    """
+    return sorted({categoria for _, categoria in REGOLE_LUOGO} | {ALTRO_LUOGO})
+
+
+def fascia_eta(limiti = LIMITI_ETA):
+    """
+    espressione vettorizzata per la fascia d'età (colonna AgeBand)
+    """
+    etichette = fasce_eta(limiti)
+    return pl.col("Age").cut(limiti, labels = etichette).cast(pl.Enum(etichette)).alias("AgeBand")
+
+
+def tabella_luoghi(luoghi):
+    """
+    applica REGOLE_LUOGO ai valori distinti di Location del LazyFrame luoghi,
+    restituendo la tabella (Location, LocationCategory) da unire ai dati (Location può essere testo o Categorical)
+    """
+    minuscolo = pl.col("Location").cast(pl.Utf8).str.to_lowercase()
+
+    regola, categoria = REGOLE_LUOGO[0]
+    espressione = pl.when(minuscolo.str.contains(regola)).then(pl.lit(categoria))
+    for regola, categoria in REGOLE_LUOGO[1:]:
+        espressione = espressione.when(minuscolo.str.contains(regola)).then(pl.lit(categoria))
+    espressione = espressione.when(pl.col("Location").is_not_null()).then(pl.lit(ALTRO_LUOGO))
+
+    return (
+        luoghi
+        .select("Location")
+        .unique()
+        .drop_nulls()
+        .with_columns(espressione.cast(pl.Enum(categorie_luogo())).alias("LocationCategory"))
+    )
+
+
+def aggiungi_dimensioni(piano, limiti = LIMITI_ETA):
+    """
+    aggiunge AgeBand e LocationCategory al piano lazy (da chiamare dopo il riempimento dei valori nulli di Age)
+    """
+    return (
+        piano
+        .with_columns(fascia_eta(limiti))
+        .join(tabella_luoghi(piano), on = "Location", how = "left")
+    )
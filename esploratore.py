@@ -0,0 +1,132 @@
+"""
+Esploratore del dataset impaginato lato server.
+
+Invece di mandare al browser l'intero dataset con st.dataframe(dati), l'esploratore costruisce una query
+lazy sul dataset partizionato (scan_dati) con proiezione delle colonne, filtri, ricerca testuale e ordinamento,
+e ne raccoglie solo la pagina visibile: al browser arrivano al massimo RIGHE_PER_PAGINA[-1] righe per interazione.
+Le pagine già calcolate restano in cache, quindi tornare indietro o cambiare pagina non rilegge i dati.
+"""
+
+import polars as pl
+import streamlit as st
+
+from filtri import scan_filtrato
+from preprocessing import scan_dati, versione_dataset
+
+RIGHE_PER_PAGINA = [50, 100, 200]
+
+# colonne su cui si può filtrare per valore (etichetta mostrata -> colonna)
+COLONNE_FILTRABILI = {
+    "Anno": "Year",
+    "Sesso": "Sex",
+    "Etnia": "Race",
+    "Contea": "Death County",
+    "Luogo": "LocationCategory"
+}
+
+
+def _testuale(tipo):
+    return tipo == pl.Utf8 or isinstance(tipo, (pl.Categorical, pl.Enum))
+
+
+def interroga(dati, colonne, filtri = (), ricerca = "", ordina_per = None, discendente = False):
+    """
+    query lazy dell'esploratore: filtri per valore (coppie colonna, valori), ricerca testuale
+    (senza distinzione tra maiuscole e minuscole, su tutte le colonne di testo mostrate), ordinamento e proiezione
+    """
+    schema = dati.collect_schema()
+
+    for colonna, valori in filtri:
+        if _testuale(schema[colonna]):
+            dati = dati.filter(pl.col(colonna).cast(pl.Utf8).is_in(list(valori)))
+        else:
+            dati = dati.filter(pl.col(colonna).is_in(list(valori)))
+
+    if ricerca:
+        testuali = [c for c in colonne if _testuale(schema[c])]
+        if testuali:
+            dati = dati.filter(pl.any_horizontal([
+                pl.col(c).cast(pl.Utf8).str.to_lowercase().str.contains(ricerca.lower(), literal = True)
+                for c in testuali
+            ]))
+        else:
+            dati = dati.filter(pl.lit(False))
+
+    if ordina_per is not None:
+        # i Categorical si ordinano alfabeticamente, non per codice
+        chiave = pl.col(ordina_per).cast(pl.Utf8) if schema[ordina_per] == pl.Categorical else pl.col(ordina_per)
+        dati = dati.sort(chiave, descending = discendente, nulls_last = True, maintain_order = True)
+
+    return dati.select(colonne)
+
+
+@st.cache_data(max_entries = 256, show_spinner = False)
+def carica_pagina(colonne, filtri, ricerca, ordina_per, discendente, pagina, righe_per_pagina, filtro = (), versione = None):
+    """
+    restituisce (righe della pagina, numero totale di righe che soddisfano i filtri e il filtro globale), in cache
+    per versione del dataset (vedi versione_dataset); sulla query lazy polars spinge proiezione e filtri fino ai file
+    e con ordinamento + slice calcola solo i primi k
+    """
+    query = interroga(scan_filtrato(filtro), list(colonne), filtri, ricerca, ordina_per, discendente)
+    righe = query.slice(pagina * righe_per_pagina, righe_per_pagina).collect()
+    totale = query.select(pl.len()).collect().item()
+    return righe, totale
+
+
+@st.cache_data(show_spinner = False)
+def valori_colonna(colonna, versione = None):
+    """
+    valori distinti di una colonna (per le tendine dei filtri), letti una volta per versione del dataset
+    """
+    valori = scan_dati(colonne = [colonna], compatto = True).select(pl.col(colonna).cast(pl.Utf8)).unique().collect()
+    return valori[colonna].drop_nulls().sort().to_list()
+
+
+def esploratore_dataset(filtro = ()):
+    """
+    widget dell'esploratore: scelta delle colonne, filtri, ricerca, ordinamento e pagina;
+    filtro è la chiave del filtro globale della barra laterale (vedi filtri.py)
+    """
+    schema = scan_dati(compatto = True).collect_schema()
+    tutte = schema.names()
+    versione = versione_dataset(compatto = True)
+
+    colonne = st.multiselect("Colonne da visualizzare:", tutte, default = tutte)
+    if not colonne:
+        st.warning("Selezionare almeno una colonna.")
+        return
+
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        ricerca = st.text_input("Cerca nel testo:", "")
+    with col2:
+        ordina_per = st.selectbox("Ordina per:", ["(nessuno)"] + colonne)
+    with col3:
+        verso = st.selectbox("Ordine:", ["Crescente", "Decrescente"])
+
+    filtri = []
+    colonne_filtro = st.columns(len(COLONNE_FILTRABILI))
+    for (etichetta, colonna), posto in zip(COLONNE_FILTRABILI.items(), colonne_filtro):
+        with posto:
+            scelti = st.multiselect(f"{etichetta}:", valori_colonna(colonna, versione))
+        if scelti:
+            valori = tuple(int(v) for v in scelti) if schema[colonna].is_integer() else tuple(scelti)
+            filtri.append((colonna, valori))
+
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        righe_per_pagina = st.selectbox("Righe per pagina:", RIGHE_PER_PAGINA)
+    ordina_per = None if ordina_per == "(nessuno)" else ordina_per
+
+    # il totale serve per sapere quante pagine ci sono: lo chiedo insieme alla prima pagina (che resta in cache)
+    _, totale = carica_pagina(tuple(colonne), tuple(filtri), ricerca, ordina_per, verso == "Decrescente", 0, righe_per_pagina, filtro, versione)
+    pagine = max(1, -(-totale // righe_per_pagina))
+    with col2:
+        pagina = st.number_input(f"Pagina (di {pagine}):", min_value = 1, max_value = pagine, value = 1, step = 1)
+
+    righe, totale = carica_pagina(
+        tuple(colonne), tuple(filtri), ricerca, ordina_per, verso == "Decrescente", pagina - 1, righe_per_pagina, filtro, versione
+    )
+    st.dataframe(righe, use_container_width = True)
+    inizio = (pagina - 1) * righe_per_pagina
+    st.caption(f"Righe {min(inizio + 1, totale)}-{inizio + righe.height} di {totale}")
@@ -0,0 +1,100 @@
+"""
+Filtro globale della dashboard (anni, contea, sesso, etnia) scelto nella barra laterale.
+
+Il filtro è rappresentato da una chiave canonica (tupla ordinata di coppie colonna, valori), così filtri
+equivalenti hanno la stessa chiave; la chiave viene compilata una volta sola in un'espressione polars che
+vale sia per il dataset sia per le letture dal dataset partizionato. I cubi (vedi cubo.py) non hanno tutte le colonne
+del filtro: per un filtro attivo vengono ricalcolati dal dataset filtrato, una volta per chiave.
+Le viste filtrate restano in una cache LRU indicizzata dalla chiave, quindi tornare a un filtro usato da poco è immediato.
+"""
+
+import polars as pl
+
+from memo import memoizza
+from cubo import costruisci_cubi
+from preprocessing import carica_cubi, carica_dati, get_droghe, scan_dati
+
+# colonne filtrabili: Year per intervallo (estremi inclusi), le altre per elenco di valori
+COLONNE_FILTRO = ["Year", "Death County", "Sex", "Race"]
+
+# viste filtrate tenute in memoria (le meno usate di recente vengono scartate)
+VISTE_IN_CACHE = 16
+
+
+def chiave_filtro(anni = None, anni_disponibili = None, valori = None):
+    """
+    chiave canonica del filtro: anni è una coppia (inizio, fine), ignorata se copre tutti gli anni_disponibili;
+    valori è un dizionario colonna -> valori scelti per le altre COLONNE_FILTRO (le selezioni vuote vengono ignorate)
+    """
+    chiave = []
+    if anni is not None and (anni_disponibili is None or tuple(anni) != (min(anni_disponibili), max(anni_disponibili))):
+        chiave.append(("Year", (int(anni[0]), int(anni[1]))))
+    for colonna, scelti in (valori or {}).items():
+        if colonna not in COLONNE_FILTRO[1:]:
+            raise ValueError(f"colonna non filtrabile: {colonna} (disponibili: {COLONNE_FILTRO})")
+        if scelti:
+            chiave.append((colonna, tuple(sorted(set(scelti)))))
+    return tuple(sorted(chiave))
+
+
+def compila_filtro(filtro):
+    """
+    espressione polars corrispondente alla chiave del filtro (vera su tutte le righe se il filtro è vuoto)
+    """
+    condizioni = []
+    for colonna, valori in filtro:
+        if colonna == "Year":
+            condizioni.append(pl.col("Year").is_between(*valori))
+        else:
+            condizioni.append(pl.col(colonna).cast(pl.Utf8).is_in(list(valori)))
+    return pl.all_horizontal(condizioni) if condizioni else pl.lit(True)
+
+
+def applica_filtro(dati, filtro):
+    """
+    applica il filtro a un DataFrame o LazyFrame (se il filtro è vuoto restituisce i dati così come sono)
+    """
+    return dati.filter(compila_filtro(filtro)) if filtro else dati
+
+
+def scan_filtrato(filtro, colonne = None, cartella_dataset = None):
+    """
+    LazyFrame sul dataset partizionato (schema compatto) ristretto al filtro, per le analisi che leggono
+    dai file invece che dalla tabella in memoria: l'intervallo di anni seleziona solo le partizioni necessarie,
+    le altre condizioni vengono spinte fino ai file (cartella_dataset come in scan_dati)
+    """
+    anni = dict(filtro).get("Year")
+    dati = applica_filtro(
+        scan_dati(anni = anni, compatto = True, cartella_dataset = cartella_dataset),
+        tuple(c for c in filtro if c[0] != "Year")
+    )
+    return dati.select(colonne) if colonne is not None else dati
+
+
+@memoizza(maxsize = VISTE_IN_CACHE)
+def vista_filtrata(filtro, compatto = True, versione = None):
+    """
+    dataset e cubi ristretti al filtro, calcolati una volta per versione del dataset (vedi versione_dataset) e chiave
+    del filtro e tenuti in una cache LRU (vedi memo.py);
+    senza filtro i cubi sono quelli precalcolati, altrimenti vengono ricostruiti dal dataset filtrato.
+    Le viste non vengono copiate a ogni lettura
+    """
+    if not filtro:
+        return carica_dati(compatto, versione), carica_cubi(compatto, versione)
+    dati = applica_filtro(carica_dati(compatto, versione), filtro)
+    return dati, costruisci_cubi(dati, get_droghe())
+
+
+def descrivi_filtro(filtro):
+    """
+    descrizione leggibile del filtro attivo
+    """
+    if not filtro:
+        return "nessun filtro"
+    parti = []
+    for colonna, valori in filtro:
+        if colonna == "Year":
+            parti.append(f"anni {valori[0]}-{valori[1]}")
+        else:
+            parti.append(f"{colonna}: {', '.join(valori)}")
+    return "; ".join(parti)
@@ -0,0 +1,137 @@
+"""
+Generatore di dataset sintetici con lo stesso schema di drug_deaths.csv, per misurare come scalano
+preprocessing e analisi (vedi benchmark.py) su volumi 10x, 100x, 1000x quello reale.
+
+Le righe sintetiche si ottengono ricampionando (con reinserimento) blocchi di colonne del csv reale,
+ognuno con un indice di riga estratto in modo indipendente:
+    - i blocchi tengono insieme le colonne legate tra loro (le droghe con la causa di morte, la città
+      con contea, stato e coordinate, ...), quindi co-presenze delle droghe, distribuzione delle città
+      e delle coordinate restano quelle reali
+    - blocchi diversi vengono mescolati, così le combinazioni (e la cardinalità dei raggruppamenti)
+      crescono con la scala invece di ripetere le stesse righe
+    - le date sono spostate di qualche giorno, restando nell'intervallo di date del csv reale
+
+uso:
+    python genera_dati.py --scale 10 100 1000 --csv drug_deaths.csv --cartella dati_sintetici
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from preprocessing import FILE_DATI, get_droghe
+
+FORMATO_DATA = "%m/%d/%Y"
+
+# massimo spostamento casuale delle date, in giorni
+SPOSTAMENTO_DATE = 3
+
+# righe generate (e scritte) alla volta, per non tenere in memoria l'intero file alle scale grandi
+RIGHE_PER_BLOCCO = 500_000
+
+
+def blocchi_colonne(colonne):
+    """
+    suddivide le colonne del csv nei blocchi ricampionati insieme; le colonne non previste finiscono
+    nel blocco delle droghe (così una colonna nuova non rompe il generatore)
+    """
+    blocchi = {
+        "data": ["Date", "Date Type"],
+        "persona": ["Age", "Sex", "Race", "Ethnicity"],
+        "residenza": ["Residence City", "Residence County", "Residence State", "ResidenceCityGeo"],
+        "luogo": [
+            "Injury City", "Injury County", "Injury State", "Injury Place", "Description of Injury",
+            "Death City", "Death County", "Death State", "Location", "Location if Other",
+            "InjuryCityGeo", "DeathCityGeo"
+        ]
+    }
+    blocchi = {nome: [c for c in elenco if c in colonne] for nome, elenco in blocchi.items()}
+    usate = {c for elenco in blocchi.values() for c in elenco}
+    blocchi["droghe"] = [c for c in colonne if c not in usate]
+    return blocchi
+
+
+def genera_blocco(sorgente, righe, rng):
+    """
+    genera 'righe' righe sintetiche a partire dal DataFrame grezzo sorgente (tutte colonne di testo)
+    """
+    blocchi = blocchi_colonne(sorgente.columns)
+
+    parti = [
+        sorgente.select(colonne)[rng.integers(0, sorgente.height, righe)]
+        for colonne in blocchi.values()
+    ]
+    sintetici = pl.concat(parti, how = "horizontal").select(sorgente.columns)
+
+    # sposto le date di qualche giorno restando nell'intervallo originale
+    date = sorgente["Date"].str.strptime(pl.Date, FORMATO_DATA, strict = False)
+    spostamento = pl.Series(rng.integers(-SPOSTAMENTO_DATE, SPOSTAMENTO_DATE + 1, righe)).cast(pl.Int64)
+    return sintetici.with_columns(
+        (pl.col("Date").str.strptime(pl.Date, FORMATO_DATA, strict = False) + pl.duration(days = spostamento))
+        .clip(date.min(), date.max())
+        .dt.strftime(FORMATO_DATA)
+        .alias("Date")
+    )
+
+
+def genera(sorgente = FILE_DATI, scala = 10, destinazione = None, seme = 0):
+    """
+    scrive un csv sintetico con scala volte le righe del csv sorgente e ne restituisce il percorso
+    """
+    sorgente = Path(sorgente)
+    if destinazione is None:
+        destinazione = sorgente.with_name(f"{sorgente.stem}_x{scala}.csv")
+    destinazione = Path(destinazione)
+    destinazione.parent.mkdir(parents = True, exist_ok = True)
+
+    # leggo tutto come testo, così i valori vengono riscritti esattamente come nel file originale
+    dati = pl.read_csv(sorgente, infer_schema = False)
+    totale = int(round(dati.height * scala))
+    rng = np.random.default_rng(seme)
+
+    temporaneo = destinazione.with_name(destinazione.name + ".tmp")
+    with open(temporaneo, "wb") as file:
+        for inizio in range(0, totale, RIGHE_PER_BLOCCO):
+            righe = min(RIGHE_PER_BLOCCO, totale - inizio)
+            genera_blocco(dati, righe, rng).write_csv(file, include_header = inizio == 0)
+    temporaneo.replace(destinazione)
+
+    return destinazione
+
+
+def riepilogo(percorso):
+    """
+    poche statistiche per confrontare un csv sintetico con quello reale
+    """
+    colonne_droga = get_droghe()
+    dati = pl.scan_csv(percorso, infer_schema = False)
+    return dati.select([
+        pl.len().alias("righe"),
+        pl.col("Date").str.strptime(pl.Date, FORMATO_DATA, strict = False).min().alias("prima data"),
+        pl.col("Date").str.strptime(pl.Date, FORMATO_DATA, strict = False).max().alias("ultima data"),
+        pl.col("DeathCityGeo").n_unique().alias("città distinte"),
+        (pl.col("Fentanyl") == "Y").fill_null(False).mean().alias("quota Fentanyl"),
+        ((pl.col("Fentanyl") == "Y") & (pl.col("Heroin") == "Y")).fill_null(False).mean().alias("quota Fentanyl + Heroin"),
+        pl.concat_str([(pl.col(c) == "Y").fill_null(False).cast(pl.Utf8) for c in colonne_droga]).n_unique().alias("combinazioni di droghe")
+    ]).collect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "generatore di dataset sintetici in scala")
+    parser.add_argument("--csv", default = FILE_DATI, help = "csv reale da ricampionare")
+    parser.add_argument("--scale", type = float, nargs = "+", default = [10, 100, 1000])
+    parser.add_argument("--cartella", default = "dati_sintetici", type = Path)
+    parser.add_argument("--seme", type = int, default = 0)
+    args = parser.parse_args()
+
+    print(f"{args.csv}:\n{riepilogo(args.csv)}")
+    for scala in args.scale:
+        scala = int(scala) if scala == int(scala) else scala
+        percorso = genera(args.csv, scala, args.cartella / f"{Path(args.csv).stem}_x{scala}.csv", args.seme)
+        print(f"{percorso}:\n{riepilogo(percorso)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Confini del Connecticut (stato, contee, aree dei CAP) semplificati per livello di zoom.
+
+Il file ct_connecticut_zip_codes_geo.min.json (4 MB, circa 170 mila vertici) contiene i poligoni delle ZCTA
+(le aree dei CAP), ma per colorare lo stato sulla mappa bastano poche centinaia di vertici. La preparazione
+avviene una volta sola:
+    - topologia: i vertici uguali vengono identificati e i contorni degli anelli vengono spezzati in archi
+      tra i nodi (vertici con grado diverso da 2 nel grafo dei lati), così un confine condiviso da due aree
+      vicine è lo stesso arco per entrambe
+    - semplificazione: Douglas-Peucker su ogni arco, una volta sola e in coordinate di Mercatore, assegna
+      a ogni vertice un'importanza (la tolleranza oltre la quale viene scartato); la variante per uno zoom tiene
+      i vertici più importanti di un pixel a quello zoom. Gli archi condivisi si semplificano allo stesso modo
+      da entrambi i lati, quindi tra aree vicine non si aprono buchi
+    - dissoluzione: il contorno di un gruppo di aree (lo stato, una contea) è formato dai lati che compaiono
+      in un solo anello del gruppo, concatenati in anelli
+Le varianti vengono salvate in cache/geometria come GeoJSON compatto (una per livello e zoom, con un manifesto
+legato all'hash del file sorgente) e lette una volta per processo; confini(livello, zoom) restituisce
+la variante più leggera con dettaglio sufficiente per lo zoom richiesto.
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from cache_file import corrisponde, hash_file, leggi_manifesto, scrivi_atomico
+from memo import memoizza
+from preprocessing import CARTELLA_CACHE, FILE_DATI, carica_citta, carica_citta_snapshot
+
+# pagina github con le coordinate dei confini degli stati degli USA e le loro città
+# https://github.com/OpenDataDE/State-zip-code-GeoJSON
+FILE_CONFINI = "ct_connecticut_zip_codes_geo.min.json"
+
+# da incrementare quando cambia la preparazione, così le varianti su disco vengono ricostruite
+VERSIONE_GEOMETRIA = 1
+
+LIVELLI = ["stato", "contee", "cap"]
+
+# livelli di zoom delle varianti (zoom di folium/Leaflet) e tolleranza della semplificazione in pixel
+ZOOM = [6, 8, 10, 12]
+TOLLERANZA_PIXEL = 1.0
+
+# i vertici vengono identificati dopo l'arrotondamento al decimilionesimo di grado
+SCALA_QUANTIZZAZIONE = 1e7
+
+
+def mercatore(longitudine, latitudine):
+    """
+    proiezione di Mercatore con entrambi gli assi in gradi (array n x 2): a ogni zoom un pixel vale
+    360 / (256 * 2^zoom) in entrambe le direzioni
+    """
+    latitudine = np.radians(np.asarray(latitudine, dtype = np.float64))
+    return np.column_stack([longitudine, np.degrees(np.log(np.tan(np.pi / 4 + latitudine / 2)))])
+
+
+def tolleranza(zoom):
+    """
+    tolleranza della semplificazione allo zoom indicato, in gradi di Mercatore (TOLLERANZA_PIXEL pixel)
+    """
+    return TOLLERANZA_PIXEL * 360 / (256 * 2 ** zoom)
+
+
+def _area(xy):
+    # area con segno di un anello chiuso (positiva se antiorario)
+    return 0.5 * np.sum(xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1])
+
+
+def _dentro(punto, xy):
+    # ray casting: il punto sta dentro l'anello chiuso xy?
+    x, y = punto
+    (x1, y1), (x2, y2) = xy[:-1].T, xy[1:].T
+    attraversa = (y1 > y) != (y2 > y)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        ascisse = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(attraversa & (x < ascisse)) % 2)
+
+
+def _douglas_peucker(xy, vertici, importanza, minima = 0.0):
+    """
+    Douglas-Peucker su un arco (coordinate xy, indici globali dei vertici): ogni vertice interno riceve la distanza
+    alla quale viene scelto, limitata da quella del vertice che ha spezzato il suo tratto, così a tolleranze
+    crescenti corrispondono sottoinsiemi dei vertici. I tratti che restano tutti sotto la tolleranza minima
+    non vengono più spezzati (i loro vertici non verrebbero tenuti a nessuno zoom)
+    """
+    pila = [(0, len(xy) - 1, np.inf)]
+    while pila:
+        i, j, limite = pila.pop()
+        if j - i < 2:
+            continue
+        a, b = xy[i], xy[j]
+        scarti = xy[i + 1:j] - a
+        ab = b - a
+        lunghezza = ab @ ab
+        if lunghezza > 0:
+            scarti = scarti - np.clip(scarti @ ab / lunghezza, 0, 1)[:, None] * ab
+        distanze = np.hypot(scarti[:, 0], scarti[:, 1])
+        k = int(np.argmax(distanze))
+        if distanze[k] <= minima:
+            importanza[vertici[i + 1:j]] = np.minimum(distanze, limite)
+            continue
+        k += i + 1
+        importanza[vertici[k]] = min(distanze[k - i - 1], limite)
+        pila.append((i, k, importanza[vertici[k]]))
+        pila.append((k, j, importanza[vertici[k]]))
+
+
+class Topologia:
+    """
+    aree (ZCTA) del file dei confini come anelli di indici su una tabella di vertici condivisi,
+    con l'importanza di ogni vertice per la semplificazione
+    """
+
+    def __init__(self, geojson):
+        self.proprieta = []
+        self.poligoni = [] # per area: lista di poligoni, ognuno lista di indici di anelli (l'esterno per primo)
+        anelli = []
+        for feature in geojson["features"]:
+            geometria = feature["geometry"]
+            poligoni = [geometria["coordinates"]] if geometria["type"] == "Polygon" else geometria["coordinates"]
+            area = []
+            for poligono in poligoni:
+                indici = []
+                for posizione, anello in enumerate(poligono):
+                    lonlat = np.asarray(anello, dtype = np.float64)
+                    # orientamento come da RFC 7946: esterni antiorari, buchi orari
+                    if (_area(lonlat) > 0) != (posizione == 0):
+                        lonlat = lonlat[::-1]
+                    indici.append(len(anelli))
+                    anelli.append(lonlat)
+                area.append(indici)
+            self.poligoni.append(area)
+            self.proprieta.append(feature["properties"])
+
+        # vertici condivisi: coordinate uguali dopo la quantizzazione hanno lo stesso indice
+        quantizzati = np.round(np.concatenate(anelli) * SCALA_QUANTIZZAZIONE).astype(np.int64)
+        unici, inversa = np.unique(quantizzati, axis = 0, return_inverse = True)
+        inversa = inversa.ravel()
+        self.lonlat = unici / SCALA_QUANTIZZAZIONE
+        self.xy = mercatore(self.lonlat[:, 0], self.lonlat[:, 1])
+        confini = np.cumsum([0] + [len(anello) for anello in anelli])
+        self.anelli = []
+        for inizio, fine in zip(confini[:-1], confini[1:]):
+            anello = inversa[inizio:fine]
+            # vertici consecutivi uguali (lati degeneri dopo la quantizzazione)
+            self.anelli.append(anello[np.concatenate([[True], np.diff(anello) != 0])])
+
+        self._importanza = None
+
+    @property
+    def importanza(self):
+        """
+        importanza di ogni vertice per la semplificazione (vedi _douglas_peucker), calcolata al primo uso:
+        infinita per i nodi, che restano a ogni zoom
+        """
+        if self._importanza is not None:
+            return self._importanza
+        # grado dei vertici nel grafo dei lati (ogni lato contato una volta): i nodi hanno grado diverso da 2
+        n = len(self.lonlat)
+        u = np.concatenate([anello[:-1] for anello in self.anelli])
+        v = np.concatenate([anello[1:] for anello in self.anelli])
+        lati = np.unique(np.minimum(u, v) * n + np.maximum(u, v))
+        grado = np.bincount(lati // n, minlength = n) + np.bincount(lati % n, minlength = n)
+        nodo = grado != 2
+
+        importanza = np.zeros(n)
+        importanza[nodo] = np.inf
+        fatti = set()
+        for anello in self.anelli:
+            for arco in self._archi(anello[:-1], nodo, importanza):
+                chiave = (arco[0], arco[1], arco[-1], len(arco))
+                if chiave not in fatti:
+                    fatti.add(chiave)
+                    _douglas_peucker(self.xy[arco], arco, importanza, tolleranza(max(ZOOM)))
+        self._importanza = importanza
+        return importanza
+
+    def _archi(self, ciclo, nodo, importanza):
+        """
+        archi di un anello (vertici senza la chiusura) tra un nodo e il successivo, in forma canonica
+        (stesso verso da entrambi i lati del confine); un anello senza nodi diventa un arco chiuso
+        che parte dal vertice di indice minimo, con quel vertice e il più lontano sempre tenuti
+        """
+        posizioni = np.flatnonzero(nodo[ciclo])
+        if len(posizioni) == 0:
+            ciclo = np.roll(ciclo, -int(np.argmin(ciclo)))
+            if ciclo[1] > ciclo[-1]:
+                ciclo = np.concatenate([ciclo[:1], ciclo[:0:-1]])
+            distanze = np.hypot(*(self.xy[ciclo] - self.xy[ciclo[0]]).T)
+            lontano = int(np.argmax(distanze))
+            importanza[ciclo[[0, lontano]]] = np.inf
+            return [ciclo[:lontano + 1], np.append(ciclo[lontano:], ciclo[0])]
+
+        ciclo = np.roll(ciclo, -posizioni[0])
+        posizioni = np.append(posizioni - posizioni[0], len(ciclo))
+        ciclo = np.append(ciclo, ciclo[0])
+        archi = []
+        for inizio, fine in zip(posizioni[:-1], posizioni[1:]):
+            arco = ciclo[inizio:fine + 1]
+            if arco[0] > arco[-1] or (arco[0] == arco[-1] and arco[1] > arco[-2]):
+                arco = arco[::-1]
+            archi.append(arco)
+        return archi
+
+    def contorno(self, aree):
+        """
+        contorno dell'unione delle aree indicate: lista di poligoni (anelli di indici dei vertici, l'esterno
+        per primo); i lati interni compaiono in due anelli del gruppo, quelli del contorno in uno solo
+        """
+        anelli = [self.anelli[i] for area in aree for poligono in self.poligoni[area] for i in poligono]
+        u = np.concatenate([anello[:-1] for anello in anelli])
+        v = np.concatenate([anello[1:] for anello in anelli])
+        n = len(self.lonlat)
+        _, inversa, conteggi = np.unique(np.minimum(u, v) * n + np.maximum(u, v), return_inverse = True, return_counts = True)
+        di_bordo = conteggi[inversa] == 1
+
+        # i lati del contorno conservano il verso degli anelli di partenza: concatenandoli gli esterni
+        # restano antiorari e i buchi orari
+        successivi = {}
+        for a, b in zip(u[di_bordo].tolist(), v[di_bordo].tolist()):
+            successivi.setdefault(a, []).append(b)
+        esterni, buchi = [], []
+        while successivi:
+            inizio = corrente = next(iter(successivi))
+            anello = [inizio]
+            while corrente in successivi:
+                prossimi = successivi[corrente]
+                prossimo = prossimi.pop()
+                if not prossimi:
+                    del successivi[corrente]
+                anello.append(prossimo)
+                corrente = prossimo
+                if corrente == inizio:
+                    break
+            if corrente != inizio or len(anello) < 4:
+                continue
+            anello = np.array(anello)
+            (esterni if _area(self.xy[anello]) > 0 else buchi).append(anello)
+
+        # ogni buco va nel più piccolo esterno che lo contiene
+        aree_esterni = [_area(self.xy[esterno]) for esterno in esterni]
+        poligoni = [[esterno] for esterno in esterni]
+        for buco in buchi:
+            contenitori = [i for i, esterno in enumerate(esterni) if _dentro(self.xy[buco[0]], self.xy[esterno])]
+            if contenitori:
+                poligoni[min(contenitori, key = aree_esterni.__getitem__)].append(buco)
+        return poligoni
+
+    def aree(self, area):
+        """
+        poligoni di una singola area (anelli di indici dei vertici, l'esterno per primo)
+        """
+        return [[self.anelli[i] for i in poligono] for poligono in self.poligoni[area]]
+
+    def coordinate(self, poligoni, zoom):
+        """
+        coordinate GeoJSON (MultiPolygon) dei poligoni semplificati per lo zoom: restano i vertici con importanza
+        maggiore della tolleranza, spariscono gli anelli con meno di tre vertici o più piccoli di un pixel;
+        le coordinate vengono arrotondate alla precisione utile a quello zoom
+        """
+        soglia = tolleranza(zoom)
+        decimali = int(np.ceil(-np.log10(soglia))) + 1
+        risultato = []
+        for poligono in poligoni:
+            anelli = []
+            for anello in poligono:
+                tenuti = anello[self.importanza[anello] > soglia]
+                if len(tenuti) and tenuti[0] != tenuti[-1]:
+                    tenuti = np.append(tenuti, tenuti[0])
+                if len(tenuti) >= 4 and abs(_area(self.xy[tenuti])) >= soglia ** 2:
+                    anelli.append(np.round(self.lonlat[tenuti], decimali).tolist())
+                elif not anelli:
+                    break # sparito l'esterno sparisce tutto il poligono
+            if anelli:
+                risultato.append(anelli)
+        return risultato
+
+
+@memoizza(maxsize = 1)
+def carica_topologia(sorgente = FILE_CONFINI):
+    """
+    topologia delle aree del file dei confini, costruita una volta per processo
+    """
+    with open(sorgente, "r") as file:
+        return Topologia(json.load(file))
+
+
+def contea_per_area(topologia, citta):
+    """
+    contea di ogni area: quella della città (con coordinate e contea note) più vicina al punto interno dell'area
+    (INTPTLAT10, INTPTLON10). È un'approssimazione: il file dei confini non riporta la contea e la tabella
+    delle città ha il CAP solo per pochi valori, quindi le aree di confine tra due contee possono finire
+    in quella vicina; None se non ci sono città utilizzabili
+    """
+    note = citta.filter(pl.col("CoordinateValide") & pl.col("Contea").is_not_null())
+    if note.height == 0:
+        return [None] * len(topologia.proprieta)
+    punti_citta = mercatore(note["Longitudine"].to_numpy(), note["Latitudine"].to_numpy())
+    punti_aree = mercatore(
+        [float(p["INTPTLON10"]) for p in topologia.proprieta],
+        [float(p["INTPTLAT10"]) for p in topologia.proprieta]
+    )
+    distanze = ((punti_aree[:, None, :] - punti_citta[None, :, :]) ** 2).sum(axis = 2)
+    return note["Contea"].gather(np.argmin(distanze, axis = 1)).to_list()
+
+
+def _gruppi(topologia, livello, citta):
+    """
+    aree del livello: lista di (proprietà, poligoni in indici dei vertici)
+    """
+    if livello == "stato":
+        return [({"Nome": "Connecticut"}, topologia.contorno(range(len(topologia.poligoni))))]
+    if livello == "cap":
+        return [
+            ({"ZCTA5CE10": p["ZCTA5CE10"], "ALAND10": p["ALAND10"]}, topologia.aree(area))
+            for area, p in enumerate(topologia.proprieta)
+        ]
+    contee = contea_per_area(topologia, citta)
+    gruppi = []
+    for contea in sorted(set(contee), key = str):
+        aree = [area for area, c in enumerate(contee) if c == contea]
+        superficie = sum(topologia.proprieta[area]["ALAND10"] for area in aree)
+        gruppi.append(({"Contea": contea, "ALAND10": superficie}, topologia.contorno(aree)))
+    return gruppi
+
+
+def _impronta_citta(citta):
+    # le contee dipendono solo da contea e coordinate delle città
+    colonne = citta.select(["Contea", "Latitudine", "Longitudine"]).sort(pl.all())
+    return hashlib.sha256(colonne.write_csv().encode()).hexdigest()[:16]
+
+
+def costruisci_confini(livello, citta = None, sorgente = FILE_CONFINI, cartella = CARTELLA_CACHE):
+    """
+    varianti del livello (una per zoom di ZOOM) come file GeoJSON compatti in cartella/geometria, ricostruite
+    solo se il manifesto non corrisponde (file sorgente, VERSIONE_GEOMETRIA e, per le contee, tabella delle città).
+    Restituisce il dizionario zoom -> percorso
+    """
+    if livello not in LIVELLI:
+        raise ValueError(f"livello non valido: {livello} (disponibili: {LIVELLI})")
+    chiave = {"sorgente": hash_file(sorgente), "versione": VERSIONE_GEOMETRIA}
+    if livello == "contee":
+        if citta is None:
+            raise ValueError("per le contee serve la tabella delle città")
+        chiave["citta"] = _impronta_citta(citta)
+
+    cartella_geometria = Path(cartella) / "geometria"
+    manifesto = cartella_geometria / f"{livello}.json"
+    percorsi = {zoom: cartella_geometria / f"{livello}_z{zoom}.geojson" for zoom in ZOOM}
+    if corrisponde(leggi_manifesto(manifesto), chiave) and all(p.exists() for p in percorsi.values()):
+        return percorsi
+
+    cartella_geometria.mkdir(parents = True, exist_ok = True)
+    topologia = carica_topologia(str(sorgente))
+    gruppi = _gruppi(topologia, livello, citta)
+    for zoom, percorso in percorsi.items():
+        collezione = {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": proprieta,
+             "geometry": {"type": "MultiPolygon", "coordinates": topologia.coordinate(poligoni, zoom)}}
+            for proprieta, poligoni in gruppi
+        ]}
+        testo = json.dumps(collezione, separators = (",", ":"))
+        scrivi_atomico(percorso, lambda p: p.write_text(testo))
+    # il manifesto va scritto per ultimo, così non punta mai a varianti incomplete
+    scrivi_atomico(manifesto, lambda p: p.write_text(json.dumps(chiave)))
+    return percorsi
+
+
+@memoizza(maxsize = len(LIVELLI))
+def carica_confini(livello = "stato", versione = None):
+    """
+    varianti del livello come testo GeoJSON (zoom -> testo), costruite se mancano e lette una volta per processo
+    e versione del dataset (vedi versione_dataset): le contee dipendono dalla tabella delle città
+    """
+    citta = carica_citta(compatto = True, versione = versione) if livello == "contee" else None
+    return {zoom: percorso.read_text() for zoom, percorso in costruisci_confini(livello, citta).items()}
+
+
+def confini(livello = "stato", zoom = 8, versione = None):
+    """
+    GeoJSON (testo, da passare così com'è a folium.GeoJson) della variante più leggera adatta allo zoom:
+    la prima con zoom almeno pari a quello richiesto, altrimenti la più dettagliata
+    """
+    varianti = carica_confini(livello, versione)
+    adatti = [z for z in ZOOM if z >= zoom]
+    return varianti[adatti[0] if adatti else ZOOM[-1]]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "prepara i confini semplificati del Connecticut per livello e zoom")
+    parser.add_argument("--sorgente", default = FILE_CONFINI, help = "GeoJSON delle aree dei CAP")
+    parser.add_argument("--csv", default = FILE_DATI, help = "csv del dataset (tabella delle città, per le contee)")
+    parser.add_argument("--cartella", default = CARTELLA_CACHE, type = Path, help = "cartella degli artefatti")
+    args = parser.parse_args(argv)
+
+    citta = carica_citta_snapshot(args.csv, args.cartella, compatto = True)
+    for livello in LIVELLI:
+        for zoom, percorso in costruisci_confini(livello, citta, args.sorgente, args.cartella).items():
+            print(f"{livello}, zoom {zoom}: {percorso.stat().st_size / 1024:.1f} KB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
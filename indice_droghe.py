@@ -0,0 +1,109 @@
+import numpy as np
+import polars as pl
+
+from filtri import scan_filtrato
+from memo import memoizza
+from preprocessing import get_droghe
+
+
+class IndiceDroghe:
+    """
+    Indice delle co-presenze delle droghe.
+
+    Ogni decesso è codificato come un intero (bitmask) in cui il bit i indica la presenza
+    dell'i-esima droga di get_droghe(). Dato che le combinazioni distinte sono poche centinaia,
+    l'indice tiene solo le combinazioni distinte con il loro conteggio: da queste calcola in
+    un'unica passata vettorizzata la matrice delle co-occorrenze, le probabilità condizionate
+    e l'istogramma delle combinazioni, e risponde alle interrogazioni senza toccare il dataset.
+    """
+
+    def __init__(self, maschere, colonne_droga):
+        self.droghe = list(colonne_droga)
+
+        # istogramma delle combinazioni esatte (un'unica passata sui dati)
+        self.combinazioni, self.conteggi = np.unique(np.asarray(maschere, dtype=np.uint32), return_counts=True)
+        self.conteggi = self.conteggi.astype(np.int64)
+        self.totale = int(self.conteggi.sum())
+
+        # matrice combinazioni x droghe con i bit esplosi, poi co-occorrenze = B^T * diag(conteggi) * B
+        bit = ((self.combinazioni[:, None] >> np.arange(len(self.droghe), dtype=np.uint32)) & 1).astype(np.int64)
+        self.cooccorrenze = bit.T @ (bit * self.conteggi[:, None])
+
+    @classmethod
+    def da_dati(cls, dati, colonne_droga):
+        """
+        costruisce l'indice dal dataset: usa la colonna DrugMask dello schema compatto se c'è,
+        altrimenti la calcola dai flag delle droghe
+        """
+        if "DrugMask" in dati.columns:
+            maschere = dati.get_column("DrugMask")
+        else:
+            maschere = dati.select(
+                pl.sum_horizontal([
+                    pl.col(droga).cast(pl.UInt32) * (1 << i) for i, droga in enumerate(colonne_droga)
+                ])
+            ).to_series()
+        return cls(maschere.to_numpy(), colonne_droga)
+
+    def maschera(self, droghe):
+        """
+        bitmask corrispondente a un elenco di droghe
+        """
+        maschera = 0
+        for droga in droghe:
+            maschera |= 1 << self.droghe.index(droga)
+        return maschera
+
+    def conta(self, con=(), senza=()):
+        """
+        numero di decessi in cui sono presenti tutte le droghe in 'con' e nessuna di quelle in 'senza'
+        (es. Fentanyl e Xylazine ma non Heroin), calcolato sulle sole combinazioni distinte
+        """
+        m_con = np.uint32(self.maschera(con))
+        m_senza = np.uint32(self.maschera(senza))
+        selezione = ((self.combinazioni & m_con) == m_con) & ((self.combinazioni & m_senza) == 0)
+        return int(self.conteggi[selezione].sum())
+
+    def probabilita_condizionate(self):
+        """
+        matrice P[a, b] = P(droga a | droga b) = co-occorrenze(a, b) / presenze(b)
+        """
+        presenze = np.diag(self.cooccorrenze)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prob = self.cooccorrenze / presenze[None, :]
+        return np.nan_to_num(prob)
+
+    def tabella_cooccorrenze(self):
+        """
+        co-occorrenze e probabilità condizionate in formato lungo (comodo per i grafici altair)
+        """
+        n = len(self.droghe)
+        return pl.DataFrame({
+            "Droga": np.repeat(self.droghe, n),
+            "Condizione": np.tile(self.droghe, n),
+            "Co-occorrenze": self.cooccorrenze.ravel(),
+            "P(Droga | Condizione)": self.probabilita_condizionate().ravel().round(3)
+        })
+
+    def istogramma_combinazioni(self):
+        """
+        conteggio delle combinazioni esatte di droghe, dalla più frequente
+        """
+        nomi = [
+            " + ".join(d for i, d in enumerate(self.droghe) if (int(m) >> i) & 1) or "Nessuna"
+            for m in self.combinazioni
+        ]
+        return (
+            pl.DataFrame({"Combinazione": nomi, "Morti": self.conteggi})
+            .sort("Morti", descending=True)
+        )
+
+
+@memoizza(maxsize=16)
+def carica_indice_droghe(filtro=(), versione=None):
+    """
+    indice delle co-presenze costruito una volta per versione del dataset (vedi versione_dataset) e filtro globale
+    (vedi filtri.py) leggendo la sola colonna DrugMask
+    (stesso schema compatto usato da app.py)
+    """
+    return IndiceDroghe.da_dati(scan_filtrato(filtro, ["DrugMask"]).collect(), get_droghe())
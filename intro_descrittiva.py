@@ -2,7 +2,9 @@
 import streamlit as st
 import folium
 from streamlit_folium import folium_static
-import json
+
+from geometria import confini
+from tessere import strato_tessere
 
 
 def intro_descrittiva():
@@ -20,24 +22,22 @@ def intro_descrittiva():
     # Creazione della mappa centrata sul Connecticut
     mappa = folium.Map(location = [41.6032, -73.0877], zoom_start = 8)
 
-    # pagina github con le coordinate dei confini degli stati degli USA e le loro città
-    # https://github.com/OpenDataDE/State-zip-code-GeoJSON
-    # da qui ho scaricato il file con quelle del connecticut
-
-    with open("ct_connecticut_zip_codes_geo.min.json", "r") as file:
-        confini_ct = json.load(file)
-
-    # aggiungo alla mappa il layer evidenziante lo stato del connecticut
-    folium.GeoJson(
-        confini_ct,
-        name='Connecticut',
-        style_function = lambda x: {
-            'fillColor': 'red',
-            'color': 'red',
-            'weight': 0.1,
-            'fillOpacity': 0.2
-        }
-    ).add_to(mappa)
+    # lo stato arriva come tessere già disegnate, servite come file statici (vedi tessere.py); se non ci sono,
+    # contorno semplificato per lo zoom della mappa (pochi KB invece dei 4 MB del file con tutte le aree dei CAP, vedi geometria.py)
+    strato_stato = strato_tessere("stato", "Connecticut")
+    if strato_stato is not None:
+        strato_stato.add_to(mappa)
+    else:
+        folium.GeoJson(
+            confini("stato", zoom = 8),
+            name='Connecticut',
+            style_function = lambda x: {
+                'fillColor': 'red',
+                'color': 'red',
+                'weight': 1,
+                'fillOpacity': 0.2
+            }
+        ).add_to(mappa)
 
     # impaginazione della mappa
     # con questi comandi la accentro
@@ -0,0 +1,211 @@
+"""
+Combinazioni frequenti di droghe (itemset frequenti e regole di associazione) con bitset compressi.
+
+Per ogni droga di get_droghe() si tiene un bitset sui decessi (bit = droga presente), impacchettato in parole
+da 64 bit: il supporto di un insieme di droghe è il numero di bit a 1 (popcount) dell'AND dei loro bitset,
+quindi ogni candidato costa una passata su n/64 parole invece che su n righe.
+I decessi sono ordinati per anno e ogni anno occupa un blocco di parole allineato a 64 bit, così con un solo
+popcount si ottengono insieme il supporto totale e quello di ogni anno (somma per blocchi), e la ricerca
+su un solo anno lavora sulla sola fetta di parole dell'anno.
+
+La ricerca è in profondità (Apriori/Eclat): si estendono solo gli insiemi frequenti, portandosi dietro
+il bitset del prefisso, quindi la memoria resta di pochi bitset qualunque sia il numero di itemset.
+"""
+
+import numpy as np
+import polars as pl
+
+from filtri import scan_filtrato
+from memo import memoizza
+from preprocessing import get_droghe
+
+
+class ItemsetDroghe:
+    """
+    bitset delle droghe per anno e ricerca degli itemset frequenti, con regole di associazione e andamento annuo
+    """
+
+    def __init__(self, maschere, anni, colonne_droga):
+        self.droghe = list(colonne_droga)
+        k = len(self.droghe)
+
+        maschere = np.asarray(maschere, dtype=np.uint32)
+        anni = np.asarray(anni)
+        ordine = np.argsort(anni, kind="stable")
+        maschere, anni = maschere[ordine], anni[ordine]
+        self.anni, inizi, self.decessi_anno = np.unique(anni, return_index=True, return_counts=True)
+
+        # ogni anno occupa un numero intero di parole da 64 bit (i bit di riempimento restano a 0)
+        parole = -(-self.decessi_anno // 64)
+        self.confini = np.concatenate([[0], np.cumsum(parole)])
+        self.bitset = np.zeros((k, self.confini[-1] * 8), dtype=np.uint8)
+        for inizio, n, parola in zip(inizi, self.decessi_anno, self.confini[:-1]):
+            bit = (maschere[inizio:inizio + n][None, :] >> np.arange(k, dtype=np.uint32)[:, None]) & 1
+            impacchettati = np.packbits(bit.astype(np.uint8), axis=1, bitorder="little")
+            self.bitset[:, parola * 8:parola * 8 + impacchettati.shape[1]] = impacchettati
+        self.bitset = self.bitset.view(np.uint64)
+
+        self._risultati = {}
+
+    @classmethod
+    def da_dati(cls, dati, colonne_droga):
+        """
+        costruisce i bitset dal dataset (colonne DrugMask e Year dello schema compatto)
+        """
+        return cls(dati.get_column("DrugMask").to_numpy(), dati.get_column("Year").to_numpy(), colonne_droga)
+
+    def _blocchi(self, anno):
+        # fetta di parole e posizioni degli anni interessati (tutti se anno è None)
+        if anno is None:
+            return 0, self.confini[-1], np.arange(len(self.anni))
+        a = int(np.searchsorted(self.anni, anno))
+        if a == len(self.anni) or self.anni[a] != anno:
+            raise ValueError(f"anno non presente nei dati: {anno}")
+        return self.confini[a], self.confini[a + 1], np.array([a])
+
+    def cerca(self, min_supporto, max_lunghezza=5, anno=None):
+        """
+        itemset con supporto (frazione dei decessi considerati) almeno min_supporto e al più max_lunghezza droghe:
+        dizionario tupla di indici delle droghe -> decessi per anno (vettore, negli anni considerati)
+        """
+        chiave = (min_supporto, max_lunghezza, anno)
+        if chiave in self._risultati:
+            return self._risultati[chiave]
+
+        inizio, fine, posizioni = self._blocchi(anno)
+        bitset = self.bitset[:, inizio:fine]
+        confini = self.confini[posizioni] - inizio
+        minimo = max(1, int(np.ceil(min_supporto * self.decessi_anno[posizioni].sum())))
+
+        def conta(bits):
+            # popcount di ogni parola, sommato per blocchi di anni
+            return np.add.reduceat(np.bitwise_count(bits), confini, dtype=np.int64)
+
+        trovati = {}
+        singoli = []
+        for j in range(len(self.droghe)):
+            conteggi = conta(bitset[j])
+            if conteggi.sum() >= minimo:
+                trovati[(j,)] = conteggi
+                singoli.append(j)
+
+        def estendi(prefisso, bits, candidati):
+            for posizione, j in enumerate(candidati):
+                nuovo = bits & bitset[j]
+                conteggi = conta(nuovo)
+                if conteggi.sum() >= minimo:
+                    itemset = prefisso + (j,)
+                    trovati[itemset] = conteggi
+                    if len(itemset) < max_lunghezza:
+                        estendi(itemset, nuovo, candidati[posizione + 1:])
+
+        if max_lunghezza > 1:
+            for posizione, j in enumerate(singoli):
+                estendi((j,), bitset[j], singoli[posizione + 1:])
+
+        self._risultati[chiave] = trovati
+        return trovati
+
+    def _nome(self, itemset):
+        return " + ".join(self.droghe[j] for j in itemset)
+
+    def frequenti(self, min_supporto, min_lunghezza=1, max_lunghezza=5, anno=None):
+        """
+        tabella degli itemset frequenti (Itemset, Lunghezza, Morti, Supporto), dal più frequente
+        """
+        trovati = self.cerca(min_supporto, max_lunghezza, anno)
+        _, _, posizioni = self._blocchi(anno)
+        totale = self.decessi_anno[posizioni].sum()
+        righe = [(self._nome(i), len(i), int(c.sum())) for i, c in trovati.items() if len(i) >= min_lunghezza]
+        return (
+            pl.DataFrame(righe, schema={"Itemset": pl.Utf8, "Lunghezza": pl.Int64, "Morti": pl.Int64}, orient="row")
+            .with_columns((pl.col("Morti") / totale).alias("Supporto"))
+            .sort(["Morti", "Itemset"], descending=[True, False])
+        )
+
+    def per_anno(self, min_supporto, min_lunghezza=1, max_lunghezza=5):
+        """
+        itemset frequenti cercati anno per anno (ogni anno con la sua soglia di supporto), con la colonna Anno
+        """
+        return pl.concat([
+            self.frequenti(min_supporto, min_lunghezza, max_lunghezza, anno).select(pl.lit(int(anno), dtype=pl.Int64).alias("Anno"), pl.all())
+            for anno in self.anni
+        ])
+
+    def regole(self, min_supporto, min_confidenza=0.5, min_lift=1.0, max_lunghezza=5, anno=None):
+        """
+        regole di associazione A -> C tra itemset frequenti, con supporto, confidenza P(C | A)
+        e lift P(C | A) / P(C); ogni sottoinsieme di un itemset frequente è frequente, quindi i supporti ci sono già
+        """
+        trovati = self.cerca(min_supporto, max_lunghezza, anno)
+        _, _, posizioni = self._blocchi(anno)
+        totale = self.decessi_anno[posizioni].sum()
+        supporti = {i: c.sum() / totale for i, c in trovati.items()}
+
+        righe = []
+        for itemset, supporto in supporti.items():
+            if len(itemset) < 2:
+                continue
+            # tutti gli antecedenti non vuoti e propri (bitmask sulle posizioni dell'itemset)
+            for scelta in range(1, (1 << len(itemset)) - 1):
+                antecedente = tuple(d for p, d in enumerate(itemset) if (scelta >> p) & 1)
+                conseguente = tuple(d for p, d in enumerate(itemset) if not (scelta >> p) & 1)
+                confidenza = supporto / supporti[antecedente]
+                lift = confidenza / supporti[conseguente]
+                if confidenza >= min_confidenza and lift >= min_lift:
+                    righe.append((self._nome(antecedente), self._nome(conseguente), supporto, confidenza, lift))
+
+        return (
+            pl.DataFrame(
+                righe,
+                schema={"Antecedente": pl.Utf8, "Conseguente": pl.Utf8, "Supporto": pl.Float64,
+                        "Confidenza": pl.Float64, "Lift": pl.Float64},
+                orient="row"
+            )
+            .sort(["Lift", "Confidenza"], descending=True)
+        )
+
+    def andamento(self, min_supporto, min_lunghezza=3, max_lunghezza=5):
+        """
+        itemset frequenti sull'intero periodo con il supporto anno per anno (quota dei decessi dell'anno)
+        e la pendenza della retta dei minimi quadrati (punti percentuali all'anno): le combinazioni in crescita
+        hanno pendenza positiva. Restituisce (tabella riassuntiva, tabella lunga Itemset, Anno, Supporto)
+        """
+        trovati = {i: c for i, c in self.cerca(min_supporto, max_lunghezza).items() if len(i) >= min_lunghezza}
+        anni = self.anni.astype(np.float64)
+        if not trovati:
+            vuota = pl.DataFrame(schema={"Itemset": pl.Utf8, "Lunghezza": pl.Int64, "Morti": pl.Int64,
+                                         "Pendenza": pl.Float64, "Variazione": pl.Float64})
+            return vuota, pl.DataFrame(schema={"Itemset": pl.Utf8, "Anno": pl.Int64, "Supporto": pl.Float64})
+
+        itemset = list(trovati)
+        nomi = [self._nome(i) for i in itemset]
+        supporti = np.array([trovati[i] for i in itemset]) / self.decessi_anno * 100 # itemset x anni, in %
+
+        # pendenza dei minimi quadrati per tutte le righe insieme
+        centrati = anni - anni.mean()
+        pendenze = supporti @ centrati / (centrati @ centrati) if len(anni) > 1 else np.zeros(len(itemset))
+
+        riassunto = pl.DataFrame({
+            "Itemset": nomi,
+            "Lunghezza": [len(i) for i in itemset],
+            "Morti": [int(trovati[i].sum()) for i in itemset],
+            "Pendenza": pendenze,
+            "Variazione": supporti[:, -1] - supporti[:, 0]
+        }).sort("Pendenza", descending=True)
+        per_anno = pl.DataFrame({
+            "Itemset": np.repeat(nomi, len(anni)),
+            "Anno": np.tile(self.anni.astype(np.int64), len(itemset)),
+            "Supporto": supporti.ravel()
+        })
+        return riassunto, per_anno
+
+
+@memoizza(maxsize=16)
+def carica_itemset(filtro=(), versione=None):
+    """
+    bitset delle droghe per versione del dataset (vedi versione_dataset) e filtro globale (vedi filtri.py),
+    leggendo le sole colonne DrugMask e Year;
+    l'oggetto tiene anche i risultati delle ricerche già fatte
+    """
+    return ItemsetDroghe.da_dati(scan_filtrato(filtro, ["DrugMask", "Year"]).collect(), get_droghe())
@@ -0,0 +1,150 @@
+"""
+Memoizzazione con chiavi basate su impronte del contenuto.
+
+st.cache_data ignora gli argomenti che iniziano con "_" (quindi restituisce grafici vecchi quando cambiano i dati)
+e per gli altri calcola l'hash dell'intero contenuto a ogni chiamata (costoso con array e tabelle grandi).
+Il decoratore memoizza invece usa come chiave un'impronta economica di ogni argomento:
+    - DataFrame/Series polars: schema, numero di righe e hash di un campione di righe distribuite uniformemente
+    - array numpy: forma, tipo e hash di un campione di righe
+    - tuple, liste, dizionari: impronta degli elementi; gli altri valori devono essere hashabili
+La cache è limitata (LRU, al più maxsize voci), le voci possono scadere dopo ttl secondi e ogni funzione
+tiene i contatori di successi, mancati e scartati (vedi statistiche_cache).
+
+I valori restano condivisi tra le chiamate (non vengono copiati come con st.cache_data): vanno trattati come immutabili.
+"""
+
+import functools
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import polars as pl
+
+# righe campionate per l'impronta di tabelle e array
+RIGHE_CAMPIONE = 1024
+
+# funzioni memoizzate, per le statistiche
+_REGISTRO = []
+
+
+def _campione(n, righe_campione = RIGHE_CAMPIONE):
+    # indici distribuiti uniformemente (prima e ultima riga comprese)
+    if n <= righe_campione:
+        return np.arange(n)
+    return np.unique(np.linspace(0, n - 1, righe_campione).astype(np.int64))
+
+
+def _digest(dati):
+    return hashlib.blake2b(dati, digest_size = 16).hexdigest()
+
+
+def impronta(valore):
+    """
+    impronta hashabile ed economica da calcolare di un argomento
+    """
+    if isinstance(valore, pl.Series):
+        valore = valore.to_frame()
+    if isinstance(valore, pl.DataFrame):
+        schema = tuple((nome, str(tipo)) for nome, tipo in valore.schema.items())
+        if valore.width == 0:
+            return ("DataFrame", schema, valore.height)
+        # i Categorical si confrontano per testo: lo stesso codice può indicare stringhe diverse in tabelle diverse
+        campione = valore[_campione(valore.height)].with_columns(pl.col(pl.Categorical).cast(pl.Utf8))
+        hash_righe = campione.hash_rows(seed = 0).to_numpy()
+        return ("DataFrame", schema, valore.height, _digest(hash_righe.tobytes()))
+    if isinstance(valore, np.ndarray):
+        campione = valore[_campione(len(valore))] if valore.ndim else valore
+        return ("ndarray", valore.shape, str(valore.dtype), _digest(np.ascontiguousarray(campione).tobytes()))
+    if isinstance(valore, (tuple, list)):
+        return (type(valore).__name__, tuple(impronta(v) for v in valore))
+    if isinstance(valore, dict):
+        return ("dict", tuple(sorted((k, impronta(v)) for k, v in valore.items())))
+    hash(valore) # solleva TypeError se il valore non si può usare come chiave
+    return valore
+
+
+class FunzioneMemoizzata:
+    """
+    funzione con cache LRU (con scadenza opzionale) indicizzata dalle impronte degli argomenti
+    """
+
+    def __init__(self, funzione, maxsize = 128, ttl = None):
+        functools.update_wrapper(self, funzione)
+        self.funzione = funzione
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._firma = inspect.signature(funzione)
+        self._voci = OrderedDict() # chiave -> (scadenza, valore)
+        self._lock = threading.Lock()
+        self.successi = self.mancati = self.scartati = 0
+
+    def chiave(self, *args, **kwargs):
+        # argomenti posizionali, per nome o di default danno la stessa chiave
+        argomenti = self._firma.bind(*args, **kwargs)
+        argomenti.apply_defaults()
+        return tuple((nome, impronta(valore)) for nome, valore in argomenti.arguments.items())
+
+    def __call__(self, *args, **kwargs):
+        chiave = self.chiave(*args, **kwargs)
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None and (voce[0] is None or voce[0] > time.monotonic()):
+                self._voci.move_to_end(chiave)
+                self.successi += 1
+                return voce[1]
+            self.mancati += 1
+
+        # il calcolo avviene fuori dal lock: chiamate concorrenti con la stessa chiave possono calcolare due volte
+        valore = self.funzione(*args, **kwargs)
+
+        with self._lock:
+            self._voci[chiave] = (time.monotonic() + self.ttl if self.ttl is not None else None, valore)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.maxsize:
+                self._voci.popitem(last = False)
+                self.scartati += 1
+        return valore
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+
+    def statistiche(self):
+        with self._lock:
+            return {
+                "Funzione": f"{self.funzione.__module__}.{self.funzione.__qualname__}",
+                "Voci": len(self._voci),
+                "Massimo": self.maxsize,
+                "Successi": self.successi,
+                "Mancati": self.mancati,
+                "Scartati": self.scartati
+            }
+
+
+def memoizza(maxsize = 128, ttl = None):
+    """
+    decoratore: memoizza la funzione con al più maxsize risultati (LRU), validi per ttl secondi (None: senza scadenza)
+    """
+    def decoratore(funzione):
+        memoizzata = FunzioneMemoizzata(funzione, maxsize, ttl)
+        _REGISTRO.append(memoizzata)
+        return memoizzata
+    return decoratore
+
+
+def statistiche_cache():
+    """
+    contatori di tutte le funzioni memoizzate, come DataFrame polars
+    """
+    return pl.DataFrame([f.statistiche() for f in _REGISTRO])
+
+
+def svuota_cache():
+    """
+    svuota le cache di tutte le funzioni memoizzate (i contatori restano)
+    """
+    for funzione in _REGISTRO:
+        funzione.svuota()
@@ -1,10 +1,36 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import warnings
+from datetime import datetime
+from pathlib import Path
+
 import polars as pl
 import streamlit as st
-import pandas as pd
+
+from cache_file import corrisponde, hash_file, leggi_manifesto, scrivi_atomico
+from citta import LATITUDINE_CT, LONGITUDINE_CT, aggiorna_citta
+from cubo import CUBI, costruisci_cubi, unisci_cubi
+from dimensioni import aggiungi_dimensioni
 
 # link dove trovare il dataset
 # https://catalog.data.gov/dataset/accidental-drug-related-deaths-2012-2018
 
+FILE_DATI = "drug_deaths.csv"
+
+# cartella dove salvo lo snapshot del dataset già pulito (formato Arrow IPC)
+CARTELLA_CACHE = Path("cache")
+
+# da incrementare ogni volta che cambia la pipeline di pulizia,
+# così gli snapshot vecchi vengono invalidati e ricostruiti
+VERSIONE_PIPELINE = 5
+
+# aggregati precalcolati insieme allo snapshot (per ora solo i cubi, vedi cubo.py)
+AGGREGATI = list(CUBI)
+
 def get_droghe():
     """
     funzione fatta per estrarre le colonne relative alle droghe dal dataset (variabili binarie)
@@ -20,126 +46,515 @@ def get_droghe():
     return colonne_droga
 
 
-@st.cache_data
-def carica_dati():
+# mappe per tradurre i numeri dei giorni della settimana e dei mesi in nomi
+# (dt.weekday() di polars segue la convenzione ISO: 1 = lunedì, 7 = domenica)
+GIORNI_SETTIMANA = {
+    1: "Lunedì",
+    2: "Martedì",
+    3: "Mercoledì",
+    4: "Giovedì",
+    5: "Venerdì",
+    6: "Sabato",
+    7: "Domenica"
+}
+
+NOMI_MESI = {
+    1: "Gennaio",
+    2: "Febbraio",
+    3: "Marzo",
+    4: "Aprile",
+    5: "Maggio",
+    6: "Giugno",
+    7: "Luglio",
+    8: "Agosto",
+    9: "Settembre",
+    10: "Ottobre",
+    11: "Novembre",
+    12: "Dicembre"
+}
+
+# colonne temporali create dalla pipeline, messe subito dopo "Age" per una migliore visualizzazione
+COLONNE_DATA = ["Year", "Month", "Month_num", "Quarter", "Day", "Day_num", "DayOfWeek"]
+
+# tipi usati dallo schema compatto: mesi e giorni sono insiemi chiusi (Enum, ordinati nel modo naturale),
+# le altre dimensioni hanno valori non noti a priori (Categorical)
+ENUM_MESI = pl.Enum(list(NOMI_MESI.values()))
+ENUM_GIORNI = pl.Enum(list(GIORNI_SETTIMANA.values()))
+DIMENSIONI_CATEGORICHE = ["Sex", "Race", "Death County", "Death City", "Location"]
+
+
+def piano_pulizia(sorgente, compatto = False, citta = None):
+    """
+    costruisce il piano lazy di pulizia e trasformazione a partire da un LazyFrame grezzo
+    (letto con pl.scan_csv), così polars può ottimizzarlo ed eseguirlo in un'unica passata
+
+    citta è la tabella delle città (vedi citta.py) da cui si prende la chiave CityKey di ogni riga,
+    se manca viene costruita dalla sorgente stessa
+    con compatto = True il risultato usa lo schema compatto (vedi _compatta)
+    """
+    colonne = sorgente.collect_schema().names()
+    colonne_droga = get_droghe()
+    data = pl.col("Date")
+    if citta is None:
+        citta = aggiorna_citta(None, sorgente)
+
+    # ordine finale delle colonne: le colonne temporali dopo "Age", le dimensioni derivate e la chiave della città in fondo
+    posizione = colonne.index("Age") + 1
+    ordine = colonne[:posizione] + COLONNE_DATA + colonne[posizione:] + ["YearMonth", "AgeBand", "LocationCategory", "CityKey"]
+
+    piano = (
+        sorgente
+        # conversione del formato della colonna Date
+        .with_columns(data.str.strptime(pl.Datetime, format="%m/%d/%Y"))
+        .with_columns([
+            # sostituisco gli NA in Age con la media generale (solo 3 valori mancanti, quindi non inficia sui risultati finali)
+            pl.col("Age").fill_null(strategy="mean").cast(pl.Int64),
+            # Rimpiazzo valori nulli in alcune colonne (utili alle successive analisi) con "unknown"
+            pl.col("Sex").fill_null("Unknown").cast(pl.Utf8),
+            pl.col("Race").fill_null("Unknown"),
+            pl.col("Death County").fill_null("Unknown").cast(pl.Utf8),
+            # Creazione di colonne separate per anno, mese e trimestre, utile per analisi di serie storiche
+            data.dt.year().cast(pl.Int64).alias("Year"),
+            data.dt.month().replace_strict(NOMI_MESI, return_dtype=pl.Utf8).alias("Month"),
+            data.dt.month().cast(pl.Int64).alias("Month_num"),
+            data.dt.quarter().cast(pl.Int64).alias("Quarter"), # aggiungo anche il trimestre (= quarter in inglese)
+            data.dt.day().cast(pl.Int64).alias("Day"),
+            data.dt.day().cast(pl.Int64).alias("Day_num"),
+            data.dt.weekday().replace_strict(GIORNI_SETTIMANA, return_dtype=pl.Utf8).alias("DayOfWeek"),
+            (data.dt.year().cast(pl.Int64) * 100 + data.dt.month().cast(pl.Int64)).alias("YearMonth"),
+            # conversione dei valori delle colonne relative alle droghe in valori binari, tutte in una volta
+            # (Y = 1, altrimenti = 0)
+            (pl.col(colonne_droga) == "Y").fill_null(False).cast(pl.Int32)
+        ])
+        # dimensioni derivate (fascia d'età e categoria del luogo), vedi dimensioni.py
+        .pipe(aggiungi_dimensioni)
+        # le coordinate non si estraggono più riga per riga: ogni riga prende solo la chiave della sua città
+        .join(citta.lazy().select(["DeathCityGeo", "CityKey"]), on = "DeathCityGeo", how = "left")
+        .select(ordine)
+    )
+
+    return _compatta(piano) if compatto else piano
+
+
+def _compatta(piano):
+    """
+    schema compatto: flag delle droghe in UInt8 più una colonna DrugMask (UInt32) con un bit per droga
+    (bit i = i-esima droga di get_droghe()), dimensioni come Enum/Categorical e interi piccoli
+    """
+    colonne_droga = get_droghe()
+    return piano.with_columns([
+        pl.col(colonne_droga).cast(pl.UInt8),
+        pl.sum_horizontal([
+            pl.col(droga).cast(pl.UInt32) * (1 << i) for i, droga in enumerate(colonne_droga)
+        ]).alias("DrugMask"),
+        pl.col(["Age", "Year"]).cast(pl.Int16),
+        pl.col(["Month_num", "Quarter", "Day", "Day_num"]).cast(pl.Int8),
+        pl.col("CityKey").cast(pl.UInt16),
+        pl.col("YearMonth").cast(pl.Int32),
+        pl.col("Month").cast(ENUM_MESI),
+        pl.col("DayOfWeek").cast(ENUM_GIORNI),
+        pl.col(DIMENSIONI_CATEGORICHE).cast(pl.Categorical)
+    ])
+
+
+def pulisci_dati(percorso = FILE_DATI, compatto = False, citta = None):
     """
     Fase di preprocessing:
     In questa funzione carico, pulisco e trasformo i dati per renderli lavorabili per le mie analisi
     """
-    dati = pl.read_csv("drug_deaths.csv", ignore_errors = True) # carico i dati
+    return piano_pulizia(pl.scan_csv(percorso, ignore_errors = True), compatto, citta).collect()
+
+
+def _chiave(percorso):
+    """
+    la chiave degli artefatti su disco è data dall'hash del csv più la versione della pipeline
+    """
+    return {"sorgente": hash_file(percorso), "versione": VERSIONE_PIPELINE}
 
-    # conversione del formato della colonna Date e rimozione dei valori nulli
-    dati = dati.with_columns(
-        # creo una nuova colonna con le date in formato datetime
-        pl.col("Date").str.strptime(pl.Datetime, format="%m/%d/%Y")
-    )
 
-    # fase di pulizia/riordino del dataset
-    dati = (dati
-            .with_columns([
-                pl.col("Age").fill_null(strategy="mean"), # sostituisco gli NA in Age con la media generale (solo 3 valori mancanti, quindi non inficia sui risultati finali)
-                # Rimpiazzo valori nulli in alcune colonne (utili alle successive analisi) con "unknown"
-                pl.col("Sex").fill_null("Unknown"),
-                pl.col("Race").fill_null("Unknown"),
-                pl.col("Death County").fill_null("Unknown"),
-                # Creazione di colonne separate per anno, mese e trimestre
-                # utile per analisi di serie storiche
-                pl.col("Date").dt.year().alias("Year").cast(pl.Int64),
-                pl.col("Date").dt.month().alias("Month").cast(pl.Int64),
-                pl.col("Date").dt.day().alias("Day").cast(pl.Int64),
-                pl.col("Date").dt.month().alias("Month_num").cast(pl.Int64),
-                pl.col("Date").dt.day().alias("Day_num").cast(pl.Int64),
-                pl.col("Date").dt.quarter().alias("Quarter").cast(pl.Int64), # aggiungo anche il trimestre (= quarter in inglese)
-                pl.col("Date").dt.weekday().alias("DayOfWeek").cast(pl.Int64)
-
-            ])
+def _chiavi_record(percorso, giorno):
+    """
+    chiavi dei record del csv con data uguale a giorno, come dizionario indice della riga -> chiave.
+    Il dataset non ha un identificativo di riga, quindi la chiave è l'hash del contenuto grezzo della riga
+    più il numero di righe identiche che la precedono: due decessi uguali nello stesso giorno restano distinti
+    """
+    righe = (
+        pl.scan_csv(percorso, infer_schema = False)
+        .with_row_index("_riga")
+        .filter(pl.col("Date").str.strptime(pl.Datetime, format = "%m/%d/%Y", strict = False) == giorno)
+        .collect()
     )
+    contenuti = righe.drop("_riga").select(pl.concat_str(pl.all().fill_null(""), separator = "\x1f")).to_series()
+    chiavi, viste = {}, {}
+    for riga, contenuto in zip(righe["_riga"].to_list(), contenuti.to_list()):
+        impronta = hashlib.sha256(contenuto.encode()).hexdigest()[:16]
+        chiavi[riga] = f"{impronta}:{viste.get(impronta, 0)}"
+        viste[impronta] = viste.get(impronta, 0) + 1
+    return chiavi
 
-    dati = dati.with_columns((pl.col("Year") * 100 + pl.col("Month_num")).alias("YearMonth"))
-
-    # creo un dizionario per la mappare i giorni della settimana salvati nella varaiabile DayOfWeek
-    giorno_settimana = {
-        0: "Lunedì",
-        1: "Martedì",
-        2: "Mercoledì",
-        3: "Giovedì",
-        4: "Venerdì",
-        5: "Sabato",
-        6: "Domenica"
-    }
 
-    nomi_mesi = {
-        1: "Gennaio",
-        2: "Febbraio",
-        3: "Marzo",
-        4: "Aprile",
-        5: "Maggio",
-        6: "Giugno",
-        7: "Luglio",
-        8: "Agosto",
-        9: "Settembre",
-        10: "Ottobre",
-        11: "Novembre",
-        12: "Dicembre"
+def _concatena(parti):
+    """
+    concatena (senza copiare) lo snapshot di base e i delta aggiunti in seguito
+    """
+    if len(parti) == 1:
+        return parti[0]
+    # i Categorical dei vari file hanno codifiche diverse, la ricodifica è attesa e si fa una volta sola
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", pl.exceptions.CategoricalRemappingWarning)
+        return pl.concat(parti, rechunk = False)
+
+
+def _nome_artefatto(nome, compatto):
+    # gli artefatti dello schema compatto vivono accanto a quelli normali, con un suffisso
+    return f"{nome}_compatto" if compatto else nome
+
+
+def carica_snapshot(percorso = FILE_DATI, cartella = CARTELLA_CACHE, compatto = False):
+    """
+    restituisce il dataset pulito leggendolo dallo snapshot su disco (in memory-map),
+    se lo snapshot manca o non corrisponde al csv/versione della pipeline lo ricostruisce
+
+    il manifesto tiene anche la data più recente presente (watermark), le chiavi dei record di quel giorno
+    (vedi _chiavi_record) e l'elenco dei delta aggiunti con ingerisci_delta, che vengono letti e accodati
+    allo snapshot di base
+    """
+    cartella = Path(cartella)
+    nome = _nome_artefatto("dati", compatto)
+    snapshot = cartella / f"{nome}.arrow"
+    manifesto = cartella / f"{nome}.json"
+    chiave = _chiave(percorso)
+
+    salvata = leggi_manifesto(manifesto)
+    if snapshot.exists() and corrisponde(salvata, chiave):
+        parti = [snapshot] + [cartella / delta["file"] for delta in salvata.get("delta", [])]
+        return _concatena([pl.read_ipc(parte, memory_map = True) for parte in parti])
+
+    citta = aggiorna_citta(None, pl.scan_csv(percorso, ignore_errors = True))
+    dati = pulisci_dati(percorso, compatto, citta)
+
+    cartella.mkdir(parents = True, exist_ok = True)
+    # un rebuild completo riassorbe i delta precedenti (il csv nuovo li contiene già)
+    for vecchio in cartella.glob(f"{nome}_delta_*.arrow"):
+        vecchio.unlink()
+    # niente compressione, altrimenti il memory-map non è possibile
+    scrivi_atomico(snapshot, lambda p: dati.write_ipc(p, compression = "uncompressed"))
+    scrivi_atomico(_percorso_citta(cartella, compatto), lambda p: citta.write_ipc(p, compression = "uncompressed"))
+    # il manifesto va scritto dopo lo snapshot e la tabella delle città, così non punta mai a dati incompleti
+    watermark = dati["Date"].max()
+    salvata = {
+        **chiave,
+        "watermark": watermark.isoformat(),
+        "record_watermark": sorted(_chiavi_record(percorso, watermark).values()),
+        "delta": []
     }
+    scrivi_atomico(manifesto, lambda p: p.write_text(json.dumps(salvata)))
 
-    # converto il dataset in un dataframe pandas per poter applicare map
-    dati_pd = dati.to_pandas()
+    return dati
 
-    dati_pd["DayOfWeek"] = dati_pd["DayOfWeek"].map(giorno_settimana)
-    dati_pd["Month"] = dati_pd["Month"].map(nomi_mesi)
 
-    # ritorno a un dataframe polars
-    dati = pl.from_pandas(dati_pd)
+def _percorso_citta(cartella, compatto):
+    return cartella / f"{_nome_artefatto('citta', compatto)}.arrow"
 
-    # conversione dei valori delle colonne relative alle droghe in valori binari, questo per comodità nei successivi calcoli
-    # (Y = 1, altrimenti = 0)
-    colonne_droga = get_droghe()
-    for droga in colonne_droga:
-        dati =  dati.with_columns(
-            pl.when(pl.col(droga) == "Y").then(1).otherwise(0).alias(droga)
-        )
 
-    # conversione di formato dei valori di alcune variaili
-    dati = dati.with_columns([
-                pl.col("Age").cast(pl.Int64),
-                pl.col("Death County").cast(pl.Utf8),
-                pl.col("Sex").cast(pl.Utf8)
-    ])
+def carica_citta_snapshot(percorso = FILE_DATI, cartella = CARTELLA_CACHE, compatto = False):
+    """
+    tabella delle città (vedi citta.py) allineata allo snapshot del dataset:
+    viene scritta insieme allo snapshot e aggiornata da ingerisci_delta, quindi basta assicurarsi
+    che lo snapshot sia valido e leggerla
+    """
+    cartella = Path(cartella)
+    carica_snapshot(percorso, cartella, compatto)
+    return pl.read_ipc(_percorso_citta(cartella, compatto), memory_map = True)
 
-    # estraggo la latitudine e la longitudine
-    dati = dati.with_columns([
-        pl.col("DeathCityGeo")
-        .str.extract(r"\(([^,]+), ([^)]+)\)", 1)
-        .cast(pl.Float64)
-        .alias("Latitudine"),
-
-        pl.col("DeathCityGeo")
-        .str.extract(r"\(([^,]+), ([^)]+)\)", 2)
-        .cast(pl.Float64)
-        .alias("Longitudine")
-    ])
 
-    # dato che colonne relative alla data create prima vengono messe alla fine, le sposto all'inizio per una migliore visualizzazione
+def costruisci_aggregati(dati):
+    """
+    calcola gli aggregati definiti in AGGREGATI a partire dal dataset pulito
+    """
+    return costruisci_cubi(dati, get_droghe())
+
+
+def unisci_aggregati(vecchi, nuovi):
+    """
+    somma due insiemi di aggregati (es. storico + delta) senza ripassare dai dati di dettaglio
+    """
+    # i Categorical dei cubi vecchi e nuovi hanno codifiche diverse, la ricodifica è attesa
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", pl.exceptions.CategoricalRemappingWarning)
+        return unisci_cubi(vecchi, nuovi)
+
+
+def _percorsi_aggregati(cartella, compatto):
+    nome_aggregati = _nome_artefatto("aggregati", compatto)
+    cartella_aggregati = cartella / nome_aggregati
+    file_aggregati = {nome: cartella_aggregati / f"{nome}.arrow" for nome in AGGREGATI}
+    return file_aggregati, cartella / f"{nome_aggregati}.json"
+
+
+def _scrivi_aggregati(aggregati, file_aggregati, manifesto, chiave):
+    for nome, tabella in aggregati.items():
+        file_aggregati[nome].parent.mkdir(parents = True, exist_ok = True)
+        scrivi_atomico(file_aggregati[nome], lambda p: tabella.write_ipc(p, compression = "uncompressed"))
+    scrivi_atomico(manifesto, lambda p: p.write_text(json.dumps(chiave)))
+
+
+def carica_aggregati_snapshot(percorso = FILE_DATI, cartella = CARTELLA_CACHE, compatto = False):
+    """
+    come carica_snapshot ma per gli aggregati: li legge da disco se validi, altrimenti li ricalcola
+    (sono validi se corrispondono allo stesso csv, versione e delta dello snapshot)
+    """
+    cartella = Path(cartella)
+    file_aggregati, manifesto = _percorsi_aggregati(cartella, compatto)
+    chiave = _chiave(percorso)
+
+    salvata_dati = leggi_manifesto(cartella / f"{_nome_artefatto('dati', compatto)}.json")
+    delta = salvata_dati.get("delta", []) if corrisponde(salvata_dati, chiave) else []
+    chiave["delta"] = [d["hash"] for d in delta]
+
+    if corrisponde(leggi_manifesto(manifesto), chiave) and all(f.exists() for f in file_aggregati.values()):
+        return {nome: pl.read_ipc(f, memory_map = True) for nome, f in file_aggregati.items()}
+
+    aggregati = costruisci_aggregati(carica_snapshot(percorso, cartella, compatto))
+    _scrivi_aggregati(aggregati, file_aggregati, manifesto, chiave)
 
-    dati = dati.drop("Year").insert_column(3, dati.get_column("Year"))
-    dati = dati.drop("Month").insert_column(4, dati.get_column("Month"))
-    dati = dati.drop("Month_num").insert_column(5, dati.get_column("Month_num"))
-    dati = dati.drop("Quarter").insert_column(6, dati.get_column("Quarter"))
-    dati = dati.drop("Day").insert_column(7, dati.get_column("Day"))
-    dati = dati.drop("Day_num").insert_column(8, dati.get_column("Day_num"))
-    dati = dati.drop("DayOfWeek").insert_column(9, dati.get_column("DayOfWeek"))
+    return aggregati
+
+
+def _percorsi_dataset(cartella, compatto):
+    nome_dataset = _nome_artefatto("dataset", compatto)
+    return cartella / nome_dataset, cartella / f"{nome_dataset}.json"
+
+
+def _scrivi_partizione(dati, cartella_dataset, nome_file):
+    """
+    scrive le righe di dati nelle partizioni Year=<anno>/ del dataset, un file per anno
+    """
+    for (anno,), parte in dati.partition_by("Year", as_dict = True).items():
+        cartella_anno = cartella_dataset / f"Year={anno}"
+        cartella_anno.mkdir(parents = True, exist_ok = True)
+        scrivi_atomico(cartella_anno / nome_file, lambda p: parte.write_parquet(p, statistics = True))
+
+
+def carica_dataset_snapshot(percorso = FILE_DATI, cartella = CARTELLA_CACHE, compatto = False):
+    """
+    si assicura che su disco ci sia il dataset pulito partizionato per anno (parquet in stile hive,
+    Year=2012/..., con le statistiche di colonna) allineato allo snapshot, e ne restituisce la cartella
+    """
+    cartella = Path(cartella)
+    cartella_dataset, manifesto = _percorsi_dataset(cartella, compatto)
+    chiave = _chiave(percorso)
+
+    salvata_dati = leggi_manifesto(cartella / f"{_nome_artefatto('dati', compatto)}.json")
+    delta = salvata_dati.get("delta", []) if corrisponde(salvata_dati, chiave) else []
+    chiave["delta"] = [d["hash"] for d in delta]
+
+    if cartella_dataset.exists() and corrisponde(leggi_manifesto(manifesto), chiave):
+        return cartella_dataset
+
+    dati = carica_snapshot(percorso, cartella, compatto)
+
+    # riscrivo tutto in una cartella temporanea e poi la sostituisco a quella vecchia
+    temporanea = cartella_dataset.with_name(cartella_dataset.name + ".tmp")
+    shutil.rmtree(temporanea, ignore_errors = True)
+    _scrivi_partizione(dati, temporanea, "00000000.parquet")
+    shutil.rmtree(cartella_dataset, ignore_errors = True)
+    os.replace(temporanea, cartella_dataset)
+    scrivi_atomico(manifesto, lambda p: p.write_text(json.dumps(chiave)))
+
+    return cartella_dataset
+
+
+def scan_dataset(cartella_dataset, anni = None, colonne = None):
+    """
+    LazyFrame sul dataset partizionato: il filtro sugli anni e la selezione delle colonne
+    vengono spinti fino ai file, quindi si leggono solo le partizioni e le colonne richieste.
+
+    anni può essere un anno singolo o una coppia (inizio, fine) con estremi inclusi
+    """
+    dati = pl.scan_parquet(
+        Path(cartella_dataset) / "**" / "*.parquet",
+        hive_partitioning = True,
+        # lo stesso tipo di Year che c'è nei file (Int16 nello schema compatto)
+        hive_schema = {"Year": pl.read_parquet_schema(next(Path(cartella_dataset).rglob("*.parquet")))["Year"]},
+        # niente lettura "prefiltered": in polars 1.19, con un filtro su Year insieme ad altri filtri,
+        # ignora i filtri sulle altre colonne e restituisce righe in più
+        parallel = "row_groups"
+    )
+
+    if isinstance(anni, int):
+        dati = dati.filter(pl.col("Year") == anni)
+    elif anni is not None:
+        inizio, fine = anni
+        dati = dati.filter(pl.col("Year").is_between(inizio, fine))
+
+    if colonne is not None:
+        dati = dati.select(colonne)
 
     return dati
 
 
-def main():
+def ingerisci_delta(percorso_delta, percorso = FILE_DATI, cartella = CARTELLA_CACHE, compatto = False):
+    """
+    ingestione incrementale: pulisce con la stessa pipeline solo le righe del file delta
+    (stesso formato del csv) dal giorno del watermark in poi, scartando i record di quel giorno già ingeriti
+    (confrontando le chiavi di _chiavi_record), così i record arrivati in ritardo per lo stesso giorno
+    non vanno persi; le salva come file a parte
+    accodato allo snapshot (e al dataset partizionato) e aggiorna gli aggregati sommando i conteggi del delta.
+    Il costo è proporzionale al delta e non allo storico; restituisce il numero di righe aggiunte.
+
+    nota: gli eventuali valori mancanti di Age nel delta sono sostituiti con la media dei nuovi record del delta
+    """
+    cartella = Path(cartella)
+    nome = _nome_artefatto("dati", compatto)
+    manifesto = cartella / f"{nome}.json"
+    chiave = _chiave(percorso)
+
+    salvata = leggi_manifesto(manifesto)
+    if not corrisponde(salvata, chiave):
+        # senza uno snapshot valido non c'è nulla a cui accodare: lo costruisco (dal solo csv)
+        carica_snapshot(percorso, cartella, compatto)
+        salvata = leggi_manifesto(manifesto)
+
+    hash_delta = hash_file(percorso_delta)
+    if any(d["hash"] == hash_delta for d in salvata["delta"]):
+        return 0 # delta già ingerito
+
+    watermark = datetime.fromisoformat(salvata["watermark"])
+    data = pl.col("Date").str.strptime(pl.Datetime, format = "%m/%d/%Y")
+    presenti = salvata.get("record_watermark")
+    if presenti is None:
+        # manifesto precedente alle chiavi dei record: resta il confine stretto sul watermark
+        nuove_righe = data > watermark
+    else:
+        presenti = set(presenti)
+        gia_ingerite = [riga for riga, chiave in _chiavi_record(percorso_delta, watermark).items() if chiave in presenti]
+        nuove_righe = (data >= watermark) & ~pl.col("_riga").is_in(gia_ingerite)
+    sorgente = (
+        pl.scan_csv(percorso_delta, ignore_errors = True)
+        .with_row_index("_riga")
+        .filter(nuove_righe)
+        .drop("_riga")
+    )
+    # le città mai viste prima vengono aggiunte in fondo alla tabella, con chiavi nuove
+    citta = aggiorna_citta(pl.read_ipc(_percorso_citta(cartella, compatto)), sorgente)
+    nuovi = piano_pulizia(sorgente, compatto, citta).collect()
+    if nuovi.height == 0:
+        return 0
+
+    file_delta = f"{nome}_delta_{len(salvata['delta']) + 1:04d}.arrow"
+    scrivi_atomico(cartella / file_delta, lambda p: nuovi.write_ipc(p, compression = "uncompressed"))
+    scrivi_atomico(_percorso_citta(cartella, compatto), lambda p: citta.write_ipc(p, compression = "uncompressed"))
+
+    # gli aggregati si aggiornano solo se erano allineati allo snapshot prima del delta,
+    # altrimenti verranno ricostruiti al prossimo caricamento
+    file_aggregati, manifesto_aggregati = _percorsi_aggregati(cartella, compatto)
+    chiave_aggregati = {**chiave, "delta": [d["hash"] for d in salvata["delta"]]}
+    if corrisponde(leggi_manifesto(manifesto_aggregati), chiave_aggregati):
+        vecchi = {nome_agg: pl.read_ipc(f) for nome_agg, f in file_aggregati.items()}
+        aggregati = unisci_aggregati(vecchi, costruisci_aggregati(nuovi))
+        chiave_aggregati["delta"].append(hash_delta)
+        _scrivi_aggregati(aggregati, file_aggregati, manifesto_aggregati, chiave_aggregati)
+
+    # stesso discorso per il dataset partizionato: accodo un file per ogni anno toccato dal delta
+    cartella_dataset, manifesto_dataset = _percorsi_dataset(cartella, compatto)
+    chiave_dataset = {**chiave, "delta": [d["hash"] for d in salvata["delta"]]}
+    if cartella_dataset.exists() and corrisponde(leggi_manifesto(manifesto_dataset), chiave_dataset):
+        _scrivi_partizione(nuovi, cartella_dataset, file_delta.replace(".arrow", ".parquet"))
+        chiave_dataset["delta"].append(hash_delta)
+        scrivi_atomico(manifesto_dataset, lambda p: p.write_text(json.dumps(chiave_dataset)))
+
+    salvata["delta"].append({"hash": hash_delta, "file": file_delta, "righe": nuovi.height})
+    nuovo_watermark = nuovi["Date"].max()
+    chiavi = set(_chiavi_record(percorso_delta, nuovo_watermark).values())
+    if presenti is not None and nuovo_watermark == watermark:
+        chiavi |= presenti
+    salvata["watermark"] = nuovo_watermark.isoformat()
+    salvata["record_watermark"] = sorted(chiavi)
+    scrivi_atomico(manifesto, lambda p: p.write_text(json.dumps(salvata)))
+
+    return nuovi.height
+
+
+def versione_dataset(compatto = False, percorso = FILE_DATI, cartella = CARTELLA_CACHE):
+    """
+    token della versione dei dati: hash dello stato del csv (dimensione e data di modifica, così non va riletto
+    a ogni esecuzione) e del manifesto dello snapshot (sorgente, versione della pipeline e delta ingeriti).
+    Cambia dopo un append o quando il csv viene modificato; va passato ai loader in cache qui sotto e usato
+    nelle chiavi delle cache dei risultati calcolati dai dati
+    """
+    stato = os.stat(percorso)
+    manifesto = leggi_manifesto(Path(cartella) / f"{_nome_artefatto('dati', compatto)}.json")
+    impronta = json.dumps([stato.st_size, stato.st_mtime_ns, manifesto], sort_keys = True)
+    return hashlib.sha256(impronta.encode()).hexdigest()[:16]
+
+
+# i loader seguenti tengono in memoria una versione dei dati per processo (st.cache_resource, condivisa tra le sessioni);
+# l'argomento versione (vedi versione_dataset) non entra nel calcolo ma fa parte della chiave della cache, così dopo
+# un append o una modifica del csv i dati vengono ricaricati invece di restare quelli vecchi
+VERSIONI_IN_MEMORIA = 2
+
+
+@st.cache_resource(max_entries = VERSIONI_IN_MEMORIA)
+def carica_dati(compatto = False, versione = None):
+    """
+    carica il dataset pulito, passando dallo snapshot su disco
+    (a differenza di st.cache_data, st.cache_resource non lo serializza né lo copia a ogni lettura,
+    quindi resta in memory-map; va trattato come immutabile)
+
+    con compatto = True usa lo schema compatto: flag delle droghe UInt8 + DrugMask,
+    dimensioni categoriche e interi piccoli, molto più leggero in memoria
+    """
+    return carica_snapshot(compatto = compatto)
+
+
+@st.cache_resource(max_entries = VERSIONI_IN_MEMORIA)
+def carica_aggregati(compatto = False, versione = None):
+    """
+    carica gli aggregati precalcolati (vedi AGGREGATI), passando dai file su disco
+    """
+    return carica_aggregati_snapshot(compatto = compatto)
+
+
+@st.cache_resource(max_entries = VERSIONI_IN_MEMORIA)
+def carica_citta(compatto = False, versione = None):
+    """
+    carica la tabella delle città (chiave, città, contea, CAP, coordinate e flag di validità)
+    """
+    return carica_citta_snapshot(compatto = compatto)
+
+
+def carica_cubi(compatto = False, versione = None):
+    """
+    cubi materializzati delle morti (vedi cubo.py), costruiti una volta e poi letti da disco
+    """
+    aggregati = carica_aggregati(compatto, versione)
+    return {nome: aggregati[nome] for nome in CUBI}
+
+
+@st.cache_resource(max_entries = VERSIONI_IN_MEMORIA)
+def prepara_dataset(compatto = False, versione = None):
+    """
+    cartella del dataset partizionato per anno (costruita se manca), verificata una volta per versione dei dati
+    """
+    return str(carica_dataset_snapshot(compatto = compatto))
+
+
+def scan_dati(anni = None, colonne = None, compatto = False, cartella_dataset = None):
     """
-    main di collaudo del preprocessing dei dati
+    legge dal dataset partizionato solo gli anni e le colonne richiesti (vedi scan_dataset),
+    in alternativa a carica_dati quando un'analisi non ha bisogno dell'intera tabella;
+    cartella_dataset permette di leggere un dataset diverso da quello dell'app (es. nella suite di benchmark.py)
     """
+    if cartella_dataset is None:
+        cartella_dataset = prepara_dataset(compatto, versione_dataset(compatto))
+    return scan_dataset(cartella_dataset, anni, colonne)
 
-    dati = carica_dati()
 
+def profila(dati):
+    """
+    stampa una panoramica del dataset pulito (ex main di collaudo del preprocessing)
+    """
     print("\nStruttura del dataset")
     print(dati.glimpse())
 
@@ -157,7 +572,102 @@ def main():
         if n_nulli > 0:
             print(f"{var}: {n_nulli} valori nulli")
 
-main()
 
+def valida(dati, aggregati, citta):
+    """
+    controlli di coerenza sul dataset pulito, sugli aggregati e sulla tabella delle città,
+    restituisce la lista dei controlli falliti (vuota se è tutto a posto)
+    """
+    colonne_droga = get_droghe()
+    mancanti = [
+        c for c in ["Date", "Age", "Sex", "Race", "DeathCityGeo", "AgeBand", "LocationCategory"] + COLONNE_DATA + colonne_droga
+        if c not in dati.columns
+    ]
+    if mancanti:
+        return [f"colonne mancanti: {mancanti}"]
+
+    controlli = {
+        "date non nulle": dati["Date"].null_count() == 0,
+        "età nulle assenti": dati["Age"].null_count() == 0,
+        "età plausibili (0-120)": dati["Age"].is_between(0, 120).all(),
+        "fascia d'età per ogni riga": dati["AgeBand"].null_count() == 0,
+        "categoria del luogo per ogni luogo": (dati["LocationCategory"].is_null() == dati["Location"].is_null()).all(),
+        "droghe binarie (0/1)": dati.select(pl.col(colonne_droga).cast(pl.Int64).is_in([0, 1]).all()).row(0) == (True,) * len(colonne_droga),
+        "coordinate nel Connecticut": (
+            citta
+            .filter(pl.col("CoordinateValide"))
+            .select(
+                pl.col("Latitudine").is_between(*LATITUDINE_CT).all()
+                & pl.col("Longitudine").is_between(*LONGITUDINE_CT).all()
+            )
+            .item() in (True, None)
+        ),
+        # ogni riga con DeathCityGeo deve avere la chiave di una città presente in tabella
+        "chiavi delle città coerenti": (
+            dati.filter(pl.col("DeathCityGeo").is_not_null() & pl.col("CityKey").is_null()).height == 0
+            and dati["CityKey"].drop_nulls().is_in(citta["CityKey"].cast(dati["CityKey"].dtype)).all()
+        ),
+        "cubi coerenti col dataset": all(
+            aggregati[nome]["Morti totali"].sum() == dati.height
+            and aggregati[nome].select(colonne_droga).sum().row(0) == dati.select(pl.col(colonne_droga).cast(pl.Int64)).sum().row(0)
+            for nome in CUBI
+        )
+    }
+
+    return [nome for nome, esito in controlli.items() if not esito]
+
+
+def main(argv = None):
+    """
+    interfaccia a riga di comando del preprocessing:
+        python -m preprocessing build     -> costruisce snapshot, aggregati e dataset partizionato (da lanciare prima dell'app, con --compatto)
+        python -m preprocessing append --delta nuovi.csv -> accoda i nuovi record e aggiorna gli aggregati
+        python -m preprocessing profile   -> stampa la panoramica del dataset pulito
+        python -m preprocessing validate  -> esegue i controlli di coerenza
+    """
+    parser = argparse.ArgumentParser(prog = "preprocessing", description = "preprocessing del dataset delle morti per droga")
+    parser.add_argument("comando", choices = ["build", "append", "profile", "validate"])
+    parser.add_argument("--csv", default = FILE_DATI, help = "percorso del csv sorgente")
+    parser.add_argument("--cartella", default = CARTELLA_CACHE, type = Path, help = "cartella degli artefatti")
+    parser.add_argument("--compatto", action = "store_true", help = "usa lo schema compatto (quello usato dall'app)")
+    parser.add_argument("--delta", help = "file csv con i nuovi record (per append)")
+    args = parser.parse_args(argv)
+
+    if args.comando == "append":
+        if not args.delta:
+            parser.error("append richiede --delta")
+        righe = ingerisci_delta(args.delta, args.csv, args.cartella, args.compatto)
+        print(f"aggiunte {righe} righe da {args.delta}")
+        return 0
+
+    dati = carica_snapshot(args.csv, args.cartella, args.compatto)
+
+    if args.comando == "build":
+        aggregati = carica_aggregati_snapshot(args.csv, args.cartella, args.compatto)
+        cartella_dataset = carica_dataset_snapshot(args.csv, args.cartella, args.compatto)
+        print(f"snapshot: {dati.height} righe, {dati.width} colonne, {dati.estimated_size('mb'):.1f} MB")
+        print(f"dataset partizionato per anno: {len(list(cartella_dataset.iterdir()))} partizioni in {cartella_dataset}")
+        print(f"tabella delle città: {carica_citta_snapshot(args.csv, args.cartella, args.compatto).height} righe")
+        for nome, tabella in aggregati.items():
+            print(f"aggregato {nome}: {tabella.height} righe")
+
+    elif args.comando == "profile":
+        profila(dati)
+
+    else:
+        falliti = valida(
+            dati,
+            carica_aggregati_snapshot(args.csv, args.cartella, args.compatto),
+            carica_citta_snapshot(args.csv, args.cartella, args.compatto)
+        )
+        for nome in falliti:
+            print(f"ERRORE: {nome}")
+        if falliti:
+            return 1
+        print("validazione superata")
+
+    return 0
 
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Serie temporali dei decessi a partire da una matrice densa di conteggi giornalieri.
+
+Con una sola passata sui dati (un group_by per giorno) si costruisce la matrice serie x giorni con le morti
+totali, per sesso e per droga, senza buchi: i giorni senza decessi valgono 0. Tutte le viste temporali
+vengono poi ricavate dalla matrice con operazioni vettorizzate numpy, senza rileggere il dataset:
+    - ricampionamento a settimana, mese, trimestre o anno (np.add.reduceat sui confini dei periodi)
+    - medie mobili (differenza di somme cumulate)
+    - variazione rispetto allo stesso periodo dell'anno precedente
+    - profilo stagionale (media giornaliera per mese, giorno della settimana o giorno dell'anno)
+    - curve cumulate, anche ripartendo da zero a ogni anno
+"""
+
+import numpy as np
+import polars as pl
+
+from memo import memoizza
+
+TOTALE = "Totale"
+SESSI = ["Male", "Female"]
+
+# granularità disponibili e periodi in un anno (per la variazione annua; la settimana è approssimata a 52)
+GRANULARITA = ["giorno", "settimana", "mese", "trimestre", "anno"]
+PERIODI_ANNO = {"giorno": 365, "settimana": 52, "mese": 12, "trimestre": 4, "anno": 1}
+
+# stagionalità disponibili per il profilo stagionale
+STAGIONALITA = ["mese", "giorno della settimana", "giorno dell'anno"]
+
+
+class SerieGiornaliere:
+    """
+    matrice densa dei conteggi giornalieri: una riga per serie (totale, sessi, droghe), una colonna per giorno
+    """
+
+    def __init__(self, inizio, conteggi, nomi):
+        self.giorni = inizio + np.arange(conteggi.shape[1]).astype("timedelta64[D]") # datetime64[D]
+        self.conteggi = conteggi
+        self.nomi = list(nomi)
+
+    @classmethod
+    def da_dati(cls, dati, colonne_droga):
+        """
+        costruisce la matrice dai dati (colonne Date, Sex e flag delle droghe) con un solo group_by per giorno
+        """
+        per_giorno = (
+            dati
+            .lazy()
+            .drop_nulls("Date")
+            .group_by(pl.col("Date").dt.date().cast(pl.Int32).alias("Giorno")) # giorni dal 1970-01-01
+            .agg(
+                [pl.len().alias(TOTALE)]
+                + [(pl.col("Sex") == sesso).sum().alias(sesso) for sesso in SESSI]
+                + [pl.col(droga).cast(pl.Int64).sum() for droga in colonne_droga]
+            )
+            .collect()
+        )
+        nomi = [TOTALE] + SESSI + list(colonne_droga)
+        if per_giorno.is_empty():
+            return cls(np.datetime64("1970-01-01", "D"), np.zeros((len(nomi), 0)), nomi)
+
+        giorno = per_giorno["Giorno"].to_numpy()
+        primo = giorno.min()
+        conteggi = np.zeros((len(nomi), giorno.max() - primo + 1))
+        conteggi[:, giorno - primo] = per_giorno.select(nomi).to_numpy().T
+        return cls(np.datetime64(int(primo), "D"), conteggi, nomi)
+
+    def _righe(self, serie):
+        serie = self.nomi if serie is None else list(serie)
+        return serie, self.conteggi[[self.nomi.index(s) for s in serie]]
+
+    def _periodi(self, granularita):
+        """
+        identificativo del periodo di ogni giorno (crescente) e data di inizio di ogni periodo
+        """
+        if granularita not in GRANULARITA:
+            raise ValueError(f"granularità non valida: {granularita} (disponibili: {GRANULARITA})")
+        giorni = self.giorni.astype(np.int64)
+        if granularita == "giorno":
+            return giorni, self.giorni
+        if granularita == "settimana":
+            # settimane da lunedì a domenica (il 1970-01-01 era un giovedì)
+            settimane = (giorni + 3) // 7
+            return settimane, (settimane * 7 - 3).astype("datetime64[D]")
+        mesi = self.giorni.astype("datetime64[M]").astype(np.int64)
+        if granularita == "mese":
+            return mesi, mesi.astype("datetime64[M]").astype("datetime64[D]")
+        if granularita == "trimestre":
+            return mesi // 3, (mesi // 3 * 3).astype("datetime64[M]").astype("datetime64[D]")
+        anni = self.giorni.astype("datetime64[Y]").astype(np.int64)
+        return anni, anni.astype("datetime64[Y]").astype("datetime64[D]")
+
+    def ricampiona(self, granularita = "giorno", serie = None):
+        """
+        conteggi per periodo: (date di inizio dei periodi, nomi delle serie, matrice serie x periodi)
+        """
+        serie, valori = self._righe(serie)
+        if valori.shape[1] == 0:
+            return self.giorni, serie, valori
+        periodi, inizi = self._periodi(granularita)
+        confini = np.concatenate([[0], np.flatnonzero(np.diff(periodi)) + 1])
+        return inizi[confini], serie, np.add.reduceat(valori, confini, axis = 1)
+
+    def media_mobile(self, finestra, granularita = "giorno", serie = None):
+        """
+        media mobile su finestra periodi (i primi finestra - 1 periodi non hanno un valore)
+        """
+        date, serie, valori = self.ricampiona(granularita, serie)
+        cumulate = np.concatenate([np.zeros((len(serie), 1)), np.cumsum(valori, axis = 1)], axis = 1)
+        medie = np.full(valori.shape, np.nan)
+        medie[:, finestra - 1:] = (cumulate[:, finestra:] - cumulate[:, :-finestra]) / finestra
+        return date, serie, medie
+
+    def variazione_annua(self, granularita = "mese", serie = None):
+        """
+        variazione percentuale rispetto allo stesso periodo dell'anno precedente
+        (non definita per il primo anno e quando l'anno precedente ha zero decessi)
+        """
+        date, serie, valori = self.ricampiona(granularita, serie)
+        passo = PERIODI_ANNO[granularita]
+        variazioni = np.full(valori.shape, np.nan)
+        precedenti = valori[:, :-passo]
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            variazioni[:, passo:] = np.where(precedenti > 0, (valori[:, passo:] - precedenti) / precedenti * 100, np.nan)
+        return date, serie, variazioni
+
+    def profilo_stagionale(self, stagionalita = "mese", serie = None):
+        """
+        media dei decessi giornalieri per mese, giorno della settimana o giorno dell'anno
+        (media per giorno, così i mesi di lunghezza diversa sono confrontabili): (etichette, nomi delle serie, matrice)
+        """
+        serie, valori = self._righe(serie)
+        if stagionalita == "mese":
+            chiave = (self.giorni.astype("datetime64[M]").astype(np.int64) % 12)
+            etichette = np.arange(1, 13)
+        elif stagionalita == "giorno della settimana":
+            chiave = (self.giorni.astype(np.int64) + 3) % 7 # 0 = lunedì
+            etichette = np.arange(1, 8)
+        elif stagionalita == "giorno dell'anno":
+            chiave = (self.giorni - self.giorni.astype("datetime64[Y]")).astype(np.int64)
+            etichette = np.arange(1, 367)
+        else:
+            raise ValueError(f"stagionalità non valida: {stagionalita} (disponibili: {STAGIONALITA})")
+
+        giorni_per_chiave = np.bincount(chiave, minlength = len(etichette))
+        somme = np.array([np.bincount(chiave, weights = riga, minlength = len(etichette)) for riga in valori]).reshape(len(serie), len(etichette))
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            return etichette, serie, somme / giorni_per_chiave
+
+    def cumulata(self, granularita = "giorno", serie = None, per_anno = False):
+        """
+        somma cumulata dei decessi; con per_anno = True riparte da zero all'inizio di ogni anno (year-to-date)
+        """
+        date, serie, valori = self.ricampiona(granularita, serie)
+        cumulate = np.cumsum(valori, axis = 1)
+        if per_anno and valori.shape[1]:
+            anni = date.astype("datetime64[Y]").astype(np.int64)
+            inizio_anno = np.concatenate([[0], np.flatnonzero(np.diff(anni)) + 1])
+            # per ogni periodo tolgo il cumulato fino alla fine dell'anno precedente
+            precedente = np.concatenate([np.zeros((len(serie), 1)), cumulate], axis = 1)[:, inizio_anno]
+            cumulate = cumulate - np.repeat(precedente, np.diff(np.append(inizio_anno, valori.shape[1])), axis = 1)
+        return date, serie, cumulate
+
+
+def in_tabella(etichette, serie, valori, nome_etichetta = "Data", nome_valore = "Valore"):
+    """
+    converte il risultato di una vista (etichette, nomi delle serie, matrice) in una tabella polars
+    in formato lungo (etichetta, Serie, valore), pronta per altair
+    """
+    return pl.DataFrame({
+        nome_etichetta: np.tile(etichette, len(serie)),
+        "Serie": np.repeat(serie, len(etichette)),
+        nome_valore: valori.ravel()
+    })
+
+
+@memoizza(maxsize = 16)
+def carica_serie(dati, colonne_droga):
+    """
+    matrice dei conteggi giornalieri dei dati (vista filtrata), costruita una volta per impronta dei dati
+    """
+    return SerieGiornaliere.da_dati(dati, colonne_droga)
@@ -0,0 +1,527 @@
+"""
+Piramide di tessere (tile) raster per le mappe, generata offline e servita come file statici.
+
+Ogni mappa folium arriva alla pagina come documento HTML completo: con i livelli GeoJSON ogni sessione riceve
+tutta la geometria e il server la ricostruisce a ogni esecuzione. I livelli che non dipendono dalla sessione
+vengono invece disegnati una volta per tutte come tessere PNG 256x256 nello schema z/x/y di Leaflet,
+per gli zoom da ZOOM_MIN a ZOOM_MAX:
+    - stato: contorno dello stato (mappa dell'introduzione)
+    - contee, cap: coropletiche dei morti per km² per contea e per area del CAP (vedi aree_cap.py)
+    - densita: stima della densità con il metodo del kernel (vedi densita.py)
+Ogni livello è un file MBTiles (SQLite, righe in ordine TMS) in cache/tessere, con nei metadati la versione
+dei dati da cui è stato disegnato, esportato anche come file {livello}/{z}/{x}/{y}.png in static/tessere:
+con enableStaticServing (vedi .streamlit/config.toml) è streamlit stesso a servirli a /app/static/tessere,
+quindi il browser scarica solo le tessere della porzione di mappa visibile e l'app non fa nessun calcolo
+geometrico per sessione. In alternativa le tessere possono arrivare da un server separato (python tessere.py serve,
+che legge i file MBTiles) all'indirizzo URL_TESSERE: deve essere raggiungibile dal browser di chi visita l'app,
+non solo dal server. L'app non avvia mai un server: senza nessuna delle due le mappe usano i livelli calcolati al momento.
+I livelli con i decessi sono disegnati sul dataset completo: con un filtro globale attivo, o se le tessere
+mancano o sono di una versione precedente, le mappe tornano ai livelli calcolati al momento.
+
+Generazione (MBTiles ed esportazione in static/tessere):  python tessere.py build
+Server separato (per esempio dietro un proxy, con URL_TESSERE nell'ambiente dell'app):  python tessere.py serve
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import branca.colormap
+import folium
+import numpy as np
+import streamlit as st
+from matplotlib import colormaps
+from matplotlib.colors import to_hex
+from PIL import Image, ImageDraw
+
+from aree_cap import morti_per_cap, morti_per_contea
+from cache_file import hash_file, scrivi_atomico
+from densita import StimaKDE, larghezza_banda, punti_filtrati
+from geometria import FILE_CONFINI, confini
+from memo import memoizza
+from preprocessing import CARTELLA_CACHE, versione_dataset
+
+CARTELLA_TESSERE = CARTELLA_CACHE / "tessere"
+
+# da incrementare quando cambia il disegno, così le tessere vecchie non vengono più usate
+VERSIONE_TESSERE = 1
+
+STRATI = ["stato", "contee", "cap", "densita"]
+
+# zoom della piramide (oltre ZOOM_MAX Leaflet ingrandisce le tessere dell'ultimo livello) e lato in pixel
+ZOOM_MIN = 6
+ZOOM_MAX = 12
+LATO = 256
+
+# cartella servita da streamlit a /app/static (accanto ad app.py) e sottocartella delle tessere esportate
+CARTELLA_STATICA = Path(__file__).resolve().parent / "static"
+CARTELLA_TESSERE_STATICHE = CARTELLA_STATICA / "tessere"
+
+# porta del server separato (python tessere.py serve) e indirizzo pubblico da cui il browser lo raggiunge
+# (senza URL_TESSERE le tessere vengono dai file statici di streamlit)
+PORTA_TESSERE = int(os.environ.get("PORTA_TESSERE", 8765))
+URL_TESSERE = os.environ.get("URL_TESSERE")
+
+# colori delle coropletiche e della densità, classi sui quantili delle aree con almeno un decesso
+SCALA_COLORI = "YlOrRd"
+QUANTILI_CLASSI = [0.25, 0.5, 0.75, 0.9]
+OPACITA = 0.7
+
+
+def _png(immagine):
+    buffer = io.BytesIO()
+    immagine.save(buffer, format = "PNG", optimize = True)
+    return buffer.getvalue()
+
+
+# servita al posto delle tessere che non ci sono (fuori dallo stato o vuote)
+TESSERA_VUOTA = _png(Image.new("RGBA", (LATO, LATO)))
+
+
+def pixel_mondo(longitudine, latitudine, zoom):
+    """
+    coordinate in pixel nel piano di Mercatore allo zoom (LATO * 2^zoom pixel per lato, origine in alto a sinistra)
+    """
+    n = LATO * 2 ** zoom
+    latitudine = np.radians(np.asarray(latitudine, dtype = np.float64))
+    x = (np.asarray(longitudine, dtype = np.float64) + 180) / 360 * n
+    y = (1 - np.log(np.tan(np.pi / 4 + latitudine / 2)) / np.pi) / 2 * n
+    return x, y
+
+
+def lonlat_pixel(x, y, zoom):
+    """
+    inversa di pixel_mondo: longitudine e latitudine dei pixel del piano di Mercatore allo zoom
+    """
+    n = LATO * 2 ** zoom
+    longitudine = np.asarray(x) / n * 360 - 180
+    latitudine = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y) / n))))
+    return longitudine, latitudine
+
+
+def limiti_tessera(zoom, x, y):
+    """
+    riquadro della tessera (lon min, lat min, lon max, lat max)
+    """
+    (lon_min, lon_max), (lat_max, lat_min) = lonlat_pixel(np.array([x, x + 1]) * LATO, np.array([y, y + 1]) * LATO, zoom)
+    return lon_min, lat_min, lon_max, lat_max
+
+
+def tessere_riquadro(riquadro, zoom):
+    """
+    indici (x, y) delle tessere dello zoom che coprono il riquadro (lon min, lat min, lon max, lat max)
+    """
+    lon_min, lat_min, lon_max, lat_max = riquadro
+    x, y = pixel_mondo([lon_min, lon_max], [lat_max, lat_min], zoom)
+    (x0, x1), (y0, y1) = (x // LATO).astype(int), (y // LATO).astype(int)
+    return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
+
+
+def _interseca(a, b):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def _aree(livello, zoom):
+    """
+    aree del livello semplificate per lo zoom (vedi geometria.py): lista di (proprietà, poligoni, riquadro)
+    """
+    aree = []
+    for area in json.loads(confini(livello, zoom, versione_dataset(compatto = True)))["features"]:
+        poligoni = [[np.asarray(anello) for anello in poligono] for poligono in area["geometry"]["coordinates"]]
+        if poligoni:
+            esterni = np.concatenate([poligono[0] for poligono in poligoni])
+            aree.append((area["properties"], poligoni, np.concatenate([esterni.min(axis = 0), esterni.max(axis = 0)])))
+    return aree
+
+
+def disegna_aree(aree, colori, zoom, x, y, bordo = None):
+    """
+    tessera con le aree riempite ciascuna del suo colore RGBA (None: area non riempita) e il contorno
+    di colore bordo (None: senza contorno); ogni area ha una sua maschera, così i buchi restano vuoti
+    """
+    tessera = Image.new("RGBA", (LATO, LATO))
+    riquadro = limiti_tessera(zoom, x, y)
+    visibili = [(poligoni, colore) for (_, poligoni, r), colore in zip(aree, colori) if _interseca(r, riquadro)]
+
+    def in_pixel(anello):
+        px, py = pixel_mondo(anello[:, 0], anello[:, 1], zoom)
+        return list(zip((px - x * LATO).tolist(), (py - y * LATO).tolist()))
+
+    for poligoni, colore in visibili:
+        if colore is None:
+            continue
+        maschera = Image.new("L", (LATO, LATO))
+        penna = ImageDraw.Draw(maschera)
+        for poligono in poligoni:
+            penna.polygon(in_pixel(poligono[0]), fill = 255)
+            for buco in poligono[1:]:
+                penna.polygon(in_pixel(buco), fill = 0)
+        tessera.paste(colore, (0, 0, LATO, LATO), maschera)
+
+    if bordo is not None:
+        penna = ImageDraw.Draw(tessera)
+        for poligoni, _ in visibili:
+            for anello in (anello for poligono in poligoni for anello in poligono):
+                penna.line(in_pixel(anello), fill = bordo, width = 1)
+    return tessera
+
+
+def disegna_densita(stima, massimo, zoom, x, y):
+    """
+    tessera della stima della densità (vedi StimaKDE) valutata nei centri dei pixel, con colore e opacità
+    crescenti con la densità relativa al massimo; sotto il 2% del massimo i pixel restano trasparenti
+    """
+    centri = np.arange(LATO) + 0.5
+    px, py = np.meshgrid(x * LATO + centri, y * LATO + centri)
+    longitudine, latitudine = lonlat_pixel(px.ravel(), py.ravel(), zoom)
+    relativa = np.clip(stima.valuta(longitudine, latitudine) / massimo, 0, 1).reshape(LATO, LATO)
+    rgba = (colormaps[SCALA_COLORI](relativa) * 255).astype(np.uint8)
+    rgba[..., 3] = np.where(relativa > 0.02, np.clip(relativa * 1.5, 0, 0.8) * 255, 0).astype(np.uint8)
+    return Image.fromarray(rgba)
+
+
+def classi_colori(valori):
+    """
+    colore RGBA di ogni valore (None per gli zeri, che restano trasparenti) con classi sui quantili dei valori
+    positivi, e legenda {"colori": esadecimali, "soglie": estremi delle classi}
+    """
+    valori = np.asarray(valori, dtype = np.float64)
+    positivi = valori[valori > 0]
+    if positivi.size == 0:
+        return [None] * len(valori), None
+    soglie = np.unique(np.concatenate([[0], np.quantile(positivi, QUANTILI_CLASSI), [positivi.max()]]))
+    if len(soglie) < 2:
+        soglie = np.array([0, positivi.max()])
+    scala = colormaps[SCALA_COLORI].resampled(len(soglie) - 1)
+    tavolozza = [scala(i) for i in range(len(soglie) - 1)]
+    classi = np.clip(np.searchsorted(soglie, valori, side = "right") - 1, 0, len(soglie) - 2)
+    colori = [
+        tuple(int(c * 255) for c in tavolozza[classe][:3]) + (int(OPACITA * 255),) if valore > 0 else None
+        for valore, classe in zip(valori, classi)
+    ]
+    return colori, {"colori": [to_hex(c) for c in tavolozza], "soglie": soglie.tolist()}
+
+
+@memoizza(maxsize = 1)
+def _hash_confini(sorgente = FILE_CONFINI):
+    return hash_file(sorgente)[:16]
+
+
+def versione_strato(livello):
+    """
+    versione dei dati da cui dipende il livello: disegno, file dei confini e (tranne per lo stato) dataset
+    """
+    parti = [str(VERSIONE_TESSERE), _hash_confini()]
+    if livello != "stato":
+        parti.append(versione_dataset(compatto = True))
+    return "-".join(parti)
+
+
+def _prepara(livello):
+    """
+    riquadro del livello, funzione (zoom, x, y) -> tessera e legenda (None se il livello non ne ha una)
+    """
+    if livello == "densita":
+        longitudine, latitudine, pesi = punti_filtrati((), versione_dataset(compatto = True))
+        stima = StimaKDE(longitudine, latitudine, larghezza_banda(longitudine, latitudine, pesi), pesi)
+        massimo = stima.densita.max()
+        riquadro = (stima.assi[0][0], stima.assi[1][0], stima.assi[0][-1], stima.assi[1][-1])
+        return riquadro, lambda zoom, x, y: disegna_densita(stima, massimo, zoom, x, y), None
+
+    if livello == "stato":
+        # come il livello GeoJSON dell'introduzione: rosso al 20% con il contorno rosso
+        legenda = None
+        colori = lambda aree: [(255, 0, 0, 51)] * len(aree)
+        bordo = (255, 0, 0, 255)
+    else:
+        versione = versione_dataset(compatto = True)
+        if livello == "cap":
+            tabella, chiave = morti_per_cap((), versione), "ZCTA5CE10"
+        else:
+            tabella, chiave = morti_per_contea((), versione), "Contea"
+        valori = dict(zip(tabella[chiave].to_list(), tabella["Morti per km2"].to_list()))
+        tavolozza, legenda = classi_colori(list(valori.values()))
+        colore = dict(zip(valori, tavolozza))
+        colori = lambda aree: [colore.get(proprieta[chiave]) for proprieta, _, _ in aree]
+        bordo = (80, 80, 80, 160)
+        if legenda is not None:
+            legenda["titolo"] = "Morti per km²"
+
+    per_zoom = {}
+
+    def disegna(zoom, x, y):
+        if zoom not in per_zoom:
+            aree = _aree(livello, zoom)
+            per_zoom[zoom] = (aree, colori(aree))
+        return disegna_aree(*per_zoom[zoom], zoom, x, y, bordo)
+
+    aree = _aree(livello, ZOOM_MIN)
+    riquadri = np.array([r for _, _, r in aree])
+    riquadro = (*riquadri[:, :2].min(axis = 0), *riquadri[:, 2:].max(axis = 0))
+    return riquadro, disegna, legenda
+
+
+def _percorso(livello, cartella = CARTELLA_TESSERE):
+    if livello not in STRATI:
+        raise ValueError(f"livello non valido: {livello} (disponibili: {STRATI})")
+    return Path(cartella) / f"{livello}.mbtiles"
+
+
+def _scrivi_mbtiles(percorso, tessere, metadati):
+    """
+    scrive un file MBTiles: tessere è un iterabile di (zoom, x, y, png), con la riga in ordine TMS (dal basso)
+    """
+    def scrivi(temporaneo):
+        temporaneo.unlink(missing_ok = True)
+        db = sqlite3.connect(temporaneo)
+        try:
+            db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+            db.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+            db.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+            db.executemany("INSERT INTO metadata VALUES (?, ?)", metadati.items())
+            db.executemany(
+                "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                ((zoom, x, 2 ** zoom - 1 - y, png) for zoom, x, y, png in tessere)
+            )
+            db.commit()
+        finally:
+            db.close()
+    scrivi_atomico(percorso, scrivi)
+
+
+def genera_strato(livello, cartella = CARTELLA_TESSERE, zoom_min = ZOOM_MIN, zoom_max = ZOOM_MAX):
+    """
+    disegna le tessere del livello per gli zoom da zoom_min a zoom_max (solo quelle che coprono il livello,
+    saltando quelle vuote) e le salva in cartella/{livello}.mbtiles; restituisce il numero di tessere scritte
+    """
+    percorso = _percorso(livello, cartella)
+    riquadro, disegna, legenda = _prepara(livello)
+    metadati = {
+        "name": livello,
+        "format": "png",
+        "type": "overlay",
+        "minzoom": str(zoom_min),
+        "maxzoom": str(zoom_max),
+        "bounds": ",".join(f"{v:.6f}" for v in riquadro),
+        "versione": versione_strato(livello)
+    }
+    if legenda is not None:
+        metadati["legenda"] = json.dumps(legenda)
+
+    scritte = 0
+
+    def tessere():
+        nonlocal scritte
+        for zoom in range(zoom_min, zoom_max + 1):
+            for x, y in tessere_riquadro(riquadro, zoom):
+                tessera = disegna(zoom, x, y)
+                if tessera.getchannel("A").getbbox() is not None:
+                    scritte += 1
+                    yield zoom, x, y, _png(tessera)
+
+    Path(cartella).mkdir(parents = True, exist_ok = True)
+    _scrivi_mbtiles(percorso, tessere(), metadati)
+    return scritte
+
+
+def metadati_strato(livello, cartella = CARTELLA_TESSERE):
+    """
+    metadati del file MBTiles del livello (dizionario vuoto se non esiste)
+    """
+    percorso = _percorso(livello, cartella)
+    if not percorso.exists():
+        return {}
+    db = sqlite3.connect(percorso.resolve().as_uri() + "?mode=ro", uri = True)
+    try:
+        return dict(db.execute("SELECT name, value FROM metadata").fetchall())
+    finally:
+        db.close()
+
+
+def leggi_tessera(livello, zoom, x, y, cartella = CARTELLA_TESSERE):
+    """
+    png della tessera z/x/y del livello (None se non c'è)
+    """
+    percorso = _percorso(livello, cartella)
+    if not percorso.exists():
+        return None
+    db = sqlite3.connect(percorso.resolve().as_uri() + "?mode=ro", uri = True)
+    try:
+        riga = db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, 2 ** zoom - 1 - y)
+        ).fetchone()
+    finally:
+        db.close()
+    return riga[0] if riga else None
+
+
+def esporta_strato(livello, cartella = CARTELLA_TESSERE, destinazione = CARTELLA_TESSERE_STATICHE):
+    """
+    esporta le tessere del file MBTiles del livello come destinazione/{livello}/{z}/{x}/{y}.png, con i metadati
+    in metadati.json; la cartella viene sostituita in un colpo solo, così streamlit non serve mai un'esportazione
+    a metà. Restituisce il numero di tessere esportate
+    """
+    finale = Path(destinazione) / livello
+    temporanea = finale.with_name(f".{livello}.tmp")
+    shutil.rmtree(temporanea, ignore_errors = True)
+    db = sqlite3.connect(_percorso(livello, cartella).resolve().as_uri() + "?mode=ro", uri = True)
+    try:
+        esportate = 0
+        for zoom, x, riga, png in db.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"):
+            file = temporanea / str(zoom) / str(x) / f"{2 ** zoom - 1 - riga}.png"
+            file.parent.mkdir(parents = True, exist_ok = True)
+            file.write_bytes(png)
+            esportate += 1
+        metadati = dict(db.execute("SELECT name, value FROM metadata").fetchall())
+    finally:
+        db.close()
+    (temporanea / "metadati.json").write_text(json.dumps(metadati), encoding = "utf-8")
+
+    vecchia = finale.with_name(f".{livello}.old")
+    shutil.rmtree(vecchia, ignore_errors = True)
+    if finale.exists():
+        finale.rename(vecchia)
+    temporanea.rename(finale)
+    shutil.rmtree(vecchia, ignore_errors = True)
+    return esportate
+
+
+def metadati_statici(livello, destinazione = CARTELLA_TESSERE_STATICHE):
+    """
+    metadati dell'esportazione statica del livello (dizionario vuoto se non esiste)
+    """
+    percorso = Path(destinazione) / livello / "metadati.json"
+    if not percorso.exists():
+        return {}
+    return json.loads(percorso.read_text(encoding = "utf-8"))
+
+
+class _GestoreTessere(BaseHTTPRequestHandler):
+    """
+    risponde a GET /{livello}/{z}/{x}/{y}.png con la tessera (trasparente se manca), leggendo da server.cartella
+    """
+
+    def do_GET(self):
+        parti = self.path.split("?")[0].strip("/").split("/")
+        try:
+            livello, zoom, x, y = parti[0], int(parti[1]), int(parti[2]), int(parti[3].removesuffix(".png"))
+        except (IndexError, ValueError):
+            self.send_error(404)
+            return
+        if len(parti) != 4 or livello not in STRATI or not 0 <= zoom <= 24:
+            self.send_error(404)
+            return
+
+        png = leggi_tessera(livello, zoom, x, y, self.server.cartella) or TESSERA_VUOTA
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(png)))
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(png)
+
+    def log_message(self, formato, *args):
+        pass # niente log per ogni tessera
+
+
+def crea_server(porta = PORTA_TESSERE, host = "localhost", cartella = CARTELLA_TESSERE):
+    """
+    server HTTP delle tessere per python tessere.py serve (da avviare con serve_forever, mai dall'app)
+    """
+    server = ThreadingHTTPServer((host, porta), _GestoreTessere)
+    server.daemon_threads = True
+    server.cartella = Path(cartella)
+    return server
+
+
+def sorgente_tessere(livello):
+    """
+    indirizzo base da cui il browser scarica le tessere del livello e i loro metadati, oppure None se non ci sono
+    tessere aggiornate: il server separato di URL_TESSERE se impostato (con i file MBTiles di cache/tessere),
+    altrimenti l'esportazione in static/tessere se streamlit serve i file statici
+    """
+    if URL_TESSERE is not None:
+        url, metadati = URL_TESSERE.rstrip("/"), metadati_strato(livello)
+    elif st.get_option("server.enableStaticServing"):
+        base = st.get_option("server.baseUrlPath").strip("/")
+        url, metadati = "/" + "/".join(p for p in [base, "app/static/tessere"] if p), metadati_statici(livello)
+    else:
+        return None
+    if metadati.get("versione") != versione_strato(livello):
+        return None
+    return url, metadati
+
+
+def strato_tessere(livello, nome, mostra = True):
+    """
+    TileLayer folium con le tessere del livello (vedi sorgente_tessere), oppure None se mancano o sono state
+    disegnate da dati diversi da quelli attuali: in quei casi la mappa usa i livelli calcolati al momento
+    """
+    sorgente = sorgente_tessere(livello)
+    if sorgente is None:
+        return None
+    url, metadati = sorgente
+    return folium.TileLayer(
+        tiles = f"{url}/{livello}/{{z}}/{{x}}/{{y}}.png",
+        attr = "tessere locali",
+        name = nome,
+        overlay = True,
+        control = True,
+        show = mostra,
+        max_native_zoom = int(metadati["maxzoom"]),
+        max_zoom = 18
+    )
+
+
+def legenda_strato(livello):
+    """
+    legenda a classi (branca) delle tessere del livello, None se il livello non ne ha una o le tessere mancano
+    """
+    sorgente = sorgente_tessere(livello)
+    legenda = sorgente[1].get("legenda") if sorgente is not None else None
+    if legenda is None:
+        return None
+    legenda = json.loads(legenda)
+    soglie = legenda["soglie"]
+    return branca.colormap.StepColormap(legenda["colori"], index = soglie, vmin = soglie[0], vmax = soglie[-1], caption = legenda["titolo"])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "piramide di tessere delle mappe: generazione, esportazione statica e server separato")
+    parser.add_argument("comando", choices = ["build", "serve"])
+    parser.add_argument("--strati", nargs = "+", choices = STRATI, default = STRATI, help = "livelli da disegnare (build)")
+    parser.add_argument("--zoom-min", type = int, default = ZOOM_MIN)
+    parser.add_argument("--zoom-max", type = int, default = ZOOM_MAX)
+    parser.add_argument("--cartella", default = CARTELLA_TESSERE, type = Path, help = "cartella dei file MBTiles")
+    parser.add_argument("--statica", default = CARTELLA_TESSERE_STATICHE, type = Path, help = "cartella dell'esportazione servita da streamlit (build)")
+    parser.add_argument("--porta", type = int, default = PORTA_TESSERE, help = "porta del server (serve)")
+    parser.add_argument("--host", default = "localhost", help = "indirizzo su cui ascolta il server (serve)")
+    args = parser.parse_args(argv)
+
+    if args.comando == "build":
+        for livello in args.strati:
+            scritte = genera_strato(livello, args.cartella, args.zoom_min, args.zoom_max)
+            esporta_strato(livello, args.cartella, args.statica)
+            dimensione = _percorso(livello, args.cartella).stat().st_size / 1024
+            print(f"{livello}: {scritte} tessere, {dimensione:.0f} KB, esportate in {args.statica / livello}")
+        return 0
+
+    server = crea_server(args.porta, args.host, args.cartella)
+    print(f"tessere da {args.cartella} su http://{args.host}:{args.porta}/{{livello}}/{{z}}/{{x}}/{{y}}.png")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
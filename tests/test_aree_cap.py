@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import polars as pl
+
+from aree_cap import cap_per_citta
+from citta import aggiorna_citta
+from geometria import FILE_CONFINI
+
+SORGENTE = str(Path(__file__).parents[1] / FILE_CONFINI)
+
+
+def test_geocodifica_generica_non_assegnata():
+    # la geocodifica generica dello stato ha coordinate valide ma né città né contea
+    grezzi = pl.LazyFrame({
+        "DeathCityGeo": ["Hartford, CT\n(41.765775, -72.673356)", "CT\n(41.575155, -72.738288)", "Nowhere, CT\n"],
+        "Death County": ["HARTFORD", None, None]
+    })
+    citta = aggiorna_citta(None, grezzi)
+    generica = citta.filter(pl.col("Citta").is_null() & pl.col("CoordinateValide"))
+    assert generica.height == 1
+
+    aree = dict(cap_per_citta(citta, SORGENTE).iter_rows())
+    assert set(aree) == set(citta["CityKey"])
+    assert aree[generica["CityKey"].item()] is None
+    assert aree[citta.filter(pl.col("Citta") == "Hartford")["CityKey"].item()].startswith("061")
+    assert aree[citta.filter(~pl.col("CoordinateValide"))["CityKey"].item()] is None
@@ -0,0 +1,54 @@
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from cubo import CUBI, aggrega, conta_droghe_per, costruisci_cubi, unisci_cubi
+from dimensioni import aggiungi_dimensioni
+
+DROGHE = ["Heroin", "Cocaine", "Fentanyl"]
+
+
+def _dati(righe = 20000):
+    # dataset sintetico con cardinalità simili a quelle reali (12 anni, 8 contee, 150 città, 10 luoghi)
+    rng = np.random.default_rng(0)
+    citta = rng.integers(0, 150, righe)
+    dati = pl.DataFrame({
+        "Year": rng.integers(2012, 2024, righe),
+        "Month": rng.integers(1, 13, righe),
+        "DayOfWeek": rng.integers(0, 7, righe),
+        "Sex": rng.choice(["Male", "Female", "Unknown"], righe, p = [0.72, 0.27, 0.01]),
+        "Race": rng.choice(["White", "Black", "Hispanic", "Asian", "Other", "Unknown"], righe),
+        "Death County": [f"Contea {c % 8}" for c in citta],
+        "Death City": [f"Città {c}" for c in citta],
+        "Location": rng.choice(["Residence", "Hospital", "Nursing Home", "Other"] + [f"Luogo {k}" for k in range(6)], righe),
+        "Age": rng.integers(15, 90, righe),
+        **{droga: rng.integers(0, 2, righe) for droga in DROGHE}
+    })
+    # le dimensioni testuali sono Categorical, come nello schema compatto dell'app
+    testuali = ["Sex", "Race", "Death County", "Death City", "Location"]
+    return aggiungi_dimensioni(dati.lazy()).with_columns(pl.col(testuali).cast(pl.Categorical)).collect()
+
+
+def test_cubi_molto_piu_piccoli_del_dataset():
+    dati = _dati()
+    cubi = costruisci_cubi(dati, DROGHE)
+    assert set(cubi) == set(CUBI)
+    assert sum(cubo.height for cubo in cubi.values()) < dati.height / 5
+
+
+def test_roll_up_come_group_by_sul_dataset():
+    dati = _dati()
+    vecchi, nuovi = dati.head(12000), dati.tail(dati.height - 12000)
+    cubi = unisci_cubi(costruisci_cubi(vecchi, DROGHE), costruisci_cubi(nuovi, DROGHE))
+    for per in [["Year", "Sex"], ["Month", "Sex"], ["DayOfWeek"], ["AgeBand"], ["Year", "Death City"], ["Location"]]:
+        atteso = dati.group_by(per).agg(pl.len().cast(pl.Int64).alias("Morti totali")).sort(per)
+        assert_frame_equal(aggrega(cubi, per).sort(per), atteso)
+
+    # LocationCategory non è nei cubi: viene ricavata da Location al momento della query
+    atteso = dati.group_by("LocationCategory").agg(pl.col(DROGHE).cast(pl.Int64).sum()).sort("LocationCategory")
+    calcolato = (
+        conta_droghe_per(cubi, "LocationCategory", DROGHE)
+        .pivot("Droga", index = "LocationCategory", values = "Conteggio")
+        .sort("LocationCategory")
+    )
+    assert_frame_equal(calcolato, atteso)
@@ -0,0 +1,30 @@
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from densita import StimaKDE, larghezza_banda
+
+
+def _citta():
+    # un punto per città pesato con il numero di morti, più i singoli decessi (punti ripetuti)
+    rng = np.random.default_rng(0)
+    longitudine = rng.normal(-72.7, 0.3, 60)
+    latitudine = 41.6 - 0.4 * (longitudine + 72.7) + rng.normal(0, 0.15, 60)
+    pesi = rng.integers(1, 80, 60).astype(np.float64)
+    decessi = np.repeat(np.vstack([longitudine, latitudine]), pesi.astype(int), axis = 1)
+    return longitudine, latitudine, pesi, decessi
+
+
+def test_banda_con_pesi_di_frequenza_come_gaussian_kde():
+    longitudine, latitudine, pesi, decessi = _citta()
+    np.testing.assert_allclose(
+        larghezza_banda(longitudine, latitudine, pesi, "scott"), gaussian_kde(decessi).covariance, rtol = 1e-10
+    )
+
+
+def test_densita_come_gaussian_kde():
+    longitudine, latitudine, pesi, decessi = _citta()
+    stima = StimaKDE(longitudine, latitudine, larghezza_banda(longitudine, latitudine, pesi), pesi)
+    esatta = gaussian_kde(decessi)(np.vstack([longitudine, latitudine]))
+    stimata = stima.valuta(longitudine, latitudine)
+    assert np.max(np.abs(stimata - esatta)) / esatta.max() < 0.01
+    assert np.corrcoef(stimata, esatta)[0, 1] > 0.999
@@ -0,0 +1,44 @@
+import csv
+
+from preprocessing import carica_snapshot, get_droghe, ingerisci_delta
+
+COLONNE = [
+    "Date", "Date Type", "Age", "Sex", "Race", "Ethnicity", "Residence City", "Residence County", "Residence State",
+    "Injury City", "Injury County", "Injury State", "Injury Place", "Description of Injury", "Death City",
+    "Death County", "Death State", "Location", "Location if Other", "Cause of Death", "Manner of Death",
+    "Other Significant Conditions", *get_droghe(), "ResidenceCityGeo", "InjuryCityGeo", "DeathCityGeo"
+]
+
+
+def _scrivi_csv(percorso, righe):
+    # righe: (data, età, città); le altre colonne restano vuote o con valori fissi
+    with open(percorso, "w", newline = "") as file:
+        scrittore = csv.writer(file)
+        scrittore.writerow(COLONNE)
+        for data, eta, citta in righe:
+            riga = dict.fromkeys(COLONNE, "")
+            riga.update({
+                "Date": data, "Date Type": "DateofDeath", "Age": str(eta), "Sex": "Male", "Race": "White",
+                "Death City": citta, "Death County": "Hartford", "Location": "Residence", "Fentanyl": "Y",
+                "DeathCityGeo": f"{citta}, CT\n(41.765775, -72.673356)"
+            })
+            scrittore.writerow([riga[c] for c in COLONNE])
+
+
+def test_delta_con_record_tardivo_dello_stesso_giorno(tmp_path):
+    base = [("01/10/2020", 30, "Hartford"), ("01/12/2020", 41, "Hartford"), ("01/12/2020", 52, "Hartford")]
+    _scrivi_csv(tmp_path / "base.csv", base)
+    carica_snapshot(tmp_path / "base.csv", tmp_path / "cache")
+
+    # il delta ripete i record già presenti dell'ultimo giorno e ne aggiunge uno arrivato in ritardo per lo stesso giorno,
+    # uno identico a un record già presente (secondo decesso uguale) e uno del giorno dopo
+    delta = base[1:] + [("01/12/2020", 63, "Hartford"), ("01/12/2020", 41, "Hartford"), ("01/13/2020", 25, "Hartford")]
+    _scrivi_csv(tmp_path / "delta.csv", delta)
+    assert ingerisci_delta(tmp_path / "delta.csv", tmp_path / "base.csv", tmp_path / "cache") == 3
+
+    dati = carica_snapshot(tmp_path / "base.csv", tmp_path / "cache")
+    assert sorted(dati["Age"].to_list()) == [25, 30, 41, 41, 52, 63]
+
+    # lo stesso delta di nuovo, con un altro nome ma lo stesso contenuto più una riga: solo la riga nuova viene aggiunta
+    _scrivi_csv(tmp_path / "delta2.csv", delta + [("01/13/2020", 70, "Hartford")])
+    assert ingerisci_delta(tmp_path / "delta2.csv", tmp_path / "base.csv", tmp_path / "cache") == 1